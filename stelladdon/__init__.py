@@ -3,3 +3,17 @@ from .routing import *
 from .services import *
 from .database import *
 from .errors import *
+from .loading import *
+from .writebehind import *
+from .caching import *
+from .sharedcache import *
+from .admission import *
+from .coalescing import *
+from .profiling import *
+from .allocations import *
+from .columns import *
+from .memory import *
+from .sharding import *
+from .warmup import *
+from .changes import *
+from .ingestion import *
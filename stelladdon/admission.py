@@ -0,0 +1,205 @@
+from typing import Any, AsyncIterator, TYPE_CHECKING
+from asyncio import Future, get_running_loop, wait
+from heapq import heappush, heappop
+from itertools import count
+
+from fastapi.responses import StreamingResponse
+
+from .errors import Overloaded
+
+if TYPE_CHECKING:
+    from .routing import Context
+
+
+__all__ = [
+    "AdmissionLimit", "AdmissionController", "AdmissionStats"
+]
+
+
+
+class AdmissionLimit:
+    """The admission options of a route or a router, to give to `StellaRouter.route(admission=...)`
+    or `StellaRouter(admission=...)`."""
+    max_concurrency: int
+    """The number of requests that can be handled at the same time."""
+    max_queue: int
+    """The number of requests that can wait for a slot, the next ones are rejected right away."""
+    queue_timeout: float
+    """The maximum time in seconds a request waits in the queue before being rejected."""
+    retry_after: int
+    """The value of the `Retry-After` header of the rejected requests, in seconds."""
+
+    def __init__(self,
+                 max_concurrency: int,
+                 max_queue: int = 0,
+                 queue_timeout: float = 1.0,
+                 retry_after: int = 1) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+
+
+class AdmissionStats:
+    """The admission metrics of a route or a router."""
+    active: int
+    """The number of requests being handled."""
+    queued: int
+    """The number of requests waiting for a slot."""
+    max_queued: int
+    """The highest queue depth seen."""
+    admitted: int
+    """The number of requests that got a slot."""
+    shed: int
+    """The number of requests rejected because the queue was full."""
+    timed_out: int
+    """The number of requests rejected because they waited too long in the queue."""
+
+    def __init__(self) -> None:
+        self.active = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+
+
+    def as_dict(self) -> dict[str, int]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "maxQueued": self.max_queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timedOut": self.timed_out,
+        }
+
+
+
+class AdmissionController:
+    """Limit the number of concurrent requests, with a bounded priority queue for the ones waiting.
+    When the queue is full, a request with a higher priority takes the place of the lowest one."""
+    limit: AdmissionLimit
+    """The limits applied by the controller."""
+    stats: AdmissionStats
+    """The admission metrics."""
+
+    def __init__(self, limit: AdmissionLimit) -> None:
+        self.limit = limit
+        self.stats = AdmissionStats()
+        self._waiters: list[tuple[int, int, Future]] = []
+        self._order = count()
+
+
+    async def acquire(self, ctx: "Context", priority: int = 0) -> None:
+        """Wait for a slot, or raise `Overloaded` if the request is shed."""
+        stats = self.stats
+        if stats.active < self.limit.max_concurrency and not stats.queued:
+            stats.active += 1
+            stats.admitted += 1
+            return
+
+        if stats.queued >= self.limit.max_queue:
+            if not self._evict_lower_than(priority):
+                stats.shed += 1
+                raise Overloaded(ctx, self.limit.retry_after)
+
+        future = get_running_loop().create_future()
+        heappush(self._waiters, (-priority, next(self._order), future))
+        stats.queued += 1
+        stats.max_queued = max(stats.max_queued, stats.queued)
+
+        try:
+            await wait((future,), timeout=self.limit.queue_timeout)
+        except BaseException:
+            # the request has been cancelled while waiting, don't leak its slot
+            if not future.done():
+                future.cancel()
+                stats.queued -= 1
+            elif future.exception() is None:
+                self.release()
+            raise
+
+        if not future.done():
+            # the slot is still not given, leave the queue
+            future.cancel()
+            stats.queued -= 1
+            stats.timed_out += 1
+            raise Overloaded(ctx, self.limit.retry_after)
+
+        if future.exception() is not None:
+            raise Overloaded(ctx, self.limit.retry_after)
+        stats.admitted += 1
+
+
+    def release(self) -> None:
+        """Give the slot to the next waiting request, or free it."""
+        while self._waiters:
+            _, _, future = heappop(self._waiters)
+            if not future.done():
+                self.stats.queued -= 1
+                future.set_result(None)
+                return
+        self.stats.active -= 1
+
+
+    def _evict_lower_than(self, priority: int) -> bool:
+        waiting = [waiter for waiter in self._waiters if not waiter[2].done()]
+        if not waiting:
+            return False
+
+        lowest = max(waiting, key=lambda waiter: (waiter[0], waiter[1]))
+        if -lowest[0] >= priority:
+            return False
+
+        future = lowest[2]
+        self.stats.queued -= 1
+        self.stats.shed += 1
+        future.set_exception(_Evicted())
+        return True
+
+
+
+class _Evicted(Exception):
+    pass
+
+
+
+class _StreamRelease:
+    """Keep the admission slots of a request until its streamed body has been sent or abandoned,
+    the handler has returned before the body is produced."""
+
+    def __init__(self, controllers: list[AdmissionController], background: Any) -> None:
+        self.controllers = controllers
+        self.background = background
+        self.released = False
+
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        for controller in self.controllers:
+            controller.release()
+
+
+    async def wrap(self, body: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            self.release()
+
+
+    async def __call__(self) -> None:
+        # run as the background task of the response, if the body has never been iterated
+        self.release()
+        if self.background is not None:
+            await self.background()
+
+
+def _release_after_stream(response: StreamingResponse, controllers: list[AdmissionController]) -> None:
+    release = _StreamRelease(controllers, response.background)
+    response.body_iterator = release.wrap(response.body_iterator)
+    response.background = release
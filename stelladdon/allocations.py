@@ -0,0 +1,198 @@
+from typing import Any, Awaitable, Callable, TYPE_CHECKING
+from collections import Counter
+from random import random
+from threading import Lock
+import hmac
+import tracemalloc
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+if TYPE_CHECKING:
+    from .routing import Context
+
+
+__all__ = [
+    "AllocationProfiler", "RouteAllocations"
+]
+
+
+ADMIN_HEADER = "x-stella-admin"
+SNAPSHOT_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+
+
+
+class RouteAllocations:
+    """The allocations of the sampled requests of a route, by phase and by allocation site."""
+    samples: int
+    """The number of sampled requests."""
+    peak_bytes: Counter[str]
+    """The sum over the samples of the memory peak of each phase, above the memory at the start of the phase."""
+    max_peak_bytes: Counter[str]
+    """The highest memory peak of each phase."""
+    retained_bytes: Counter[str]
+    """The sum over the samples of the memory still allocated at the end of each phase."""
+    sites: Counter[tuple[str, str]]
+    """The sum over the samples of the bytes allocated and still alive at the end of a phase, by (phase, site)."""
+
+    def __init__(self) -> None:
+        self.samples = 0
+        self.peak_bytes: Counter[str] = Counter()
+        self.max_peak_bytes: Counter[str] = Counter()
+        self.retained_bytes: Counter[str] = Counter()
+        self.sites: Counter[tuple[str, str]] = Counter()
+
+
+    def as_dict(self, top: int = 10) -> dict[str, Any]:
+        samples = self.samples or 1
+        return {
+            "samples": self.samples,
+            "retained_bytes": sum(self.retained_bytes.values()) // samples,
+            "phases": {
+                phase: {
+                    "peak_bytes": self.peak_bytes[phase] // samples,
+                    "max_peak_bytes": self.max_peak_bytes[phase],
+                    "retained_bytes": self.retained_bytes[phase] // samples,
+                }
+                for phase in self.peak_bytes
+            },
+            "top": [
+                {"phase": phase, "site": site, "bytes": size // samples}
+                for (phase, site), size in self.sites.most_common(top)
+            ],
+        }
+
+
+
+class _Sample:
+
+    def __init__(self, ctx: "Context") -> None:
+        self.ctx = ctx
+        self.phases: list[tuple[str, int, int]] = []
+        self.sites: Counter[tuple[str, str]] = Counter()
+        self._snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        self._start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+
+    def end_phase(self, phase: str) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        for stat in snapshot.compare_to(self._snapshot, "lineno"):
+            if stat.size_diff > 0:
+                frame = stat.traceback[0]
+                self.sites[(phase, f"{frame.filename}:{frame.lineno}")] += stat.size_diff
+
+        self.phases.append((phase, max(peak - self._start, 0), current - self._start))
+        # the memory of the snapshots is measured in the start of the next phase, not in its allocations
+        self._snapshot = snapshot
+        self._start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+
+
+class AllocationProfiler:
+    """Trace the memory allocations of sampled requests with tracemalloc, and attribute their peak and retained bytes
+    to the route and the phase (arguments, services, handler, encoding...) that allocated them.
+    The tracing is only enabled while a sampled request runs, and one request is sampled at a time,
+    so the overhead is bounded by the sampling rate. The allocations of the requests running concurrently
+    are included in the sample."""
+    rate: float
+    """The default sampling rate of the routes."""
+    rates: dict[str, float]
+    """The sampling rate of the routes, by route path."""
+    frames: int
+    """The number of frames stored by tracemalloc for each allocation."""
+
+    def __init__(self,
+                 rate: float = 0.01,
+                 rates: dict[str, float] | None = None,
+                 frames: int = 1,
+                 secret: str | None = None) -> None:
+        self.rate = rate
+        self.rates = rates or {}
+        self.frames = frames
+        self.routes: dict[str, RouteAllocations] = {}
+        self._secret = secret
+        self._armed: dict[str, int] = {}
+        self._lock = Lock()
+        self._sampling = False
+
+
+    def arm(self, path: str, count: int = 1) -> None:
+        """Sample the next `count` requests of the route with this path."""
+        self._armed[path] = self._armed.get(path, 0) + count
+
+
+    def should_sample(self, ctx: "Context") -> bool:
+        if self._sampling:
+            return False
+
+        path = ctx.route.faroute.path
+        if self._armed.get(path):
+            self._armed[path] -= 1
+            return True
+        return random() < self.rates.get(path, self.rate)
+
+
+    async def run(self, ctx: "Context", call: Callable[["Context"], Awaitable[Any]]) -> Any:
+        """Run a request while tracing its allocations, then add them to the statistics of its route."""
+        with self._lock:
+            if self._sampling:
+                return await call(ctx)
+            self._sampling = True
+
+        # tracemalloc may have been started by someone else, then it is left running
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(self.frames)
+
+        try:
+            sample = _Sample(ctx)
+            ctx.phase_listener = lambda ctx, phase: sample.end_phase(ctx.phase)
+            try:
+                return await call(ctx)
+            finally:
+                ctx.phase_listener = None
+                sample.end_phase(ctx.phase)
+                self._record(ctx.route.faroute.path, sample)
+        finally:
+            if started:
+                tracemalloc.stop()
+            self._sampling = False
+
+
+    def reset(self) -> None:
+        """Forget the statistics of all the routes."""
+        self.routes = {}
+
+
+    def as_dict(self, top: int = 10) -> dict[str, Any]:
+        """The statistics of all the sampled routes, with their `top` allocation sites."""
+        return {path: allocations.as_dict(top) for path, allocations in self.routes.items()}
+
+
+    async def endpoint(self, req: Request) -> JSONResponse:
+        """The admin endpoint listing the allocations of the routes, protected by the `X-Stella-Admin` header.
+        It always answers 403 if the profiler has no secret. The `top` query parameter sets the number
+        of allocation sites per route."""
+        if self._secret is None or not hmac.compare_digest(
+                req.headers.get(ADMIN_HEADER, "").encode(), self._secret.encode()):
+            return JSONResponse({"error": "stellapi.forbidden", "statusCode": 403,
+                                 "message": "A valid admin secret is required."}, status_code=403)
+
+        top = req.query_params.get("top", "10")
+        return JSONResponse(self.as_dict(int(top) if top.isdigit() else 10))
+
+
+    def _record(self, path: str, sample: _Sample) -> None:
+        allocations = self.routes.get(path)
+        if allocations is None:
+            allocations = self.routes[path] = RouteAllocations()
+
+        allocations.samples += 1
+        for phase, peak, retained in sample.phases:
+            allocations.peak_bytes[phase] += peak
+            allocations.max_peak_bytes[phase] = max(allocations.max_peak_bytes[phase], peak)
+            allocations.retained_bytes[phase] += retained
+        allocations.sites.update(sample.sites)
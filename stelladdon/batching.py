@@ -0,0 +1,217 @@
+from typing import Any, TYPE_CHECKING
+from asyncio import Event, Future, gather, get_running_loop, shield
+from json import loads, dumps
+from urllib.parse import urlsplit
+import logging
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response
+from starlette.exceptions import HTTPException
+from starlette.routing import Match
+
+from .errors import StellaAPIError, NoWaitResponse
+from .core import run_with_context
+
+if TYPE_CHECKING:
+    from .routing import Context, StellAppMaster
+    from .services import Service
+    from .loading import TableLoader
+
+
+__all__ = [
+    "BatchContext", "BatchDispatcher"
+]
+
+
+BATCH_SCOPE_KEY = "stella.batch"
+
+logger = logging.getLogger(__name__)
+
+
+
+class BatchContext:
+    """The state shared by the sub-requests of a batch: the results of the batch-safe services
+    and the identity map of the objects read from the tables."""
+
+    def __init__(self) -> None:
+        self.loaders: dict[int, "TableLoader"] = {}
+        self.identity_map: dict[tuple[int, str, Any], Any] = {}
+        self._services: dict[tuple, Future] = {}
+
+
+    async def run_service_once(self, service: "Service", arguments: dict[str, Any], ctx: "Context") -> None:
+        """Run the before function of a batch-safe service for the first sub-request only,
+        and give the states and arguments it set to the other sub-requests with the same headers."""
+        key = (id(service), tuple(ctx.req.headers.raw))
+        future = self._services.get(key)
+        if future is not None:
+            states, injected = await shield(future)
+            ctx.states.update(states)
+            ctx.arguments.update(injected)
+            return
+
+        future = self._services[key] = get_running_loop().create_future()
+        states_before = dict(ctx.states)
+        arguments_before = dict(ctx.arguments)
+        try:
+            await run_with_context(service.before_fn, arguments, ctx)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+
+        future.set_result((
+            {name: value for name, value in ctx.states.items()
+             if name not in states_before or states_before[name] is not value},
+            {name: value for name, value in ctx.arguments.items()
+             if name not in arguments_before or arguments_before[name] is not value},
+        ))
+
+
+
+class BatchDispatcher:
+    """Execute the sub-requests of a batch request concurrently and in-process on the matching routes."""
+    max_requests: int
+    """The maximum number of sub-requests in a batch."""
+
+    def __init__(self, master: "StellAppMaster", max_requests: int = 20) -> None:
+        self.master = master
+        self.max_requests = max_requests
+
+
+    async def __call__(self, req: Request) -> Response:
+        try:
+            items = (await req.json())["requests"]
+            if not isinstance(items, list):
+                raise TypeError
+        except Exception:
+            return self._json_response({"error": "stellapi.batch.invalid", "statusCode": 400,
+                                        "message": "The body must be an object with a list of requests."}, 400)
+
+        if len(items) > self.max_requests:
+            return self._json_response({"error": "stellapi.batch.too_large", "statusCode": 413,
+                                        "message": f"A batch can't have more than {self.max_requests} requests."}, 413)
+
+        batch = BatchContext()
+        responses = await gather(*(self.dispatch(req, item, batch) for item in items))
+        return self._json_response({"responses": responses}, 200)
+
+
+    async def dispatch(self, parent: Request, item: dict[str, Any], batch: BatchContext) -> dict[str, Any]:
+        """Run one sub-request and build its item of the batch response."""
+        from .routing import Route
+
+        method = str(item.get("method", "GET")).upper()
+        url = urlsplit(str(item.get("path", "/")))
+        body = b"" if item.get("body") is None else dumps(item["body"]).encode()
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in parent.headers.raw
+                   if key.lower() not in (b"content-length", b"content-type")}
+        headers.update({key.lower(): str(value) for key, value in (item.get("headers") or {}).items()})
+        if body:
+            headers["content-type"] = "application/json"
+            headers["content-length"] = str(len(body))
+
+        scope = {
+            "type": "http",
+            "asgi": parent.scope.get("asgi", {}),
+            "http_version": parent.scope.get("http_version", "1.1"),
+            "method": method,
+            "scheme": parent.scope.get("scheme", "http"),
+            "server": parent.scope.get("server"),
+            "client": parent.scope.get("client"),
+            "root_path": parent.scope.get("root_path", ""),
+            "path": url.path,
+            "raw_path": url.path.encode(),
+            "query_string": url.query.encode(),
+            "headers": [(key.encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()],
+            "app": parent.scope.get("app"),
+            BATCH_SCOPE_KEY: batch,
+        }
+
+        for faroute in self.master.app.router.routes:
+            route = getattr(getattr(faroute, "endpoint", None), "__self__", None)
+            if not isinstance(route, Route):
+                continue
+            match, child_scope = faroute.matches(scope)
+            if match == Match.FULL:
+                scope.update(child_scope)
+                break
+        else:
+            return {"status": 404, "body": {"error": "stellapi.route.notfound", "statusCode": 404,
+                                            "message": f"No route matches {method} {url.path}."}}
+
+        sent = False
+
+        async def receive() -> dict[str, Any]:
+            nonlocal sent
+            if sent:
+                # the sub-request stays connected until the batch is answered
+                await Event().wait()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        try:
+            response = await route(Request(scope, receive))
+        except StellaAPIError as e:
+            return {"status": e.status_code, "body": e.data}
+        except NoWaitResponse as e:
+            response = e.ctx.route.encode_response(e.response)
+        except RequestValidationError as e:
+            return {"status": 422, "body": {"detail": jsonable_encoder(e.errors())}}
+        except HTTPException as e:
+            item = {"status": e.status_code, "body": {"detail": e.detail}}
+            if e.headers:
+                item["headers"] = dict(e.headers)
+            return item
+        except Exception:
+            # the message of an unexpected error may reveal internal details, it's only logged
+            logger.exception("The batched request %s %s failed.", method, url.path)
+            return {"status": 500, "body": {"error": "stellapi.internal_error", "statusCode": 500,
+                                            "message": "An internal error occurred."}}
+
+        if not isinstance(response, Response):
+            return {"status": 200, "body": jsonable_encoder(response)}
+
+        try:
+            item = await self._read_response(response)
+        except Exception:
+            logger.exception("The response of the batched request %s %s can't be read.", method, url.path)
+            return {"status": 500, "body": {"error": "stellapi.internal_error", "statusCode": 500,
+                                            "message": "An internal error occurred."}}
+        if response.background is not None:
+            # like Starlette, the background tasks run once the body is sent, they can't change the response
+            try:
+                await response.background()
+            except Exception:
+                logger.exception("The background tasks of the batched request %s %s failed.", method, url.path)
+        return item
+
+
+    async def _read_response(self, response: Response) -> dict[str, Any]:
+        if hasattr(response, "body_iterator"):
+            chunks = [chunk if isinstance(chunk, bytes) else chunk.encode() async for chunk in response.body_iterator]
+            content = b"".join(chunks)
+        else:
+            content = response.body
+
+        item: dict[str, Any] = {"status": response.status_code}
+        if "etag" in response.headers:
+            item["headers"] = {"ETag": response.headers["etag"]}
+
+        media_type = response.media_type or ""
+        if not content:
+            item["body"] = None
+        elif media_type.endswith("json"):
+            item["body"] = loads(content)
+        elif media_type == "application/x-ndjson":
+            item["body"] = [loads(line) for line in content.splitlines() if line]
+        else:
+            item["body"] = content.decode(errors="replace")
+        return item
+
+
+    def _json_response(self, content: Any, status_code: int) -> Response:
+        return Response(dumps(content), status_code=status_code, media_type="application/json")
@@ -0,0 +1,260 @@
+from typing import Any, Awaitable, Callable, Iterator, TYPE_CHECKING
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import blake2b
+from threading import Lock
+from time import monotonic
+
+from fastapi.responses import JSONResponse, Response
+
+if TYPE_CHECKING:
+    from .database import Table
+    from .routing import Context
+
+
+__all__ = [
+    "RouteCache", "ResponseStore", "CachedResponse"
+]
+
+
+ANY_OBJECT = object()
+"""The tag of the entries built from queries that may match any object of a table."""
+
+_tracked_reads: ContextVar[set | None] = ContextVar("stelladdon_tracked_reads", default=None)
+
+
+
+def record_read(table: "Table", ids: list[Any] | None) -> None:
+    """Record that the objects of a table have been read while building a cached response.
+    Pass None as ids when the read was a query that may match any object."""
+    tags = _tracked_reads.get()
+    if tags is None:
+        return
+
+    if ids is None:
+        tags.add((table, ANY_OBJECT))
+    else:
+        for id in ids:
+            tags.add((table, id))
+
+
+@contextmanager
+def recording_reads(tags: set[tuple["Table", Any]]) -> Iterator[None]:
+    """Add to `tags` the table objects read in the block, see `record_read()`."""
+    token = _tracked_reads.set(tags)
+    try:
+        yield
+    finally:
+        _tracked_reads.reset(token)
+
+
+
+def request_key(ctx: "Context",
+                query_params: list[str] | None,
+                headers: list[str]) -> tuple:
+    """Build a key identifying the requests of a route that should get the same response,
+    from their path parameters, the selected query parameters (all if None) and the selected headers."""
+    req = ctx.req
+    if query_params is None:
+        query = tuple(sorted(req.query_params.multi_items()))
+    else:
+        query = tuple((name, tuple(req.query_params.getlist(name))) for name in query_params)
+
+    return (
+        id(ctx.route),
+        tuple(sorted(req.path_params.items())),
+        query,
+        tuple(req.headers.get(header) for header in headers),
+    )
+
+
+
+class RouteCache:
+    """The cache options of a route, to give to `StellaRouter.route(cache=...)`."""
+    ttl: float
+    """The time in seconds a response stays in the cache."""
+    query_params: list[str] | None
+    """The query parameters that are part of the cache key, all of them if None."""
+    headers: list[str]
+    """The request headers that are part of the cache key."""
+
+    def __init__(self,
+                 ttl: float = 60.0,
+                 query_params: list[str] | None = None,
+                 headers: list[str] | None = None) -> None:
+        self.ttl = ttl
+        self.query_params = query_params
+        self.headers = [header.lower() for header in headers or []]
+
+
+    def key_of(self, ctx: "Context") -> tuple:
+        """Build the cache key of a request."""
+        return request_key(ctx, self.query_params, self.headers)
+
+
+
+class CachedResponse:
+
+    def __init__(self,
+                 body: bytes,
+                 status_code: int,
+                 media_type: str,
+                 expires: float,
+                 tags: set[tuple["Table", Any]]) -> None:
+        self.body = body
+        self.status_code = status_code
+        self.media_type = media_type
+        self.expires = expires
+        self.tags = tags
+        self.etag = '"%s"' % blake2b(body, digest_size=16).hexdigest()
+
+
+    def matches(self, if_none_match: str | None) -> bool:
+        """Check if the `If-None-Match` header of a request matches the ETag of the response."""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return any(tag.strip().removeprefix("W/") == self.etag for tag in if_none_match.split(","))
+
+
+    def to_response(self, if_none_match: str | None) -> Response:
+        headers = {"ETag": self.etag}
+        if self.matches(if_none_match):
+            return Response(status_code=304, headers=headers)
+        return Response(self.body, status_code=self.status_code, media_type=self.media_type, headers=headers)
+
+
+
+class ResponseStore:
+    """A bounded in-process store of the encoded responses of the cached routes.
+    The entries are tagged with the table objects read while building them,
+    and are invalidated when these objects are written through their table."""
+    max_entries: int
+    """The maximum number of responses kept, the least recently used are evicted first."""
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self._tags: dict["Table", dict[Any, set[tuple]]] = {}
+        self._writes = 0
+        self._last_writes: dict["Table", int] = {}
+        self._lock = Lock()
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+    def get(self, key: tuple) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry.expires <= monotonic():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return entry
+
+
+    def begin(self) -> int:
+        """Get the write counter to give to `.put()` for an entry built from now."""
+        with self._lock:
+            return self._writes + 1
+
+
+    def put(self, key: tuple, entry: CachedResponse, started_at: int) -> None:
+        """Store an entry built since the `started_at` write counter,
+        unless one of the tables it read has been written since."""
+        with self._lock:
+            for table, _ in entry.tags:
+                if self._last_writes.get(table, -1) >= started_at:
+                    return
+
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = entry
+            for table, id in entry.tags:
+                if table not in self._tags:
+                    self._tags[table] = {}
+                    table.write_hooks.append(self.invalidate)
+                self._tags[table].setdefault(id, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+
+    def invalidate(self, table: "Table", id: Any | None) -> None:
+        """Remove the entries that depend on an object of a table, or on the whole table if id is None."""
+        with self._lock:
+            self._writes += 1
+            self._last_writes[table] = self._writes
+
+            table_tags = self._tags.get(table)
+            if not table_tags:
+                return
+
+            if id is None:
+                keys = set().union(*table_tags.values())
+            else:
+                keys = table_tags.get(id, set()) | table_tags.get(ANY_OBJECT, set())
+
+            for key in keys:
+                self._remove(key)
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            for table_tags in self._tags.values():
+                table_tags.clear()
+
+
+    async def respond(self,
+                      ctx: "Context",
+                      options: RouteCache,
+                      handler: Callable[["Context"], Awaitable[Any]],
+                      started_at: int | None = None,
+                      tags: set[tuple["Table", Any]] | None = None) -> Any:
+        """Answer a request from the cache, or run the handler and cache its encoded response.
+        The reads done before (like the arguments loaded from the tables) are given with the `started_at`
+        write counter and their `tags`."""
+        key = options.key_of(ctx)
+        if_none_match = ctx.req.headers.get("if-none-match")
+
+        entry = self.get(key)
+        if entry is not None:
+            return entry.to_response(if_none_match)
+
+        if started_at is None:
+            started_at = self.begin()
+        tags = set() if tags is None else tags
+        with recording_reads(tags):
+            response = await handler(ctx)
+
+        if isinstance(response, Response) or ctx.error is not None or ctx.coalesced:
+            # a coalesced response has been built by another request, its reads are unknown
+            return response
+
+        body = JSONResponse(response).body
+        entry = CachedResponse(body, 200, "application/json", monotonic() + options.ttl, tags)
+        self.put(key, entry, started_at)
+        return entry.to_response(if_none_match)
+
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        for table, id in entry.tags:
+            keys = self._tags.get(table, {}).get(id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[table][id]
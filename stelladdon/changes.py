@@ -0,0 +1,367 @@
+from typing import Any, Iterable, Iterator, TYPE_CHECKING
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from time import monotonic, time, time_ns
+
+from pydantic import BaseModel
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+
+from .errors import StelladdonError, InvalidSyncToken, ExpiredSyncToken
+
+if TYPE_CHECKING:
+    from .database import Table
+
+
+__all__ = [
+    "VersionStamps", "ChangeSet", "Tombstone"
+]
+
+
+SEQUENCES_COLLECTION = "stelladdon_sequences"
+CLOCKS = ("sequence", "time")
+RETENTION = 30 * 24 * 3600.0
+PRUNE_INTERVAL = 3600.0
+
+
+
+class Tombstone(BaseModel):
+    """The record of an object removed from a versioned table."""
+    id: Any
+    seq: int
+    at: datetime
+
+
+
+
+class ChangeSet:
+    """The objects upserted and removed in a table since a sync token, returned by `Table.changes_since()`."""
+    upserted: list[Any]
+    """The objects inserted or updated since the token, in the order of their changes."""
+    removed: list[Any]
+    """The primary keys of the objects removed since the token."""
+    token: str
+    """The token to give to the next call to get the following changes."""
+    more: bool
+    """If there are more changes than the limit, to get with the new token."""
+
+    def __init__(self, upserted: list[Any], removed: list[Any], token: str, more: bool) -> None:
+        self.upserted = upserted
+        self.removed = removed
+        self.token = token
+        self.more = more
+
+
+    def __repr__(self) -> str:
+        return f"ChangeSet(upserted={len(self.upserted)} removed={len(self.removed)} token={self.token!r} more={self.more})"
+
+
+
+
+
+
+class VersionStamps:
+    """Stamp the objects of a table with an increasing sequence number at each write, and keep a tombstone
+    of the removed ones, so the changes since a sync token are read from an index.
+    A sequence number is in flight from the start to the end of its write, and the sync tokens stay below
+    the oldest one in flight, so a write committed after a more recent one is not skipped.
+    The objects written before the versioning was enabled are stamped at the first sync.
+    Should not be used directly, use `Table.enable_versioning()`."""
+    table: "Table"
+    """The versioned table."""
+    field: str
+    """The field of the documents holding their sequence number."""
+    clock: str
+    """"sequence" for a counter shared by all the processes in the database, at the cost of 2 more round trips
+    per write (to take the number and to release it at the end of the write), or "time" for the time in
+    nanoseconds of the process (no round trip, but the clocks of the hosts must be synchronized)."""
+    tombstones: "Table[Tombstone]"
+    """The table of the tombstones of the removed objects."""
+    retention: float | None
+    """The time in seconds the tombstones are kept, forever if None. The sync tokens given before the pruned
+    tombstones expire."""
+    max_write_time: float
+    """With the "sequence" clock, the time in seconds after which a sequence number still in flight is ignored,
+    as its write may have crashed."""
+    settle_time: float
+    """With the "time" clock, the time in seconds the changes wait before being synced. The writes in flight in the
+    other processes are not known, the ones taking longer may be skipped."""
+
+    def __init__(self,
+                 table: "Table",
+                 field: str = "_seq",
+                 clock: str = "sequence",
+                 retention: float | None = RETENTION,
+                 max_write_time: float = 60.0,
+                 settle_time: float = 1.0) -> None:
+        from .database import Table
+
+        if clock not in CLOCKS:
+            raise StelladdonError(f"The clock must be one of {CLOCKS}, not {clock!r}.")
+
+        self.table = table
+        self.field = field
+        self.clock = clock
+        self.retention = retention
+        self.max_write_time = max_write_time
+        self.settle_time = settle_time
+        self.tombstones = Table(Tombstone, f"{table.collection}_tombstones", table.database, "id")
+        if self._offline:
+            self.tombstones.enable_memory(offline=True)
+
+        self._lock = Lock()
+        self._last = 0
+        self._in_flight: set[int] = set()
+        self._pruned = 0
+        self._next_prune = 0.0
+        self._indexed = False
+        self._stamped = False
+
+
+    @contextmanager
+    def write(self) -> Iterator[int]:
+        """Get a new sequence number, greater than all the previous ones, for a write done in the block.
+        The sync tokens stay below it until the end of the block."""
+        seq = self._allocate()
+        try:
+            yield seq
+        finally:
+            self._release(seq)
+
+
+    def stamp(self, update: dict, seq: int) -> dict:
+        """Add a sequence number to an update, without modifying it."""
+        if not isinstance(update, dict):
+            raise StelladdonError(f"The pipeline updates are not supported by the versioned table {self.table}.")
+        return update | {"$set": update.get("$set", {}) | {self.field: seq}}
+
+
+    def stamp_existing(self, batch_size: int = 1000) -> None:
+        """Stamp the objects written before the versioning was enabled, so the syncs return them.
+        Each batch gets its own sequence number, to keep the pages of the first sync within their limit."""
+        primary_key = self.table.primary_key
+        unstamped = {self.field: {"$exists": False}}
+        while True:
+            ids = [document[primary_key] for document in self.table._collection.find(
+                unstamped, projection={primary_key: 1}, limit=batch_size)]
+            if not ids:
+                break
+            with self.write() as seq:
+                # the objects written meanwhile already have their own number
+                self.table._collection.update_many(unstamped | {primary_key: {"$in": ids}},
+                                                   {"$set": {self.field: seq}})
+        self._stamped = True
+
+
+    def bury(self, ids: Iterable[Any]) -> None:
+        """Record the removal of the objects."""
+        ids = list(ids)
+        if not ids:
+            return
+
+        at = datetime.now(timezone.utc)
+        with self.write() as seq:
+            self.tombstones._collection.bulk_write(
+                [UpdateOne({"id": id}, {"$set": {"seq": seq, "at": at}}, upsert=True) for id in ids], ordered=False)
+
+        if self.retention is not None and monotonic() >= self._next_prune:
+            self.prune()
+
+
+    def revive(self, id: Any) -> None:
+        """Forget the removal of an object inserted again."""
+        self.tombstones._collection.delete_one({"id": id})
+
+
+    def revive_many(self, ids: list[Any]) -> None:
+        """Forget the removal of several objects inserted again."""
+        if ids:
+            self.tombstones._collection.delete_many({"id": {"$in": ids}})
+
+
+    def prune(self) -> None:
+        """Remove the tombstones older than the retention. Called by the removals at most once an hour.
+        The sync tokens given before the last pruned tombstone expire, their clients must sync again from scratch."""
+        if self.retention is None:
+            return
+        self._next_prune = monotonic() + min(self.retention, PRUNE_INTERVAL)
+
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.retention)
+        expired = list(self.tombstones._collection.find(
+            {"at": {"$lt": cutoff}}, projection={"seq": 1}, sort=[("seq", DESCENDING)], limit=1))
+        if not expired:
+            return
+
+        # the horizon is recorded before the removal, so the syncs reading the tombstones meanwhile see it after
+        horizon = expired[0]["seq"]
+        if self._offline:
+            with self._lock:
+                self._pruned = max(self._pruned, horizon)
+        else:
+            self._sequences.update_one({"_id": self._sequence_id}, {"$max": {"pruned": horizon}}, upsert=True)
+        self.tombstones._collection.delete_many({"seq": {"$lte": horizon}})
+
+
+    def changes_since(self, token: str | None, query: dict | None = None, limit: int = 1000) -> ChangeSet:
+        """Get the objects upserted and removed since the token (all the objects if None), at most about `limit`.
+        The changed objects that don't match the query are returned as removed, as they may have matched before.
+        Raise `ExpiredSyncToken` if tombstones more recent than the token have been pruned."""
+        self._ensure_indexes()
+        since = self._parse_token(token)
+        if not self._stamped:
+            self.stamp_existing(limit)
+        stable = self._stable()
+
+        changes = self._changes({"$gt": since, "$lte": stable}, limit + 1)
+        more = len(changes) > limit
+        if more:
+            # the objects written at once share a sequence number, keep them together
+            last = changes[limit - 1][0]
+            changes = [change for change in changes if change[0] < last] + self._changes(last)
+
+        # read after the changes, see prune()
+        if since and since < self._pruned_seq():
+            raise ExpiredSyncToken(f"The sync token {token!r} has expired, sync again without token.")
+
+        ids = [id for _, id, removed in changes if not removed]
+        upserted = self._upserted(ids, query)
+        removed = [id for _, id, removed in changes if removed]
+        removed += [id for id in ids if id not in upserted]
+
+        new_since = changes[-1][0] if changes else max(since, stable)
+        return ChangeSet(list(upserted.values()), removed, str(new_since), more)
+
+
+    def _changes(self, seqs: Any, limit: int = 0) -> list[tuple[int, Any, bool]]:
+        primary_key = self.table.primary_key
+        documents = self.table._collection.find({self.field: seqs}, projection={primary_key: 1, self.field: 1},
+                                                sort=[(self.field, ASCENDING)], limit=limit)
+        tombstones = self.tombstones._collection.find({"seq": seqs}, sort=[("seq", ASCENDING)], limit=limit)
+
+        changes = [(document[self.field], document[primary_key], False) for document in documents]
+        changes += [(document["seq"], document["id"], True) for document in tombstones]
+        changes.sort(key=lambda change: change[0])
+        return changes
+
+
+    def _upserted(self, ids: list[Any], query: dict | None) -> dict[Any, Any]:
+        """The objects with these ids matching the query, in the order of the ids."""
+        if not ids:
+            return {}
+
+        primary_key = self.table.primary_key
+        query = query or {}
+        if primary_key in query:
+            wanted = set(ids)
+            documents = [document for document in self.table._collection.find(query)
+                         if document[primary_key] in wanted]
+        else:
+            documents = list(self.table._collection.find(query | {primary_key: {"$in": ids}}))
+
+        by_id = {document[primary_key]: document for document in documents}
+        return {id: self.table.load_object(by_id[id]) for id in ids if id in by_id}
+
+
+    def _allocate(self) -> int:
+        self._ensure_indexes()
+        if self.clock == "sequence" and not self._offline:
+            # the sequence number is added to the ones in flight in the same atomic update,
+            # and the ones left by the crashed writes are dropped
+            now = _now_ms()
+            document = self._sequences.find_one_and_update(
+                {"_id": self._sequence_id},
+                [
+                    {"$set": {"seq": {"$add": [{"$ifNull": ["$seq", 0]}, 1]}}},
+                    {"$set": {"pending": {"$concatArrays": [
+                        {"$filter": {"input": {"$ifNull": ["$pending", []]},
+                                     "cond": {"$gt": ["$$this.expires", now]}}},
+                        [{"seq": "$seq", "expires": now + int(self.max_write_time * 1000)}],
+                    ]}}},
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            return document["seq"]
+
+        with self._lock:
+            self._last = max(time_ns(), self._last + 1) if self.clock == "time" else self._last + 1
+            self._in_flight.add(self._last)
+            return self._last
+
+
+    def _release(self, seq: int) -> None:
+        if self.clock == "sequence" and not self._offline:
+            self._sequences.update_one({"_id": self._sequence_id}, {"$pull": {"pending": {"seq": seq}}})
+            return
+
+        with self._lock:
+            self._in_flight.discard(seq)
+
+
+    def _stable(self) -> int:
+        """The greatest sequence number below all the ones in flight: no write can be committed with it anymore."""
+        if self.clock == "sequence" and not self._offline:
+            document = self._sequences.find_one({"_id": self._sequence_id}) or {}
+            now = _now_ms()
+            pending = [item["seq"] for item in document.get("pending") or [] if item["expires"] > now]
+            return min(pending) - 1 if pending else document.get("seq", 0)
+
+        with self._lock:
+            in_flight = min(self._in_flight) - 1 if self._in_flight else None
+            stable = self._last if in_flight is None else in_flight
+        if self.clock == "time" and not self._offline:
+            # the writes in flight in the other processes are not known
+            settled = time_ns() - int(self.settle_time * 1e9)
+            stable = settled if in_flight is None else min(in_flight, settled)
+        return stable
+
+
+    def _pruned_seq(self) -> int:
+        if self.retention is None:
+            return 0
+        if self._offline:
+            return self._pruned
+        document = self._sequences.find_one({"_id": self._sequence_id}, projection={"pruned": 1}) or {}
+        return document.get("pruned", 0)
+
+
+    def _ensure_indexes(self) -> None:
+        if self._indexed:
+            return
+        self._indexed = True
+        if self._offline:
+            return
+        self.table._collection.create_index([(self.field, ASCENDING)])
+        self.tombstones._collection.create_index([("id", ASCENDING)], unique=True)
+        self.tombstones._collection.create_index([("seq", ASCENDING)])
+        self.tombstones._collection.create_index([("at", ASCENDING)])
+
+
+    @property
+    def _offline(self) -> bool:
+        return self.table.memory is not None and self.table.memory.offline
+
+
+    @property
+    def _sequence_id(self) -> str:
+        return f"{self.table.database.name}.{self.table.collection}"
+
+
+    @property
+    def _sequences(self):
+        return self.table._collection.database[SEQUENCES_COLLECTION]
+
+
+    @staticmethod
+    def _parse_token(token: str | None) -> int:
+        if not token:
+            return 0
+        try:
+            return int(token)
+        except ValueError:
+            raise InvalidSyncToken(f"Invalid sync token {token!r}.") from None
+
+
+
+def _now_ms() -> int:
+    return int(time() * 1000)
@@ -0,0 +1,158 @@
+from typing import Any, Awaitable, Callable, Hashable, TYPE_CHECKING
+from asyncio import Future, get_running_loop, shield, wait_for, TimeoutError as AsyncTimeoutError
+from threading import Event, Lock
+
+from fastapi.responses import Response
+
+from .caching import request_key
+from .errors import HTTPException
+
+if TYPE_CHECKING:
+    from .routing import Context
+
+
+__all__ = [
+    "Coalesce", "QueryCoalescer", "RequestCoalescer"
+]
+
+
+
+def _copy_error(error: BaseException, ctx: "Context | None" = None) -> BaseException:
+    """Copy the error of a shared call for one of the callers waiting for it,
+    so they don't all raise (and update the traceback of) the same instance."""
+    copied = type(error).__new__(type(error))
+    copied.__dict__.update(error.__dict__)
+    copied.args = error.args
+    if ctx is not None and isinstance(copied, HTTPException):
+        copied.ctx = ctx
+    return copied
+
+
+
+class _Flight:
+
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+
+class QueryCoalescer:
+    """Share one in-flight database query between the threads running the same query at the same time.
+    The first caller runs the query, the others wait for its result (or its error) up to `max_wait` seconds
+    and then run their own."""
+    max_wait: float
+    """The maximum time in seconds a caller waits for the query of another one."""
+
+    def __init__(self, max_wait: float = 5.0) -> None:
+        self.max_wait = max_wait
+        self._flights: dict[Hashable, _Flight] = {}
+        self._lock = Lock()
+
+
+    def run(self, key: Hashable, query: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if not flight.done.wait(self.max_wait):
+                return query()
+            if flight.error is not None:
+                error = flight.error
+                raise _copy_error(error) from error
+            return flight.result
+
+        try:
+            flight.result = query()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+
+class Coalesce:
+    """The coalescing options of an idempotent route, to give to `StellaRouter.route(coalesce=...)`.
+    The identical requests received while one is being handled get its response instead of being handled again."""
+    query_params: list[str] | None
+    """The query parameters that make two requests identical, all of them if None."""
+    headers: list[str]
+    """The request headers that make two requests identical."""
+    max_wait: float
+    """The maximum time in seconds a request waits for the response of another one before being handled itself."""
+
+    def __init__(self,
+                 query_params: list[str] | None = None,
+                 headers: list[str] | None = None,
+                 max_wait: float = 5.0) -> None:
+        self.query_params = query_params
+        self.headers = [header.lower() for header in headers or []]
+        self.max_wait = max_wait
+
+
+
+class RequestCoalescer:
+    """Run the handler once for the identical requests of a route handled concurrently,
+    and give its encoded response to all of them."""
+    options: Coalesce
+    """The coalescing options of the route."""
+
+    def __init__(self, options: Coalesce) -> None:
+        self.options = options
+        self._flights: dict[tuple, Future] = {}
+
+
+    async def run(self, ctx: "Context", handler: Callable[["Context"], Awaitable[Any]]) -> Any:
+        key = request_key(ctx, self.options.query_params, self.options.headers)
+
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                break
+
+            try:
+                response = await wait_for(shield(flight), self.options.max_wait)
+            except AsyncTimeoutError:
+                return await handler(ctx)
+            except Exception as e:
+                raise _copy_error(e, ctx) from e
+
+            if response is _NOT_SHARED:
+                return await handler(ctx)
+            if response is _ABANDONED:
+                # the leader has been cancelled, the first follower to wake up leads a new flight
+                continue
+            ctx.coalesced = True
+            return response
+
+        flight = self._flights[key] = get_running_loop().create_future()
+        try:
+            response = await handler(ctx)
+        except Exception as e:
+            flight.set_exception(e)
+            # retrieve the exception so it's not reported as never retrieved when there are no followers
+            flight.exception()
+            raise
+        except BaseException:
+            # a cancellation concerns the leader request only, not the followers
+            flight.set_result(_ABANDONED)
+            raise
+        else:
+            # response objects (like streams) can only be sent once
+            flight.set_result(_NOT_SHARED if isinstance(response, Response) else response)
+            return response
+        finally:
+            del self._flights[key]
+
+
+
+_NOT_SHARED = object()
+_ABANDONED = object()
@@ -0,0 +1,311 @@
+from typing import Any, Callable, Iterable
+from array import array
+from itertools import compress
+
+
+__all__ = [
+    "Column", "ColumnResult"
+]
+
+
+MISSING = object()
+TYPECODES = {"int": "q", "float": "d", "bool": "b", "str": "l"}
+NUMERIC_KINDS = ("int", "float", "bool")
+
+
+
+def _get_path(document: dict, path: list[str]) -> Any:
+    value: Any = document
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+    return value
+
+
+
+class Column:
+    """A column of values stored compactly: a typed array for the numbers and booleans,
+    codes into a string table for the strings, and a list only for the other values.
+    The missing values are tracked in a mask, only created when there is one."""
+    name: str
+    """The name of the field."""
+    kind: str | None
+    """The kind of values: "int", "float", "bool", "str", "object", or None if there is no value yet."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.kind: str | None = None
+        self.values: array | list = array("q")
+        self.strings: list[str] = []
+        self.mask: bytearray | None = None
+        self._string_codes: dict[str, int] = {}
+        self._length = 0
+
+
+    def __len__(self) -> int:
+        return self._length
+
+
+    def __repr__(self) -> str:
+        return f"Column({self.name!r} kind={self.kind} length={self._length})"
+
+
+    def append(self, value: Any) -> None:
+        if value is MISSING or value is None:
+            if self.mask is None:
+                self.mask = bytearray(b"\x01") * self._length
+            self.mask.append(0)
+            self._store(None)
+        else:
+            kind = self._kind_of(value)
+            if kind != self.kind:
+                common_kind = self._common_kind(self.kind, kind)
+                if common_kind != self.kind:
+                    self._convert(common_kind)
+            if self.mask is not None:
+                self.mask.append(1)
+            self._store(value)
+        self._length += 1
+
+
+    def extend(self, other: "Column") -> None:
+        """Append the values of another column, copying its arrays in bulk when the kinds allow it."""
+        if other.kind is not None and other.kind != self.kind:
+            common_kind = self._common_kind(self.kind, other.kind)
+            if common_kind != self.kind:
+                self._convert(common_kind)
+
+        if self.mask is not None or other.mask is not None:
+            if self.mask is None:
+                self.mask = bytearray(b"\x01") * self._length
+            self.mask += other.mask if other.mask is not None else bytearray(b"\x01") * other._length
+
+        if other.kind == self.kind == "str":
+            # the string codes of the other column are translated to the codes of this one
+            codes = [self._string_code(string) for string in other.strings] or [0]
+            self.values.extend(codes[code] for code in other.values)
+        elif other.kind == self.kind:
+            self.values.extend(other.values)
+        else:
+            for value in other.to_list():
+                self._store(value)
+        self._length += other._length
+
+
+    def get(self, index: int) -> Any:
+        if self.mask is not None and not self.mask[index]:
+            return None
+        value = self.values[index]
+        if self.kind == "str":
+            return self.strings[value]
+        if self.kind == "bool":
+            return bool(value)
+        return value
+
+
+    def present(self) -> Iterable[Any]:
+        """Iterate over the values that are not missing, without decoding the strings."""
+        if self.mask is None:
+            return self.values
+        return compress(self.values, self.mask)
+
+
+    def to_list(self) -> list[Any]:
+        if self.kind == "str":
+            strings = self.strings
+            values = [strings[code] for code in self.values]
+        elif self.kind == "bool":
+            values = [bool(value) for value in self.values]
+        else:
+            values = self.values.tolist() if isinstance(self.values, array) else list(self.values)
+
+        if self.mask is not None:
+            values = [value if present else None for value, present in zip(values, self.mask)]
+        return values
+
+
+    def to_numpy(self) -> Any:
+        """Get the values as a NumPy array without copying them (string codes for the string columns).
+        The missing values are zeros, see `mask`."""
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("NumPy is required to use Column.to_numpy().") from None
+        if not isinstance(self.values, array):
+            return numpy.array(self.values, dtype=object)
+        return numpy.frombuffer(self.values, dtype=self.values.typecode)
+
+
+    def select(self, selectors: bytearray) -> "Column":
+        column = Column(self.name)
+        column.kind = self.kind
+        column.strings = self.strings
+        column._string_codes = self._string_codes
+        if isinstance(self.values, array):
+            column.values = array(self.values.typecode, compress(self.values, selectors))
+        else:
+            column.values = list(compress(self.values, selectors))
+        if self.mask is not None:
+            column.mask = bytearray(compress(self.mask, selectors))
+        column._length = len(column.values)
+        return column
+
+
+    def _store(self, value: Any) -> None:
+        if value is None:
+            if self.kind == "object":
+                self.values.append(None)
+            else:
+                self.values.append(float("nan") if self.kind == "float" else 0)
+
+        elif self.kind == "str":
+            self.values.append(self._string_code(value))
+
+        else:
+            self.values.append(value)
+
+
+    def _string_code(self, string: str) -> int:
+        code = self._string_codes.get(string)
+        if code is None:
+            code = self._string_codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+
+    def _convert(self, kind: str) -> None:
+        values = self.to_list()
+        self.kind = kind
+        self.strings = []
+        self._string_codes = {}
+        self.values = [] if kind == "object" else array(TYPECODES[kind])
+        for value in values:
+            self._store(value)
+
+
+    @staticmethod
+    def _common_kind(old: str | None, new: str) -> str:
+        if old is None:
+            return new
+        if old in NUMERIC_KINDS and new in NUMERIC_KINDS:
+            return "float" if "float" in (old, new) else "int"
+        return "object"
+
+
+    @staticmethod
+    def _kind_of(value: Any) -> str:
+        if isinstance(value, bool):
+            return "bool"
+        if isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+            return "int"
+        if isinstance(value, float):
+            return "float"
+        if isinstance(value, str):
+            return "str"
+        return "object"
+
+
+
+class ColumnResult:
+    """The result of `Table.find_columns()`: the projected fields of the matching documents,
+    stored by column instead of one model per document."""
+    columns: dict[str, Column]
+    """The columns by field name."""
+
+    def __init__(self, fields: list[str]) -> None:
+        self.columns = {field: Column(field) for field in fields}
+        self._paths = {field: field.split(".") for field in fields}
+
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+
+    def __getitem__(self, field: str) -> Column:
+        return self.columns[field]
+
+
+    def __repr__(self) -> str:
+        return f"ColumnResult({list(self.columns)} rows={len(self)})"
+
+
+    def add_documents(self, documents: Iterable[dict]) -> None:
+        items = [(column, self._paths[name]) for name, column in self.columns.items()]
+        for document in documents:
+            for column, path in items:
+                column.append(_get_path(document, path))
+
+
+    def sum(self, field: str) -> int | float:
+        return sum(self._numeric(field).present())
+
+
+    def mean(self, field: str) -> float | None:
+        count = 0
+        total = 0
+        for value in self._numeric(field).present():
+            total += value
+            count += 1
+        return total / count if count else None
+
+
+    def min(self, field: str) -> Any:
+        return self._reduce(field, min)
+
+
+    def max(self, field: str) -> Any:
+        return self._reduce(field, max)
+
+
+    def filter(self, field: str, predicate: Callable[[Any], bool]) -> "ColumnResult":
+        """Keep the rows where the predicate on the field value is true."""
+        column = self.columns[field]
+        selectors = bytearray(bool(predicate(column.get(i))) for i in range(len(column)))
+        return self._select(selectors)
+
+
+    def where(self, field: str, value: Any) -> "ColumnResult":
+        """Keep the rows where the field is equal to the value. Faster than `filter()` on string columns."""
+        column = self.columns[field]
+        if column.kind == "str":
+            code = column._string_codes.get(value)
+            selectors = bytearray(code == c for c in column.values)
+        else:
+            selectors = bytearray(v == value for v in column.values)
+        if column.mask is not None:
+            selectors = bytearray(s and m for s, m in zip(selectors, column.mask))
+        return self._select(selectors)
+
+
+    def to_dict(self) -> dict[str, list[Any]]:
+        """The column-oriented representation of the result, used to serialize it."""
+        return {name: column.to_list() for name, column in self.columns.items()}
+
+
+    def _numeric(self, field: str) -> Column:
+        # the values of the string columns are codes, summing them would give a meaningless number
+        column = self.columns[field]
+        if column.kind not in (None, *NUMERIC_KINDS):
+            raise TypeError(f"The column {field!r} is not numeric ({column.kind}).")
+        return column
+
+
+    def _reduce(self, field: str, function: Callable) -> Any:
+        column = self.columns[field]
+        values = column.present()
+        try:
+            if column.kind == "str":
+                return function(column.strings[code] for code in set(values))
+            result = function(values)
+        except ValueError:
+            # no value to reduce
+            return None
+        return bool(result) if column.kind == "bool" else result
+
+
+    def _select(self, selectors: bytearray) -> "ColumnResult":
+        result = ColumnResult([])
+        result.columns = {name: column.select(selectors) for name, column in self.columns.items()}
+        result._paths = self._paths
+        return result
@@ -8,15 +8,18 @@ from fastapi import FastAPI, Request, APIRouter
 from fastapi.routing import APIRoute, run_endpoint_function
 from fastapi.utils import get_path_param_names
 from fastapi.dependencies.utils import get_dependant, solve_dependencies
+from fastapi.dependencies.models import Dependant
 from fastapi.responses import JSONResponse, Response
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi._compat import _normalize_errors
 from .errors import StellaAPIError, NoWaitResponse
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from .typin import ServiceT, ServiceResultT
 from .database import Table
+from .profiling import _profiled_session, _follow_in_thread
 
 if TYPE_CHECKING:
     from .routing import Context
@@ -36,42 +39,46 @@ async def run_with_context(func: Callable,
     for arg, argval in ctx.arguments.items():
         arguments[arg] = argval
 
-    result = await _run_func(func, arguments, ctx.route.faroute.path, ctx.req)
+    arguments = {name: value for name, value in arguments.items() if name in func.__code__.co_varnames}
+    dependant = ctx.route.get_dependant(func, frozenset(arguments))
+
+    # the ingestion routes read their body as a stream
+    result = await _run_func(func, arguments, dependant, ctx.req, read_body=ctx.route.ingest is None)
     return result
 
 
-async def _run_func(func: Callable,
-                    arguments: dict[str, Any],
-                    dependant_path: str,
-                    req: Request) -> Any:
-    co_varnames = list(func.__code__.co_varnames)
-    varnames_to_remove = 0
+def _build_dependant(func: Callable, names: frozenset[str], dependant_path: str) -> Dependant:
+    """Build the FastAPI dependant of a function, without its parameters given by stelladdon."""
+    co_varnames = [varname for varname in func.__code__.co_varnames if varname not in names]
+    varnames_to_remove = len(func.__code__.co_varnames) - len(co_varnames)
 
     func_code = func.__code__
-
-    for argname in arguments.copy():
-        if argname in co_varnames:
-            co_varnames.remove(argname)
-            varnames_to_remove += 1
-
-        else:
-            del arguments[argname]
-
     func.__code__ = func.__code__.replace(
         co_varnames=tuple(co_varnames),
         co_argcount=func.__code__.co_argcount - varnames_to_remove,
         co_nlocals=func.__code__.co_nlocals - varnames_to_remove,
     )
 
-    dependant = get_dependant(
-        path=dependant_path, # TODO: ca
-        call=func,
-    )
-
     try:
-        body = await req.json()
-    except:
-        body = await req.body()
+        return get_dependant(
+            path=dependant_path, # TODO: ca
+            call=func,
+        )
+    finally:
+        func.__code__ = func_code
+
+
+async def _run_func(func: Callable,
+                    arguments: dict[str, Any],
+                    dependant: Dependant,
+                    req: Request,
+                    read_body: bool = True) -> Any:
+    body = None
+    if read_body and dependant.body_params:
+        try:
+            body = await req.json()
+        except:
+            body = await req.body()
 
     async with AsyncExitStack() as async_exit_stack:
         solved = await solve_dependencies(
@@ -82,8 +89,6 @@ async def _run_func(func: Callable,
             embed_body_fields=False
         )
 
-        func.__code__ = func_code
-
         errors = solved.errors.copy()
         if errors:
             for error in errors.copy():
@@ -105,6 +110,10 @@ async def _run_func(func: Callable,
         """if solved.values.get("body", "abc") == None and body:
             solved.values["body"] = body"""
 
+        if _profiled_session.get() is not None and not iscoroutinefunction(func):
+            # the profiler follows the function in its worker thread
+            return await run_in_threadpool(_follow_in_thread(dependant.call), **(solved.values | arguments))
+
         resp = await run_endpoint_function(
             dependant=dependant,
             values=solved.values | arguments,
@@ -118,12 +127,15 @@ async def _run_func(func: Callable,
 class DatabaseGetterArg:
 
     def __init__(self, table: Table, pyname: str, key: str,
-                 none_allowed: bool, only_one: bool): # TODO: model (db obj), py name, key, param name
+                 none_allowed: bool, only_one: bool,
+                 count: bool = False, exists: bool = False): # TODO: model (db obj), py name, key, param name
         self.table = table
         self.pyname = pyname
         self.key = key
         self.none_allowed = none_allowed
         self.only_one = only_one
+        self.count = count
+        self.exists = exists
 
 
 
@@ -139,10 +151,14 @@ class FromDatabaseArg:
 
     def __init__(self, table: Table,
                  multiple: bool,
-                 key: str | None) -> None:
+                 key: str | None,
+                 count: bool = False,
+                 exists: bool = False) -> None:
         self.table = table
         self.multiple = multiple
         self.key = key
+        self.count = count
+        self.exists = exists
 
 
 
@@ -156,9 +172,13 @@ class APIObject(BaseModel, ABC):
 
 def FromDB(table: Table,
            multiple: bool = False,
-           key: str | None = None) -> FromDatabaseArg:
+           key: str | None = None,
+           count: bool = False,
+           exists: bool = False) -> FromDatabaseArg:
     """
     A special type hint to indicate that the argument should be fetched from the database.
+    With `count` the argument is the number of matching objects, and with `exists`
+    a boolean telling if there is one, both computed on the server without loading the objects.
     TODO: doc
     """
-    return FromDatabaseArg(table, multiple, key)
+    return FromDatabaseArg(table, multiple, key, count, exists)
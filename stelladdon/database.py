@@ -1,32 +1,82 @@
-from typing import Generic, Callable, Type, Any
-
-from pymongo import MongoClient
-
-from .typin import TableModelT
-from .utils import _pretty
-from .errors import StelladdonError, ObjectAlreadyExists, TableNotFound
+from typing import Generic, Callable, ContextManager, Iterable, Type, Any
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from threading import Lock
+import os
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.write_concern import WriteConcern
+
+from .typin import TableModelT, ResultModelT
+from .utils import _pretty, _get_field
+from .errors import StelladdonError, ObjectAlreadyExists, TableNotFound, ConcurrentModification
+from .writebehind import WriteBehindBuffer
+from .caching import record_read
+from .sharedcache import SharedObjectCache
+from .coalescing import QueryCoalescer
+from .columns import ColumnResult
+from .tracking import ChangeTracker
+from .memory import MemoryStore
+from .changes import VersionStamps, ChangeSet, RETENTION
 
 
 __all__ = [
-    "StellaMongo", "Database", "Table"
+    "StellaMongo", "Database", "Table", "TableCursor"
 ]
 
 
 
 class StellaMongo:
-    """A MongoDB client wich stores the databases with their typed tables."""
-    client: MongoClient | None
-    """The pymongo.MongoClient instance used by the client."""
+    """A MongoDB client wich stores the databases with their typed tables.
+    The pymongo client is created on first use in each process, so a StellaMongo can be created before the workers fork."""
+    host: str | None
+    """The host (or connection string) of the MongoDB server, None if the pymongo client is set manually."""
     cached_databases: list["Database"]
     """The databases stuctures that have been cached by the client. Should not be used directly."""
 
-    def __init__(self, host: str | None, port: int | None = None) -> None:
-        """Create a StellaMongo client. You can set host to None is you want to setup pymongo.MongoClient later manually."""
-        if host is None:
-            self.client = None
-        else:
-            self.client = MongoClient(host, port)
+    def __init__(self, host: str | None, port: int | None = None, **options) -> None:
+        """Create a StellaMongo client. You can set host to None is you want to setup pymongo.MongoClient later manually.
+        The options are passed to pymongo.MongoClient (`minPoolSize`, `maxPoolSize`...)."""
+        self.host = host
+        self.port = port
+        self.options = options
         self.cached_databases: list[Database] = []
+        self._client: MongoClient | None = None
+        self._client_pid: int | None = None
+        self._lock = Lock()
+
+
+    @property
+    def client(self) -> MongoClient | None:
+        """The pymongo.MongoClient instance used by the client, created for the current process."""
+        if self.host is not None and (self._client is None or self._client_pid != os.getpid()):
+            with self._lock:
+                # a pymongo client is not fork-safe, the forked processes need their own
+                if self._client is None or self._client_pid != os.getpid():
+                    self._client = MongoClient(self.host, self.port, **self.options)
+                    self._client_pid = os.getpid()
+        return self._client
+
+
+    @client.setter
+    def client(self, client: MongoClient | None) -> None:
+        self._client = client
+        self._client_pid = os.getpid()
+
+
+    def connect(self, connections: int = 1) -> None:
+        """Create the pymongo client now and open `connections` connections to the server, to not delay the first requests."""
+        client = self.client
+        if client is None:
+            raise StelladdonError("The client has no host to connect to.")
+
+        if connections <= 1:
+            client.admin.command("ping")
+            return
+
+        # concurrent commands can't share a connection, so each one opens a connection of the pool
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            list(executor.map(lambda _: client.admin.command("ping"), range(connections)))
 
 
     def get_database(self, name: str) -> "Database":
@@ -117,6 +167,20 @@ class Table(Generic[TableModelT]):
     """The database that the table is rattached to."""
     primary_key: str
     """The primary key of all the objects in the table that is used to identify them."""
+    write_behind: WriteBehindBuffer | None
+    """The buffer of the updates waiting to be written, if write-behind is enabled."""
+    write_hooks: list[Callable[["Table", Any | None], None]]
+    """Called with the primary key of each object written through the table, or None when several may have been."""
+    shared_cache: SharedObjectCache | None
+    """The cache shared between processes that the objects got by primary key are read from, if any."""
+    coalescer: QueryCoalescer | None
+    """Share the identical queries running at the same time, if coalescing is enabled."""
+    tracker: ChangeTracker | None
+    """Remember the loaded objects to save only their changes, if change tracking is enabled."""
+    memory: MemoryStore | None
+    """The content of the table held in memory to answer the simple queries locally, if enabled."""
+    versions: VersionStamps | None
+    """Stamp the written objects with a sequence number and record the removed ones, if versioning is enabled."""
 
     def __init__(self,
                  model: Type[TableModelT],
@@ -128,6 +192,13 @@ class Table(Generic[TableModelT]):
         self.collection = collection
         self.database = database
         self.primary_key = primary_key
+        self.write_behind: WriteBehindBuffer | None = None
+        self.write_hooks: list[Callable[[Table, Any | None], None]] = []
+        self.shared_cache: SharedObjectCache | None = None
+        self.coalescer: QueryCoalescer | None = None
+        self.tracker: ChangeTracker | None = None
+        self.memory: MemoryStore | None = None
+        self.versions: VersionStamps | None = None
 
 
     def __getitem__(self, id: Any) -> TableModelT | None:
@@ -140,7 +211,10 @@ class Table(Generic[TableModelT]):
 
     def load_object(self, data: dict) -> TableModelT:
         """Load a document from the database (or not) into the table model."""
-        return self.model.model_validate(data)
+        object = self.model.model_validate(data)
+        if self.tracker is not None:
+            self.tracker.track(object)
+        return object
 
 
     def get_id_of(self, object: TableModelT) -> Any:
@@ -153,38 +227,172 @@ class Table(Generic[TableModelT]):
              limit: int | None = None,
              **kwargs) -> list[TableModelT]:
         """Find objects in the table that match the query."""
+        record_read(self, None)
+        if self.memory is not None and set(kwargs) <= {"sort", "skip"}:
+            objects = self.memory.find(query, kwargs.get("sort"), kwargs.get("skip", 0), limit)
+            if objects is not None:
+                return self._from_memory(objects)
+
+        if self.coalescer is not None:
+            key = ("find", repr(query), limit, repr(sorted(kwargs.items())))
+            docs = self.coalescer.run(key, lambda: list(
+                self._collection.find(query, limit=limit if limit is not None else 0, **kwargs)))
+            return [self.load_object(doc) for doc in docs]
+
         cursor = self._collection.find(query, limit=limit if limit is not None else 0, **kwargs)
         return [self.load_object(doc) for doc in cursor]
 
 
+    def iter_find(self,
+                  query: dict,
+                  limit: int | None = None,
+                  batch_size: int | None = None,
+                  **kwargs) -> "TableCursor[TableModelT]":
+        """Find objects in the table that match the query, loading them lazily while iterating.
+        Returning the cursor from a route streams the objects instead of building a list."""
+        record_read(self, None)
+        cursor = self._collection.find(query, limit=limit if limit is not None else 0, **kwargs)
+        if batch_size is not None:
+            cursor = cursor.batch_size(batch_size)
+        return TableCursor(self, cursor)
+
+
+    def find_columns(self,
+                     query: dict,
+                     fields: list[str],
+                     limit: int | None = None,
+                     batch_size: int = 10000,
+                     **kwargs) -> ColumnResult:
+        """Find the objects in the table that match the query, and load only the given fields
+        (dotted paths are allowed) into compact columns, without creating a model per object."""
+        record_read(self, None)
+        projection = {field: 1 for field in fields}
+        if "_id" not in projection:
+            projection["_id"] = 0
+        cursor = self._collection.find(query, projection=projection,
+                                       limit=limit if limit is not None else 0, **kwargs).batch_size(batch_size)
+
+        result = ColumnResult(fields)
+        result.add_documents(cursor)
+        return result
+
+
     def find_one(self,
                  query: dict,
                  **kwargs) -> TableModelT | None:
         """Find one object in the table that match the query."""
-        data = self._collection.find_one(query, **kwargs)
+        if self.memory is not None and set(kwargs) <= {"sort"}:
+            objects = self.memory.find(query, kwargs.get("sort"), limit=1)
+            if objects is not None:
+                record_read(self, [self.get_id_of(object) for object in objects] or None)
+                return self._from_memory(objects)[0] if objects else None
+
+        data = self._find_one_document(query, **kwargs)
         if data is None:
+            record_read(self, None)
             return None
+        record_read(self, [data.get(self.primary_key)])
         return self.load_object(data)
 
 
     def get(self, id: Any) -> TableModelT | None:
         """Get an object from the table by its primary key."""
-        data = self._collection.find_one({self.primary_key: id})
+        record_read(self, [id])
+        if self.memory is not None:
+            object = self.memory.get(id)
+            if object is None:
+                return None
+            return self._from_memory([object])[0]
+
+        if self.shared_cache is not None:
+            data = self.shared_cache.fetch(self, id, lambda: self._find_one_document({self.primary_key: id}))
+        else:
+            data = self._find_one_document({self.primary_key: id})
         if data is None:
             return None
         return self.load_object(data)
 
 
+    def get_many(self, ids: Iterable[Any]) -> list[TableModelT | None]:
+        """Get multiple objects from the table by their primary keys with a single query.
+        The results are returned in the same order as the ids, with None for the missing ones."""
+        ids = list(ids)
+        if not ids:
+            return []
+
+        record_read(self, ids)
+        if self.memory is not None:
+            return [self.get(id) for id in ids]
+
+        cursor = self._collection.find({self.primary_key: {"$in": list(dict.fromkeys(ids))}})
+        objects = {doc[self.primary_key]: self.load_object(doc) for doc in cursor}
+        return [objects.get(id) for id in ids]
+
+
+    def exists(self, query: dict, **kwargs) -> bool:
+        """Check if at least one object in the table match the query, without loading it."""
+        record_read(self, None)
+        if self.memory is not None and not kwargs:
+            ids = self.memory.match(query, limit=1)
+            if ids is not None:
+                return bool(ids)
+
+        return self._collection.find_one(query, projection={"_id": 1}, **kwargs) is not None
+
+
+    def count(self, query: dict | None = None, **kwargs) -> int:
+        """Count the objects in the table that match the query."""
+        record_read(self, None)
+        if self.memory is not None and not kwargs:
+            ids = self.memory.match(query)
+            if ids is not None:
+                return len(ids)
+
+        return self._collection.count_documents(query or {}, **kwargs)
+
+
+    def estimated_count(self, **kwargs) -> int:
+        """Get an estimation of the number of objects in the table from the collection metadata."""
+        record_read(self, None)
+        return self._collection.estimated_document_count(**kwargs)
+
+
+    def distinct(self, key: str, query: dict | None = None, **kwargs) -> list[Any]:
+        """Get the distinct values of a field for the objects that match the query."""
+        record_read(self, None)
+        return self._collection.distinct(key, query, **kwargs)
+
+
+    def aggregate(self,
+                  pipeline: list[dict],
+                  model: Type[ResultModelT] | None = None,
+                  **kwargs) -> list[ResultModelT] | list[dict]:
+        """Run an aggregation pipeline on the table.
+        The output documents are validated into the model if one is given, else returned as raw dicts."""
+        record_read(self, None)
+        cursor = self._collection.aggregate(pipeline, **kwargs)
+        if model is None:
+            return list(cursor)
+        return [model.model_validate(doc) for doc in cursor]
+
+
     def insert(self, object: TableModelT, comment: str | None = None) -> None:
         """Insert an object in the table."""
-        exists = self.get(self.get_id_of(object))
-        if exists is not None:
+        if self.exists({self.primary_key: self.get_id_of(object)}):
             raise ObjectAlreadyExists((
                 "The object you tried to insert in {} already exists in the table.\n"
                 "Prefer using .push() method that update the object if it already exists instead of .insert().\n\n"
                 "Object you tried to insert:\n{}".format(_pretty(self), _pretty(object))
             ))
-        self._collection.insert_one(object.model_dump(), comment=comment)
+        self._flush_write_behind()
+        document = object.model_dump()
+        with self._stamping() as seq:
+            if seq is not None:
+                document[self.versions.field] = seq
+            self._collection.insert_one(document, comment=comment)
+        if self.versions is not None:
+            self.versions.revive(self.get_id_of(object))
+        self._notify_write(self.get_id_of(object))
 
 
     def insert_many_iter(self, objects: list[TableModelT], comment: str | None = None) -> None:
@@ -195,44 +403,332 @@ class Table(Generic[TableModelT]):
 
     def update_many(self, filter: dict, update: dict, comment: str | None = None) -> None:
         """Update objects in the table that are mathing the filter."""
-        self._collection.update_many(filter, update, comment=comment)
+        self._flush_write_behind()
+        with self._stamping() as seq:
+            self._collection.update_many(filter, self._stamp(update, seq), comment=comment)
+        self._notify_write(None)
 
 
     def remove_many(self, filter: dict, comment: str | None = None) -> None:
         """Remove objects from the table that are mathing the filter."""
+        self._flush_write_behind()
+        if self.versions is not None:
+            removed = [doc[self.primary_key] for doc in self._collection.find(filter, projection={self.primary_key: 1})]
         self._collection.delete_many(filter, comment=comment)
+        if self.versions is not None:
+            self.versions.bury(removed)
+        self._notify_write(None)
 
 
     def update(self, object_or_id: TableModelT | Any, update: dict, comment: str | None = None) -> None:
         """Update an object in the table by its primary key."""
         object_id = object_or_id if (not isinstance(object_or_id, self.model)) \
             else self.get_id_of(object_or_id)
-        self._collection.update_one({self.primary_key: object_id}, update, comment=comment)
+
+        if self.write_behind is not None and comment is None and self.write_behind.can_buffer(update):
+            # the write hooks are called and the update is stamped when the buffer is flushed
+            self.write_behind.add(object_id, update)
+            return
+
+        self._flush_write_behind()
+        with self._stamping() as seq:
+            self._collection.update_one({self.primary_key: object_id}, self._stamp(update, seq), comment=comment)
+        self._notify_write(object_id)
 
 
     def remove(self, object_or_id: TableModelT | Any, comment: str | None = None) -> None:
         """Remove an object from the table by its primary key."""
         object_id = object_or_id if (not isinstance(object_or_id, self.model)) \
             else self.get_id_of(object_or_id)
-        self._collection.delete_one({self.primary_key: object_id}, comment=comment)
+        self._flush_write_behind()
+        result = self._collection.delete_one({self.primary_key: object_id}, comment=comment)
+        if self.versions is not None and result.deleted_count:
+            self.versions.bury([object_id])
+        self._notify_write(object_id)
 
 
     def push(self, object: TableModelT, comment: str | None = None) -> None:
         """Insert or update an object in the table depending if it already exists."""
         object_id = self.get_id_of(object)
-        exists = self.get(object_id)
 
-        if exists is None:
+        if not self.exists({self.primary_key: object_id}):
             self.insert(object, comment)
         else:
             # remove then insert
-            self.remove_many({self.primary_key: object_id}, comment)
+            self.remove(object_id, comment)
             self.insert(object, comment)
 
 
+    def save(self, object: TableModelT, comment: str | None = None) -> None:
+        """Update an existing object in the table with only the fields changed since it was loaded.
+        With a version field, raise `ConcurrentModification` if the object has been saved by someone else since."""
+        request = self._save_request(object)
+        if request is None:
+            return
+
+        filter, update = request
+        self._flush_write_behind()
+        with self._stamping() as seq:
+            result = self._collection.update_one(filter, self._stamp(update, seq), comment=comment)
+        if self.tracker is not None and self.tracker.version_field and result.matched_count == 0:
+            raise ConcurrentModification((
+                "The object {} has been modified in {} since it was loaded."
+            ).format(self.get_id_of(object), self))
+        self._saved(object)
+
+
+    def save_many(self, objects: list[TableModelT], comment: str | None = None) -> None:
+        """Save multiple objects in one bulk write, sending only the fields changed since they were loaded."""
+        requests: dict[Any, tuple[TableModelT, dict, dict]] = {}
+        for object in objects:
+            request = self._save_request(object)
+            if request is not None:
+                requests[self.get_id_of(object)] = (object, *request)
+        if not requests:
+            return
+
+        self._flush_write_behind()
+        with self._stamping() as seq:
+            result = self._collection.bulk_write(
+                [UpdateOne(filter, self._stamp(update, seq)) for _, filter, update in requests.values()],
+                ordered=False, comment=comment)
+
+        version_field = self.tracker.version_field if self.tracker is not None else None
+        if not version_field or result.matched_count == len(requests):
+            for object, _, _ in requests.values():
+                self._saved(object)
+            return
+
+        # the bulk result doesn't tell which updates matched, find the objects stored with the fields we saved
+        cursor = self._collection.find({self.primary_key: {"$in": list(requests)}})
+        stored = {doc[self.primary_key]: self.model.model_validate(doc).model_dump() for doc in cursor}
+        conflicts = []
+        for object_id, (object, _, update) in requests.items():
+            # the untracked objects are saved without incrementing their version
+            expected = object.model_dump()
+            if version_field in update.get("$set", {}):
+                expected[version_field] = update["$set"][version_field]
+            fields = [*update.get("$set", {}), *update.get("$unset", {})]
+
+            document = stored.get(object_id)
+            if document is not None and all(_get_field(document, field) == _get_field(expected, field)
+                                            for field in fields):
+                self._saved(object)
+            else:
+                conflicts.append(object_id)
+
+        raise ConcurrentModification((
+            "The objects {} have been modified in {} since they were loaded."
+        ).format(conflicts, self))
+
+
+    def enable_change_tracking(self, version_field: str | None = None) -> ChangeTracker:
+        """Remember the state of the loaded objects so `.save()` sends only their changes.
+        With a version field, the field is incremented at each save and checked against the stored one."""
+        self.tracker = ChangeTracker(version_field)
+        return self.tracker
+
+
+    def _save_request(self, object: TableModelT) -> tuple[dict, dict] | None:
+        object_id = self.get_id_of(object)
+        filter = {self.primary_key: object_id}
+
+        if self.tracker is None:
+            update = {"$set": object.model_dump()}
+        else:
+            update = self.tracker.changes_of(object)
+            if not update:
+                return None
+
+            version_field = self.tracker.version_field
+            snapshot = self.tracker.snapshot_of(object)
+            if version_field and snapshot is not None:
+                version = snapshot.get(version_field) or 0
+                filter[version_field] = snapshot.get(version_field)
+                update.setdefault("$set", {})[version_field] = version + 1
+
+        update.get("$set", {}).pop(self.primary_key, None)
+        return filter, update
+
+
+    def _stamping(self) -> ContextManager[int | None]:
+        """Get the sequence number of a write in the block, None if the table is not versioned."""
+        return self.versions.write() if self.versions is not None else nullcontext()
+
+
+    def _stamp(self, update: dict, seq: int | None) -> dict:
+        return update if seq is None else self.versions.stamp(update, seq)
+
+
+    def _saved(self, object: TableModelT) -> None:
+        version_field = self.tracker.version_field if self.tracker is not None else None
+        if version_field:
+            snapshot = self.tracker.snapshot_of(object)
+            if snapshot is not None:
+                setattr(object, version_field, (snapshot.get(version_field) or 0) + 1)
+
+        if self.tracker is not None:
+            self.tracker.track(object)
+        self._notify_write(self.get_id_of(object))
+
+
+    def enable_versioning(self,
+                          field: str = "_seq",
+                          clock: str = "sequence",
+                          retention: float | None = RETENTION,
+                          max_write_time: float = 60.0,
+                          settle_time: float = 1.0) -> VersionStamps:
+        """Stamp the objects with an increasing sequence number in `field` at each write, and keep a tombstone
+        of the removed ones for `retention` seconds, so `.changes_since()` reads only the changes from an index.
+        With the "sequence" clock the numbers come from a counter in the database, and the ones of the writes
+        in flight (for up to `max_write_time` seconds) are recorded with it, which costs 2 more round trips
+        per write. With "time" they come from the clock of the process, without a round trip, and the changes
+        are synced after `settle_time` seconds. The objects written before are stamped at the first sync."""
+        self.versions = VersionStamps(self, field, clock, retention, max_write_time, settle_time)
+        return self.versions
+
+
+    def changes_since(self, token: str | None, query: dict | None = None, limit: int = 1000) -> ChangeSet:
+        """Get the objects upserted and removed since a sync token, and the token of the next call.
+        Without token all the objects are returned. The changed objects not matching the query are returned
+        as removed. Raise `ExpiredSyncToken` if the token is older than the kept tombstones."""
+        if self.versions is None:
+            raise StelladdonError(f"The versioning of {self} is not enabled, use .enable_versioning().")
+        record_read(self, None)
+        return self.versions.changes_since(token, query, limit)
+
+
+    def enable_write_behind(self,
+                            max_size: int = 1000,
+                            max_delay: float = 1.0,
+                            write_concern: int = 1) -> WriteBehindBuffer:
+        """Buffer the `$inc`, `$set` and `$max` updates made with `.update()` and send them as bulk writes.
+        The buffer is flushed when it holds `max_size` objects, every `max_delay` seconds and at exit."""
+        if self.write_behind is not None:
+            self.write_behind.close()
+        self.write_behind = WriteBehindBuffer(self, max_size, max_delay, write_concern)
+        return self.write_behind
+
+
+    def disable_write_behind(self) -> None:
+        """Flush the pending updates and stop buffering them."""
+        if self.write_behind is not None:
+            self.write_behind.close()
+            self.write_behind = None
+
+
+    def flush(self) -> None:
+        """Send the updates pending in the write-behind buffer, if any."""
+        self._flush_write_behind()
+
+
+    def use_shared_cache(self, cache: SharedObjectCache | None) -> None:
+        """Cache the objects got by primary key in a cache shared by all the processes of the host.
+        The writes made through the table invalidate the cached objects in every process."""
+        if self.shared_cache is not None:
+            self.write_hooks.remove(self.shared_cache.invalidate)
+
+        self.shared_cache = cache
+        if cache is not None:
+            self.write_hooks.append(cache.invalidate)
+
+
+    def enable_coalescing(self, max_wait: float = 5.0) -> QueryCoalescer:
+        """Share the result of the `find`, `find_one` and `get` queries between the threads
+        running the same query at the same time, instead of sending it once per thread."""
+        self.coalescer = QueryCoalescer(max_wait)
+        return self.coalescer
+
+
+    def enable_memory(self,
+                      indexes: list[str] | None = None,
+                      refresh_interval: float | None = None,
+                      offline: bool = False) -> MemoryStore:
+        """Load the whole table in memory to answer `get`, `find`, `count`... locally, for small read-mostly tables.
+        The queries using only equality, `$in` and comparison operators are answered from hash indexes
+        on the primary key and the given fields, the others are sent to the database.
+        The objects written through the table are reloaded, and the whole table every `refresh_interval` seconds.
+        The table is loaded by the app warmup or at the first read, so it can be enabled before the workers fork.
+        With `offline`, the table is only stored in memory and doesn't need a database server (tests, benchmarks)."""
+        self.disable_memory()
+        memory = MemoryStore(self, indexes or [], refresh_interval, offline)
+        if not offline:
+            self.write_hooks.append(memory._on_write)
+        self.memory = memory
+        return memory
+
+
+    def disable_memory(self) -> None:
+        """Stop holding the table in memory and read it from the database again."""
+        if self.memory is not None:
+            self.memory.close()
+            if self.memory._on_write in self.write_hooks:
+                self.write_hooks.remove(self.memory._on_write)
+            self.memory = None
+
+
+    def _from_memory(self, objects: list[TableModelT]) -> list[TableModelT]:
+        # the objects of the store are shared by all the requests, a caller modifying its object must not change them
+        objects = [object.model_copy(deep=True) for object in objects]
+        if self.tracker is not None:
+            for object in objects:
+                self.tracker.track(object)
+        return objects
+
+
+    def _find_one_document(self, query: dict, **kwargs) -> dict | None:
+        if self.coalescer is None:
+            return self._collection.find_one(query, **kwargs)
+
+        key = ("find_one", repr(query), repr(sorted(kwargs.items())))
+        return self.coalescer.run(key, lambda: self._collection.find_one(query, **kwargs))
+
+
+    def _notify_write(self, object_id: Any | None) -> None:
+        for hook in self.write_hooks:
+            hook(self, object_id)
+
+
+    def _flush_write_behind(self) -> None:
+        if self.write_behind is not None:
+            self.write_behind.flush()
+
+
+    def _write_collection(self, write_concern: int):
+        return self._collection.with_options(write_concern=WriteConcern(w=write_concern))
+
+
     @property
     def _collection(self):
+        if self.memory is not None and self.memory.offline:
+            return self.memory.collection
+
         _pymongo_client = self.database.client.client
         if not _pymongo_client:
             raise StelladdonError("The database client is not connected to a MongoDB server.")
         return _pymongo_client[self.database.name][self.collection]
+
+
+
+class TableCursor(Generic[TableModelT]):
+    """A lazy iterator over the objects of a table returned by a query."""
+    table: Table[TableModelT]
+    """The table that the objects are loaded into."""
+
+    def __init__(self, table: Table[TableModelT], cursor: Any) -> None:
+        """Create a table cursor. Should not be used directly, use `Table.iter_find()`."""
+        self.table = table
+        self._cursor = cursor
+
+
+    def __iter__(self) -> "TableCursor[TableModelT]":
+        return self
+
+
+    def __next__(self) -> TableModelT:
+        return self.table.load_object(next(self._cursor))
+
+
+    def close(self) -> None:
+        """Close the underlying database cursor."""
+        self._cursor.close()
@@ -6,7 +6,7 @@ if TYPE_CHECKING:
 
 __all__ = [
     "StelladdonError", "ObjectAlreadyExists", "ObjectNotFound",
-    "TableNotFound"
+    "TableNotFound", "ConcurrentModification", "InvalidSyncToken", "ExpiredSyncToken", "Overloaded"
 ]
 
 class StelladdonError(Exception):
@@ -27,6 +27,18 @@ class TableNotFound(StelladdonError):
     """Raised when a table is not found in the database."""
     pass
 
+class ConcurrentModification(StelladdonError):
+    """Raised when saving an object that has been modified in the database since it was loaded."""
+    pass
+
+class InvalidSyncToken(StelladdonError):
+    """Raised when asking the changes of a table since a token it didn't give."""
+    pass
+
+class ExpiredSyncToken(InvalidSyncToken):
+    """Raised when asking the changes of a table since a token older than the tombstones it kept."""
+    pass
+
 
 
 class HTTPException(Exception):
@@ -46,11 +58,13 @@ class StellaAPIError(HTTPException):
                  ctx: "Context",
                  code: str,
                  status_code: int,
-                 message: str | None) -> None:
+                 message: str | None,
+                 headers: dict[str, str] | None = None) -> None:
         super().__init__(ctx)
         self.code = code
         self.status_code = status_code
         self.message = message
+        self.headers = headers
 
 
     @property
@@ -96,3 +110,15 @@ class InternalError(StellaAPIError):
                  exception: Exception) -> None:
         super().__init__(ctx, "stellapi.internal_error", 500, message)
         self.exception = exception
+
+
+
+class Overloaded(StellaAPIError):
+
+    def __init__(self,
+                 ctx: "Context",
+                 retry_after: int) -> None:
+        super().__init__(ctx, "stellapi.overloaded", 503,
+                         "The server is overloaded, retry later.",
+                         headers={"Retry-After": str(retry_after)})
+        self.retry_after = retry_after
@@ -0,0 +1,248 @@
+from typing import Any, TYPE_CHECKING
+from asyncio import Queue, create_task, wait, FIRST_COMPLETED
+
+from pydantic import ValidationError
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+
+from .database import Table
+
+if TYPE_CHECKING:
+    from .routing import Context
+
+
+__all__ = [
+    "Ingest", "IngestionSummary"
+]
+
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+
+class IngestionSummary:
+    """The result of the ingestion of an NDJSON body into a table."""
+    lines: int
+    """The number of non-empty lines read."""
+    inserted: int
+    """The number of objects inserted."""
+    duplicates: int
+    """The number of objects not inserted because their primary key already exists."""
+    invalid: int
+    """The number of lines that are not valid JSON objects of the table model."""
+    failed: int
+    """The number of valid objects that the database refused for another reason."""
+    errors: list[dict[str, Any]]
+    """The first errors, with their line number."""
+
+    def __init__(self) -> None:
+        self.lines = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.failed = 0
+        self.errors: list[dict[str, Any]] = []
+
+
+    def __repr__(self) -> str:
+        return (f"IngestionSummary(lines={self.lines}, inserted={self.inserted}, duplicates={self.duplicates}, "
+                f"invalid={self.invalid}, failed={self.failed})")
+
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "lines": self.lines,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+
+class Ingest:
+    """Make a route read its body as NDJSON, one object of the table model per line, and insert the objects
+    in the table with unordered bulk writes while the body is received. The parsing waits for the writes when
+    `max_pending` batches are waiting, so the memory used doesn't depend on the size of the body.
+    With a `ShardedTable`, each batch is split by shard and written to the shard of its objects."""
+    table: Table
+    """The table the objects are inserted in."""
+    batch_size: int
+    """The number of objects of each bulk write."""
+    max_pending: int
+    """The number of validated batches waiting to be written before the reading of the body is paused."""
+    max_line_size: int
+    """The size in bytes above which a line is rejected without being parsed."""
+    max_errors: int
+    """The number of errors kept in the summary."""
+
+    def __init__(self,
+                 table: Table,
+                 batch_size: int = 1000,
+                 max_pending: int = 2,
+                 max_line_size: int = 1024 * 1024,
+                 max_errors: int = 20) -> None:
+        self.table = table
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_line_size = max_line_size
+        self.max_errors = max_errors
+
+
+    async def run(self, ctx: "Context") -> IngestionSummary:
+        """Read the body of the request and insert its objects in the table."""
+        summary = IngestionSummary()
+        queue: Queue[list[dict] | None] = Queue(maxsize=self.max_pending)
+        writer = create_task(self._write_batches(queue, summary))
+        self.table.flush()
+
+        try:
+            batch: list[dict] = []
+            async for line_number, line in self._lines(ctx, summary):
+                summary.lines += 1
+                try:
+                    object = self.table.model.model_validate_json(line)
+                except ValidationError as e:
+                    summary.invalid += 1
+                    errors = e.errors(include_url=False, include_context=False, include_input=False)
+                    self._add_error(summary, line_number, errors)
+                    continue
+
+                batch.append(object.model_dump())
+                if len(batch) >= self.batch_size:
+                    await self._put(queue, writer, batch)
+                    batch = []
+
+            if batch:
+                await self._put(queue, writer, batch)
+            await self._put(queue, writer, None)
+            await writer
+        finally:
+            if not writer.done():
+                writer.cancel()
+            if summary.inserted:
+                for table in getattr(self.table, "shards", [self.table]):
+                    table._notify_write(None)
+
+        return summary
+
+
+    async def _lines(self, ctx: "Context", summary: IngestionSummary):
+        buffer = bytearray()
+        line_number = 0
+        skipping = False
+
+        async for chunk in ctx.req.stream():
+            start = 0
+            while True:
+                end = chunk.find(b"\n", start)
+                if end == -1:
+                    if not skipping:
+                        buffer += chunk[start:]
+                        if len(buffer) > self.max_line_size:
+                            skipping = True
+                            buffer.clear()
+                    break
+
+                line_number += 1
+                if buffer:
+                    buffer += chunk[start:end]
+                    line = bytes(buffer).strip()
+                    buffer.clear()
+                else:
+                    line = chunk[start:end].strip()
+                start = end + 1
+
+                if skipping or len(line) > self.max_line_size:
+                    skipping = False
+                    self._reject_line(summary, line_number)
+                elif line:
+                    yield line_number, line
+
+        line = bytes(buffer).strip()
+        if skipping or len(line) > self.max_line_size:
+            self._reject_line(summary, line_number + 1)
+        elif line:
+            yield line_number + 1, line
+
+
+    async def _put(self, queue: Queue, writer, batch: list[dict] | None) -> None:
+        put = create_task(queue.put(batch))
+        await wait((put, writer), return_when=FIRST_COMPLETED)
+        if not put.done():
+            # the writer failed, stop reading the body and raise its error
+            put.cancel()
+            await writer
+
+
+    async def _write_batches(self, queue: Queue, summary: IngestionSummary) -> None:
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            await run_in_threadpool(self._write, batch, summary)
+
+
+    def _write(self, batch: list[dict], summary: IngestionSummary) -> None:
+        shard_of = getattr(self.table, "shard_of", None)
+        if shard_of is None:
+            self._write_to(self.table, batch, summary)
+            return
+
+        primary_key = self.table.primary_key
+        by_shard: dict[Table, list[dict]] = {}
+        for document in batch:
+            by_shard.setdefault(shard_of(document.get(primary_key)), []).append(document)
+        for shard, documents in by_shard.items():
+            self._write_to(shard, documents, summary)
+
+
+    def _write_to(self, table: Table, batch: list[dict], summary: IngestionSummary) -> None:
+        primary_key = table.primary_key
+
+        # skip the objects already in the table or earlier in the batch, with one query per batch
+        unique: dict[Any, dict] = {}
+        for document in batch:
+            unique.setdefault(document.get(primary_key), document)
+        existing = {document[primary_key] for document in table._collection.find(
+            {primary_key: {"$in": list(unique)}}, projection={primary_key: 1})}
+        documents = [document for id, document in unique.items() if id not in existing]
+        summary.duplicates += len(batch) - len(documents)
+        if not documents:
+            return
+
+        try:
+            # one sequence number for the batch, in flight until the bulk write is done
+            with table._stamping() as seq:
+                if seq is not None:
+                    for document in documents:
+                        document[table.versions.field] = seq
+                result = table._collection.bulk_write([InsertOne(document) for document in documents], ordered=False)
+            inserted = result.inserted_count
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == DUPLICATE_KEY_ERROR:
+                    summary.duplicates += 1
+                else:
+                    summary.failed += 1
+                    if len(summary.errors) < self.max_errors:
+                        summary.errors.append({"id": documents[error["index"]].get(primary_key),
+                                               "error": error.get("errmsg")})
+        summary.inserted += inserted
+
+        if table.versions is not None:
+            table.versions.revive_many([document.get(primary_key) for document in documents])
+
+
+    def _reject_line(self, summary: IngestionSummary, line_number: int) -> None:
+        summary.lines += 1
+        summary.invalid += 1
+        self._add_error(summary, line_number, f"The line is larger than {self.max_line_size} bytes.")
+
+
+    def _add_error(self, summary: IngestionSummary, line_number: int, error: Any) -> None:
+        if len(summary.errors) < self.max_errors:
+            summary.errors.append({"line": line_number, "error": error})
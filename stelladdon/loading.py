@@ -0,0 +1,162 @@
+from typing import Generic, Any, TYPE_CHECKING
+from asyncio import Future, get_running_loop, gather
+
+from pydantic_core import core_schema
+
+from .typin import TableModelT
+from .database import Table
+
+if TYPE_CHECKING:
+    from .routing import Context
+
+
+__all__ = [
+    "TableLoader", "Reference", "Ref"
+]
+
+
+
+class TableLoader(Generic[TableModelT]):
+    """Batch the `Table.get` calls awaited in the same event loop tick into a single `Table.get_many` query.
+    A loader is meant to live for one request only, use `Context.loader()` to get one."""
+    table: Table[TableModelT]
+    """The table that the objects are loaded from."""
+
+    def __init__(self, table: Table[TableModelT]) -> None:
+        """Create a loader for the given table. Should not be used directly."""
+        self.table = table
+        self._cache: dict[Any, Future] = {}
+        self._pending: list[Any] = []
+
+
+    def load(self, id: Any) -> "Future[TableModelT | None]":
+        """Load an object by its primary key. The query is sent once the current tick is over."""
+        future = self._cache.get(id)
+        if future is not None:
+            return future
+
+        loop = get_running_loop()
+        future = loop.create_future()
+        self._cache[id] = future
+
+        if not self._pending:
+            loop.call_soon(self._dispatch)
+        self._pending.append(id)
+        return future
+
+
+    async def load_many(self, ids: list[Any]) -> list[TableModelT | None]:
+        """Load multiple objects by their primary keys, in the same order as the ids."""
+        return list(await gather(*(self.load(id) for id in ids)))
+
+
+    def prime(self, object: TableModelT) -> None:
+        """Put an already loaded object in the loader cache."""
+        id = self.table.get_id_of(object)
+        if id in self._cache:
+            return
+
+        future = get_running_loop().create_future()
+        future.set_result(object)
+        self._cache[id] = future
+
+
+    def _dispatch(self) -> None:
+        ids, self._pending = self._pending, []
+
+        try:
+            objects = self.table.get_many(ids)
+        except Exception as e:
+            for id in ids:
+                future = self._cache.pop(id)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for id, object in zip(ids, objects):
+            future = self._cache[id]
+            if not future.done():
+                future.set_result(object)
+
+
+
+class Reference(Generic[TableModelT]):
+    """A reference to an object of another table, stored as its primary key in the database."""
+    table: Table[TableModelT]
+    """The table that the referenced object belongs to."""
+    id: Any
+    """The primary key of the referenced object."""
+
+    def __init__(self, table: Table[TableModelT], id: Any) -> None:
+        self.table = table
+        self.id = id
+
+
+    def __repr__(self) -> str:
+        return f"Reference({self.table.collection!r}, {self.id!r})"
+
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Reference):
+            return self.table is other.table and self.id == other.id
+        return NotImplemented
+
+
+    def __hash__(self) -> int:
+        return hash((id(self.table), self.id))
+
+
+    async def resolve(self, ctx: "Context") -> TableModelT | None:
+        """Resolve the referenced object through the request loader of the table."""
+        return await ctx.loader(self.table).load(self.id)
+
+
+
+class ReferenceArg:
+
+    def __init__(self, table: Table) -> None:
+        self.table = table
+
+
+    def validate(self, value: Any) -> Reference:
+        if isinstance(value, Reference):
+            return value
+
+        if isinstance(value, self.table.model):
+            return Reference(self.table, self.table.get_id_of(value))
+
+        return Reference(self.table, value)
+
+
+    def __get_pydantic_core_schema__(self, source_type: Any, handler: Any) -> core_schema.CoreSchema:
+        # the reference is documented in the JSON schema as the primary key of the referenced object
+        id_schema = self._id_schema(handler)
+        return core_schema.no_info_plain_validator_function(
+            self.validate,
+            json_schema_input_schema=id_schema,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda ref: ref.id if isinstance(ref, Reference) else ref,
+                return_schema=id_schema
+            )
+        )
+
+
+    def _id_schema(self, handler: Any) -> core_schema.CoreSchema:
+        for name, field in self.table.model.model_fields.items():
+            if self.table.primary_key in (name, field.alias):
+                return handler.generate_schema(field.annotation)
+        return core_schema.any_schema()
+
+
+
+def Ref(table: Table) -> ReferenceArg:
+    """
+    A special type hint to declare a model field as a reference to an object of another table.
+    The field is stored as the primary key of the object, and is resolved with `Reference.resolve()`.
+
+    ```
+    class Post(APIObject):
+        author: Annotated[Reference[User], Ref(UserTable)]
+    ```
+    """
+    return ReferenceArg(table)
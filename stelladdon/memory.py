@@ -0,0 +1,710 @@
+from typing import Any, Callable, Iterable, Iterator, TYPE_CHECKING
+from threading import Lock, RLock, Event, Thread
+from copy import deepcopy
+from itertools import count as counter
+
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pymongo.results import InsertOneResult, UpdateResult, DeleteResult, BulkWriteResult
+
+from .utils import _sort_key
+from .errors import StelladdonError
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+    from .database import Table
+
+
+__all__ = [
+    "MemoryStore", "MemoryCollection"
+]
+
+
+MISSING = object()
+QUERY_OPERATORS = ("$eq", "$ne", "$in", "$nin", "$gt", "$gte", "$lt", "$lte", "$exists")
+UPDATE_OPERATORS = ("$set", "$unset", "$inc", "$max", "$min", "$push", "$addToSet")
+
+
+
+class _Unsupported(Exception):
+    pass
+
+
+
+def _get_path(document: dict, path: str) -> Any:
+    value: Any = document
+    for key in path.split("."):
+        if isinstance(value, list):
+            # the paths through arrays match any of their elements
+            raise _Unsupported(path)
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+    return value
+
+
+def _same(value: Any, operand: Any) -> bool:
+    # unlike Python, MongoDB doesn't consider the booleans as numbers (but 1 and 1.0 are equal)
+    return value == operand and isinstance(value, bool) == isinstance(operand, bool)
+
+
+def _equals(value: Any, operand: Any) -> bool:
+    if value is MISSING:
+        return operand is None
+    if _same(value, operand):
+        return True
+    return isinstance(value, list) and any(_same(item, operand) for item in value)
+
+
+def _compare(value: Any, operand: Any, op: str) -> bool:
+    values = value if isinstance(value, list) else [value]
+    for value in values:
+        if value is MISSING or value is None or isinstance(value, bool) != isinstance(operand, bool):
+            continue
+        try:
+            if ((op == "$gt" and value > operand) or (op == "$gte" and value >= operand)
+                    or (op == "$lt" and value < operand) or (op == "$lte" and value <= operand)):
+                return True
+        except TypeError:
+            # MongoDB only compares the values of the same type
+            continue
+    return False
+
+
+def _is_operators(condition: Any) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+
+def _check_query(query: dict) -> None:
+    for path, condition in query.items():
+        if path.startswith("$"):
+            raise _Unsupported(path)
+        if _is_operators(condition):
+            for op in condition:
+                if op not in QUERY_OPERATORS:
+                    raise _Unsupported(op)
+
+
+def _matches(document: dict, query: dict) -> bool:
+    for path, condition in query.items():
+        value = _get_path(document, path)
+        if not _is_operators(condition):
+            if not _equals(value, condition):
+                return False
+            continue
+
+        for op, operand in condition.items():
+            if op == "$eq":
+                matched = _equals(value, operand)
+            elif op == "$ne":
+                matched = not _equals(value, operand)
+            elif op == "$in":
+                matched = any(_equals(value, item) for item in operand)
+            elif op == "$nin":
+                matched = not any(_equals(value, item) for item in operand)
+            elif op == "$exists":
+                matched = (value is not MISSING) == bool(operand)
+            else:
+                matched = _compare(value, operand, op)
+            if not matched:
+                return False
+    return True
+
+
+def _index_key(value: Any) -> tuple[bool, Any]:
+    # True and 1 have the same hash and are equal in Python, not in MongoDB
+    return isinstance(value, bool), value
+
+
+def _index_keys(value: Any) -> list[tuple[bool, Any]]:
+    if value is MISSING:
+        return [_index_key(None)]
+    values = [value]
+    if isinstance(value, list):
+        values.extend(value)
+    keys = []
+    for item in values:
+        try:
+            hash(item)
+        except TypeError:
+            continue
+        keys.append(_index_key(item))
+    return keys
+
+
+def _set_path(document: dict, path: str, value: Any) -> None:
+    *parents, key = path.split(".")
+    for parent in parents:
+        document = document.setdefault(parent, {})
+        if not isinstance(document, dict):
+            raise StelladdonError(f"Can't set {path!r}: one of its parents is not a document.")
+    document[key] = value
+
+
+def _unset_path(document: dict, path: str) -> None:
+    *parents, key = path.split(".")
+    for parent in parents:
+        document = document.get(parent)
+        if not isinstance(document, dict):
+            return
+    document.pop(key, None)
+
+
+def _apply_update(document: dict, update: dict) -> None:
+    if not _is_operators(update):
+        raise StelladdonError("The update must only contain update operators.")
+
+    for op, fields in update.items():
+        if op not in UPDATE_OPERATORS:
+            raise StelladdonError(f"The update operator {op} is not supported by the memory backend.")
+
+        for path, value in fields.items():
+            current = _get_path(document, path)
+            if op == "$set":
+                _set_path(document, path, deepcopy(value))
+            elif op == "$unset":
+                _unset_path(document, path)
+            elif op == "$inc":
+                _set_path(document, path, value if current is MISSING else current + value)
+            elif op == "$max":
+                if current is MISSING or value > current:
+                    _set_path(document, path, value)
+            elif op == "$min":
+                if current is MISSING or value < current:
+                    _set_path(document, path, value)
+            else:
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                array = [] if current is MISSING else current
+                if not isinstance(array, list):
+                    raise StelladdonError(f"Can't {op} to {path!r}: it is not an array.")
+                for item in items:
+                    if op == "$push" or item not in array:
+                        array.append(deepcopy(item))
+                _set_path(document, path, array)
+
+
+def _project(document: dict, projection: dict | list | None) -> dict:
+    if not projection:
+        return deepcopy(document)
+    if isinstance(projection, list):
+        projection = {path: 1 for path in projection}
+
+    include_id = bool(projection.get("_id", 1))
+    included = [path for path, flag in projection.items() if flag and path != "_id"]
+    if not included:
+        result = deepcopy(document)
+        for path, flag in projection.items():
+            if not flag:
+                _unset_path(result, path)
+        return result
+
+    result: dict = {}
+    if include_id and "_id" in document:
+        result["_id"] = deepcopy(document["_id"])
+    for path in included:
+        value = _get_path(document, path)
+        if value is not MISSING:
+            _set_path(result, path, deepcopy(value))
+    return result
+
+
+
+class _Contents:
+    """The documents, objects and indexes of a store, replaced at once when the whole table is reloaded."""
+
+    def __init__(self, fields: list[str]) -> None:
+        self.documents: dict[Any, dict] = {}
+        self.objects: dict[Any, "BaseModel"] = {}
+        self.order: dict[Any, int] = {}
+        self.indexes: dict[str, dict[Any, dict[Any, None]]] = {field: {} for field in fields}
+
+
+
+class MemoryStore:
+    """The whole content of a table held in memory as validated models, with hash indexes on the primary key
+    and on some fields. The queries using only equality, `$in` and comparison operators are answered
+    without a round trip to the database. The content is loaded by the warmup or at the first read,
+    and the periodic refresh started then. Should not be used directly, use `Table.enable_memory()`."""
+    table: "Table"
+    """The table whose content is held."""
+    indexes: list[str]
+    """The fields that have a hash index, in addition to the primary key."""
+    refresh_interval: float | None
+    """The time in seconds between two full reloads from the database, if periodic refresh is enabled."""
+    offline: bool
+    """If the store is the only storage of the table, instead of a copy of the database collection."""
+    hits: int
+    """The number of reads answered from memory."""
+    fallbacks: int
+    """The number of reads sent to the database because their query is not supported."""
+
+    def __init__(self,
+                 table: "Table",
+                 indexes: Iterable[str] = (),
+                 refresh_interval: float | None = None,
+                 offline: bool = False) -> None:
+        self.table = table
+        self.indexes = [field for field in indexes if field != table.primary_key]
+        self.refresh_interval = refresh_interval
+        self.offline = offline
+        self.hits = 0
+        self.fallbacks = 0
+        self.collection = MemoryCollection(self)
+
+        self._lock = RLock()
+        self._loading = Lock()
+        self._loaded = offline
+        self._positions = counter()
+        self._contents = _Contents([self.table.primary_key, *self.indexes])
+        self._written: set[Any] | None = None
+        self._closed = Event()
+        self._thread: Thread | None = None
+
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._contents.documents)
+
+
+    def __repr__(self) -> str:
+        return f"MemoryStore({self.table.collection!r} objects={len(self)} indexes={self.indexes})"
+
+
+    def load(self, documents: Iterable[dict]) -> None:
+        """Replace the content of the store with these documents and rebuild the indexes.
+        The new content is built aside, the readers see the previous one until it is complete."""
+        with self._lock:
+            self._written = set()
+        try:
+            contents = _Contents([self.table.primary_key, *self.indexes])
+            for document in documents:
+                self._put(contents, document, self.table.model.model_validate(document))
+
+            with self._lock:
+                # the objects written meanwhile may be older in the loaded documents
+                previous = self._contents
+                for object_id in self._written:
+                    if object_id in previous.documents:
+                        self._put(contents, previous.documents[object_id], previous.objects[object_id])
+                    elif object_id in contents.documents:
+                        self._remove(contents, object_id)
+                self._contents = contents
+                self._loaded = True
+        finally:
+            with self._lock:
+                self._written = None
+
+
+    def refresh(self) -> None:
+        """Reload the whole collection from the database."""
+        if self.offline:
+            return
+        self.load(self.table._collection.find({}))
+
+        if self.refresh_interval is not None and self._thread is None and not self._closed.is_set():
+            # started after the first load, in the process that uses the store
+            self._thread = Thread(target=self._run, name=f"stelladdon-memory-{self.table.collection}", daemon=True)
+            self._thread.start()
+
+
+    def reload(self, object_id: Any) -> None:
+        """Reload one object from the database, or remove it from the store if it doesn't exist anymore."""
+        if self.offline:
+            return
+        document = self.table._collection.find_one({self.table.primary_key: object_id})
+        with self._lock:
+            if document is None:
+                self.discard(object_id)
+            else:
+                self.put(document)
+
+
+    def put(self, document: dict) -> None:
+        """Add or replace a document in the store."""
+        object = self.table.model.model_validate(document)
+        with self._lock:
+            self._put(self._contents, document, object)
+            if self._written is not None:
+                self._written.add(document[self.table.primary_key])
+
+
+    def discard(self, object_id: Any) -> None:
+        """Remove a document from the store, if it is in."""
+        with self._lock:
+            if self._written is not None:
+                self._written.add(object_id)
+            if object_id in self._contents.documents:
+                self._remove(self._contents, object_id)
+
+
+    def get(self, object_id: Any) -> "BaseModel | None":
+        self._ensure_loaded()
+        self.hits += 1
+        return self._contents.objects.get(object_id)
+
+
+    def document_of(self, object_id: Any) -> dict | None:
+        self._ensure_loaded()
+        return self._contents.documents.get(object_id)
+
+
+    def match(self,
+              query: dict | None,
+              sort: list[tuple[str, int]] | None = None,
+              skip: int = 0,
+              limit: int | None = None) -> list[Any] | None:
+        """Get the primary keys of the objects matching the query, or None if the query is not supported."""
+        return self._select(query, sort, skip, limit, lambda contents, object_id: object_id)
+
+
+    def find(self,
+             query: dict | None,
+             sort: list[tuple[str, int]] | None = None,
+             skip: int = 0,
+             limit: int | None = None) -> list["BaseModel"] | None:
+        """Get the objects matching the query, or None if the query is not supported."""
+        return self._select(query, sort, skip, limit, lambda contents, object_id: contents.objects[object_id])
+
+
+    def find_documents(self,
+                       query: dict | None,
+                       sort: list[tuple[str, int]] | None = None,
+                       skip: int = 0,
+                       limit: int | None = None) -> list[dict] | None:
+        """Get the documents matching the query, or None if the query is not supported."""
+        return self._select(query, sort, skip, limit, lambda contents, object_id: contents.documents[object_id])
+
+
+    def close(self) -> None:
+        """Stop the periodic refresh."""
+        self._closed.set()
+
+
+    def _select(self,
+                query: dict | None,
+                sort: list[tuple[str, int]] | None,
+                skip: int,
+                limit: int | None,
+                pick: Callable[[_Contents, Any], Any]) -> list[Any] | None:
+        # the objects are picked under the lock, from the same contents as the matching
+        query = query or {}
+        try:
+            _check_query(query)
+            self._ensure_loaded()
+            with self._lock:
+                contents = self._contents
+                ids = [object_id for object_id in self._candidates(contents, query)
+                       if _matches(contents.documents[object_id], query)]
+                if sort:
+                    key = _sort_key(sort)
+                    ids.sort(key=lambda object_id: key(contents.documents[object_id]))
+                end = None if not limit else skip + limit
+                selected = [pick(contents, object_id) for object_id in ids[skip:end]]
+        except _Unsupported:
+            self.fallbacks += 1
+            return None
+
+        self.hits += 1
+        return selected
+
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._loading:
+            if not self._loaded:
+                self.refresh()
+
+
+    def _put(self, contents: _Contents, document: dict, object: "BaseModel") -> None:
+        object_id = document[self.table.primary_key]
+        if object_id in contents.documents:
+            self._unindex(contents, object_id)
+        else:
+            contents.order[object_id] = next(self._positions)
+        contents.documents[object_id] = document
+        contents.objects[object_id] = object
+        for field, index in contents.indexes.items():
+            for key in _index_keys(_get_path(document, field)):
+                index.setdefault(key, {})[object_id] = None
+
+
+    def _remove(self, contents: _Contents, object_id: Any) -> None:
+        self._unindex(contents, object_id)
+        del contents.documents[object_id]
+        del contents.objects[object_id]
+        del contents.order[object_id]
+
+
+    def _candidates(self, contents: _Contents, query: dict) -> list[Any]:
+        candidates: dict[Any, None] | None = None
+        for path, condition in query.items():
+            index = contents.indexes.get(path)
+            if index is None:
+                continue
+
+            if _is_operators(condition):
+                if set(condition) == {"$eq"}:
+                    keys = [condition["$eq"]]
+                elif set(condition) == {"$in"}:
+                    keys = list(condition["$in"])
+                else:
+                    continue
+            else:
+                keys = [condition]
+
+            try:
+                found: dict[Any, None] = {}
+                for key in keys:
+                    found.update(index.get(_index_key(key), {}))
+            except TypeError:
+                # unhashable values are only found by scanning
+                continue
+
+            candidates = found if candidates is None else {key: None for key in candidates if key in found}
+            if not candidates:
+                return []
+
+        if candidates is None:
+            return list(contents.documents)
+        return sorted(candidates, key=contents.order.__getitem__)
+
+
+    def _unindex(self, contents: _Contents, object_id: Any) -> None:
+        document = contents.documents[object_id]
+        for field, index in contents.indexes.items():
+            for key in _index_keys(_get_path(document, field)):
+                ids = index.get(key)
+                if ids is not None:
+                    ids.pop(object_id, None)
+                    if not ids:
+                        del index[key]
+
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                # keep serving the last loaded content until the database is reachable again
+                pass
+
+
+    def _on_write(self, table: "Table", object_id: Any | None) -> None:
+        if not self._loaded and self._written is None:
+            # the first load will read the written objects
+            return
+        if object_id is None:
+            self.refresh()
+        else:
+            self.reload(object_id)
+
+
+
+class MemoryCursor:
+    """The documents returned by `MemoryCollection.find()`, with the cursor methods used by the tables."""
+
+    def __init__(self, documents: list[dict]) -> None:
+        self._documents = iter(documents)
+
+
+    def __iter__(self) -> Iterator[dict]:
+        return self
+
+
+    def __next__(self) -> dict:
+        return next(self._documents)
+
+
+    def batch_size(self, batch_size: int) -> "MemoryCursor":
+        return self
+
+
+    def close(self) -> None:
+        self._documents = iter(())
+
+
+
+class MemoryCollection:
+    """A stand-in for a pymongo collection storing the documents in a `MemoryStore`, used by the offline tables.
+    It supports the queries of the store and the `$set`, `$unset`, `$inc`, `$max`, `$min`, `$push`
+    and `$addToSet` updates, the other operations raise a `StelladdonError`."""
+
+    def __init__(self, store: MemoryStore) -> None:
+        self.store = store
+
+
+    def with_options(self, **kwargs) -> "MemoryCollection":
+        return self
+
+
+    def find(self,
+             filter: dict | None = None,
+             projection: dict | list | None = None,
+             skip: int = 0,
+             limit: int = 0,
+             sort: list[tuple[str, int]] | None = None,
+             **kwargs) -> MemoryCursor:
+        documents = self.store.find_documents(filter, sort, skip, limit)
+        if documents is None:
+            raise StelladdonError(f"The query {filter!r} is not supported by the memory backend.")
+        return MemoryCursor([_project(document, projection) for document in documents])
+
+
+    def find_one(self, filter: dict | None = None, projection: dict | list | None = None, **kwargs) -> dict | None:
+        return next(self.find(filter, projection, limit=1, sort=kwargs.get("sort")), None)
+
+
+    def count_documents(self, filter: dict, **kwargs) -> int:
+        return len(self._match(filter))
+
+
+    def estimated_document_count(self, **kwargs) -> int:
+        return len(self.store)
+
+
+    def distinct(self, key: str, filter: dict | None = None, **kwargs) -> list[Any]:
+        values: list[Any] = []
+        documents = self.store.find_documents(filter)
+        if documents is None:
+            raise StelladdonError(f"The query {filter!r} is not supported by the memory backend.")
+        for document in documents:
+            value = _get_path(document, key)
+            for item in value if isinstance(value, list) else [value]:
+                if item is not MISSING and not any(_same(item, other) for other in values):
+                    values.append(item)
+        return values
+
+
+    def aggregate(self, pipeline: list[dict], **kwargs):
+        raise StelladdonError("The aggregations are not supported by the memory backend.")
+
+
+    def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        primary_key = self.store.table.primary_key
+        if self.store.document_of(document.get(primary_key)) is not None:
+            raise DuplicateKeyError(f"Duplicate key {primary_key}: {document.get(primary_key)!r}")
+
+        document.setdefault("_id", ObjectId())
+        self.store.put(deepcopy(document))
+        return InsertOneResult(document["_id"], True)
+
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=False)
+
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=True)
+
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        with self.store._lock:
+            ids = self._match(filter, limit=1)
+            if not ids and not upsert:
+                return UpdateResult({"n": 0, "nModified": 0}, True)
+            document = deepcopy(replacement)
+            if ids:
+                document.setdefault("_id", self.store.document_of(ids[0]).get("_id"))
+                self.store.discard(ids[0])
+            else:
+                document.setdefault("_id", ObjectId())
+            self.store.put(document)
+        if ids:
+            return UpdateResult({"n": 1, "nModified": 1}, True)
+        return UpdateResult({"n": 1, "nModified": 0, "upserted": document["_id"]}, True)
+
+
+    def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        return self._delete(filter, limit=1)
+
+
+    def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        return self._delete(filter)
+
+
+    def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self.insert_one(request._doc)
+                    result["nInserted"] += 1
+                    continue
+                if isinstance(request, (DeleteOne, DeleteMany)):
+                    deleted = self._delete(request._filter, limit=1 if isinstance(request, DeleteOne) else 0)
+                    result["nRemoved"] += deleted.deleted_count
+                    continue
+                if isinstance(request, ReplaceOne):
+                    updated = self.replace_one(request._filter, request._doc, bool(request._upsert))
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    updated = self._update(request._filter, request._doc, bool(request._upsert),
+                                           multi=isinstance(request, UpdateMany))
+                else:
+                    raise StelladdonError(f"The bulk operation {request!r} is not supported by the memory backend.")
+            except (DuplicateKeyError, StelladdonError) as e:
+                result["writeErrors"].append({"index": index, "code": 11000 if isinstance(e, DuplicateKeyError) else 2,
+                                              "errmsg": str(e), "op": request})
+                if ordered:
+                    break
+                continue
+
+            if updated.upserted_id is not None:
+                result["nUpserted"] += 1
+                result["upserted"].append({"index": index, "_id": updated.upserted_id})
+            else:
+                result["nMatched"] += updated.matched_count
+                result["nModified"] += updated.modified_count
+
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+
+    def _match(self,
+               filter: dict | None,
+               sort: list[tuple[str, int]] | None = None,
+               skip: int = 0,
+               limit: int = 0) -> list[Any]:
+        ids = self.store.match(filter, sort, skip, limit)
+        if ids is None:
+            raise StelladdonError(f"The query {filter!r} is not supported by the memory backend.")
+        return ids
+
+
+    def _update(self, filter: dict, update: dict, upsert: bool, multi: bool) -> UpdateResult:
+        primary_key = self.store.table.primary_key
+        with self.store._lock:
+            ids = self._match(filter, limit=0 if multi else 1)
+            if not ids:
+                if not upsert:
+                    return UpdateResult({"n": 0, "nModified": 0}, True)
+                document = {path: deepcopy(condition) for path, condition in filter.items()
+                            if not path.startswith("$") and not _is_operators(condition)}
+                _apply_update(document, update)
+                document.setdefault("_id", ObjectId())
+                self.store.put(document)
+                return UpdateResult({"n": 1, "nModified": 0, "upserted": document["_id"]}, True)
+
+            modified = 0
+            for object_id in ids:
+                document = deepcopy(self.store.document_of(object_id))
+                _apply_update(document, update)
+                if document == self.store.document_of(object_id):
+                    continue
+                if document.get(primary_key) != object_id:
+                    self.store.discard(object_id)
+                self.store.put(document)
+                modified += 1
+        return UpdateResult({"n": len(ids), "nModified": modified}, True)
+
+
+    def _delete(self, filter: dict, limit: int = 0) -> DeleteResult:
+        with self.store._lock:
+            ids = self._match(filter, limit=limit)
+            for object_id in ids:
+                self.store.discard(object_id)
+        return DeleteResult({"n": len(ids)}, True)
@@ -0,0 +1,225 @@
+from typing import Any, Awaitable, Callable, TYPE_CHECKING
+from threading import Thread, Lock, get_ident
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from random import random
+from time import time, sleep
+import hmac
+import os
+import re
+import sys
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from .allocations import ADMIN_HEADER
+
+if TYPE_CHECKING:
+    from types import FrameType
+    from .routing import Context
+
+
+__all__ = [
+    "RequestProfiler", "ProfileSession"
+]
+
+
+PROFILE_HEADER = "x-stella-profile"
+
+_profiled_session: ContextVar["ProfileSession | None"] = ContextVar("stelladdon_profiled_session", default=None)
+
+
+
+class ProfileSession:
+    """The samples of one profiled request."""
+
+    def __init__(self, ctx: "Context", frame: "FrameType", thread_id: int) -> None:
+        self.ctx = ctx
+        self.frame = frame
+        self.thread_id = thread_id
+        self.workers: dict[int, "FrameType"] = {}
+        """The worker threads running the sync functions of the request, with the frame they start from."""
+        self.samples: Counter[str] = Counter()
+
+
+    def collapsed(self) -> str:
+        """The samples in the collapsed stack format used by the flamegraph tools."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+
+def _follow_in_thread(func: Callable) -> Callable:
+    """Wrap a sync function of a profiled request, so the sampler follows it in its worker thread."""
+    session = _profiled_session.get()
+    if session is None:
+        return func
+
+    @wraps(func)
+    def run(*args, **kwargs):
+        thread_id = get_ident()
+        session.workers[thread_id] = sys._getframe()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            del session.workers[thread_id]
+    return run
+
+
+
+class RequestProfiler:
+    """Profile selected requests with a stack sampler, and write their collapsed stacks in a directory.
+    A request is profiled when it has a valid signed `X-Stella-Profile` header, when its route has been armed,
+    or randomly with the sampling rate of its route. The other requests are not slowed down.
+    The stacks are sampled in the event loop and in the worker threads running the sync functions of the request,
+    the other threads it uses (like the ones of the sharded tables) are not followed."""
+    directory: str
+    """The directory where the `.folded` files are written."""
+    rates: dict[str, float]
+    """The sampling rate of the routes, by route path."""
+    max_files: int
+    """The number of files kept in the directory, the oldest are removed first."""
+    interval: float
+    """The time in seconds between two samples."""
+
+    def __init__(self,
+                 directory: str,
+                 secret: str | None = None,
+                 rates: dict[str, float] | None = None,
+                 max_files: int = 100,
+                 interval: float = 0.001) -> None:
+        self.directory = directory
+        self.rates = rates or {}
+        self.max_files = max_files
+        self.interval = interval
+        self._secret = secret.encode() if secret else None
+        self._armed: dict[str, int] = {}
+        self._sessions: list[ProfileSession] = []
+        self._lock = Lock()
+        self._sampler: Thread | None = None
+        os.makedirs(directory, exist_ok=True)
+
+
+    def sign(self, ttl: float = 300.0) -> str:
+        """Build a value of the `X-Stella-Profile` header valid for `ttl` seconds."""
+        if self._secret is None:
+            raise ValueError("The profiler has no secret to sign the profiling requests.")
+        expires = str(int(time() + ttl))
+        return f"{expires}:{hmac.new(self._secret, expires.encode(), 'sha256').hexdigest()}"
+
+
+    def arm(self, path: str, count: int = 1) -> None:
+        """Profile the next `count` requests of the route with this path."""
+        self._armed[path] = self._armed.get(path, 0) + count
+
+
+    def should_profile(self, ctx: "Context") -> bool:
+        path = ctx.route.faroute.path
+
+        if self._armed.get(path):
+            self._armed[path] -= 1
+            return True
+
+        rate = self.rates.get(path)
+        if rate and random() < rate:
+            return True
+
+        signature = ctx.req.headers.get(PROFILE_HEADER)
+        return signature is not None and self._check_signature(signature)
+
+
+    async def run(self, ctx: "Context", call: Callable[["Context"], Awaitable[Any]]) -> Any:
+        """Run a request while sampling its stack, then write its profile."""
+        session = ProfileSession(ctx, sys._getframe(), get_ident())
+        with self._lock:
+            self._sessions.append(session)
+            if self._sampler is None:
+                self._sampler = Thread(target=self._sample_loop, name="stelladdon-profiler", daemon=True)
+                self._sampler.start()
+
+        token = _profiled_session.set(session)
+        try:
+            return await call(ctx)
+        finally:
+            _profiled_session.reset(token)
+            with self._lock:
+                self._sessions.remove(session)
+            await run_in_threadpool(self._write, session)
+
+
+    async def endpoint(self, req: Request) -> JSONResponse:
+        """The admin endpoint arming a route, protected by the `X-Stella-Admin` header being the profiler secret.
+        The `path` query parameter is the route path and `count` the number of requests to profile."""
+        if self._secret is None or not hmac.compare_digest(req.headers.get(ADMIN_HEADER, "").encode(), self._secret):
+            return JSONResponse({"error": "stellapi.forbidden", "statusCode": 403,
+                                 "message": "A valid admin secret is required."}, status_code=403)
+
+        path = req.query_params.get("path")
+        count = req.query_params.get("count", "1")
+        if not path or not count.isdigit():
+            return JSONResponse({"error": "stellapi.invalid_request", "statusCode": 400,
+                                 "message": "A route path and a count are required."}, status_code=400)
+
+        self.arm(path, int(count))
+        return JSONResponse({"armed": self._armed})
+
+
+    def _check_signature(self, signature: str) -> bool:
+        if self._secret is None or ":" not in signature:
+            return False
+
+        expires, digest = signature.split(":", 1)
+        expected = hmac.new(self._secret, expires.encode(), "sha256").hexdigest()
+        return hmac.compare_digest(digest, expected) and expires.isdigit() and int(expires) > time()
+
+
+    def _sample_loop(self) -> None:
+        while True:
+            with self._lock:
+                sessions = list(self._sessions)
+                if not sessions:
+                    self._sampler = None
+                    return
+
+            frames = sys._current_frames()
+            for session in sessions:
+                frame = frames.get(session.thread_id)
+                if frame is not None:
+                    self._sample(session, frame, session.frame)
+                for thread_id, start in list(session.workers.items()):
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        self._sample(session, frame, start)
+
+            sleep(self.interval)
+
+
+    def _sample(self, session: ProfileSession, frame: "FrameType", start: "FrameType") -> None:
+        stack: list[str] = []
+        while frame is not None and frame is not start:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+
+        if frame is None:
+            # the event loop is running another request
+            return
+
+        stack.append(session.ctx.phase)
+        session.samples[";".join(reversed(stack))] += 1
+
+
+    def _write(self, session: ProfileSession) -> None:
+        if not session.samples:
+            return
+
+        route = session.ctx.route
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route.faroute.path).strip("_") or "root"
+        filename = f"{time():.6f}-{slug}.folded"
+        with open(os.path.join(self.directory, filename), "w") as file:
+            file.write(session.collapsed())
+
+        files = sorted(name for name in os.listdir(self.directory) if name.endswith(".folded"))
+        for name in files[:-self.max_files]:
+            os.remove(os.path.join(self.directory, name))
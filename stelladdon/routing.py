@@ -1,6 +1,6 @@
 from typing import Annotated, Callable, List, Any, _SpecialForm, TYPE_CHECKING, get_origin, get_args, Union
 from inspect import iscoroutinefunction, get_annotations
-from contextlib import AsyncExitStack
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
 from abc import ABC, abstractmethod
 from json import loads
 
@@ -8,16 +8,31 @@ from fastapi import FastAPI, Request, APIRouter
 from fastapi.routing import APIRoute, run_endpoint_function
 from fastapi.utils import get_path_param_names
 from fastapi.dependencies.utils import get_dependant, solve_dependencies
-from fastapi.responses import JSONResponse, Response
+from fastapi.dependencies.models import Dependant
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 
 from .typin import ServiceT, ServiceResultT
 from .database import Table
-from .core import StellaAPIError, run_with_context, APIObject, DatabaseGetterArg, FromDatabaseArg, ErrorHandler
+from .core import StellaAPIError, run_with_context, APIObject, DatabaseGetterArg, FromDatabaseArg, ErrorHandler, \
+    _build_dependant
 from .services import Service
-from .errors import StellaAPIError, NoWaitResponse
+from .errors import StellaAPIError, NoWaitResponse, InvalidSyncToken, ExpiredSyncToken
 from .pagination import PaginationInfo, PaginableListInfo
+from .loading import TableLoader
+from .streaming import is_streamable, stream_items
+from .caching import RouteCache, ResponseStore, recording_reads
+from .admission import AdmissionLimit, AdmissionController, _release_after_stream
+from .coalescing import Coalesce, RequestCoalescer
+from .profiling import RequestProfiler
+from .allocations import AllocationProfiler
+from .columns import ColumnResult
+from .batching import BatchContext, BatchDispatcher, BATCH_SCOPE_KEY
+from .warmup import Warmup
+from .ingestion import Ingest
+from .database import StellaMongo
+from .utils import _JSON_ENCODERS
 
 
 __all__ = [
@@ -37,12 +52,48 @@ class Context:
         self.arguments: dict[str, Any] = {}
         self.states: dict[str, Any] = {}
         self._paginfo: PaginationInfo | None = None
+        self._loaders: dict[int, TableLoader] = {}
+        self.error: Exception | None = None
+        self.coalesced = False
+        self.phase_listener: Callable[[Context, str], None] | None = None
+        self._phase = "route"
+
+        self.batch: BatchContext | None = req.scope.get(BATCH_SCOPE_KEY)
+        self.identity_map: dict[tuple[int, str, Any], Any] | None = None
+        if self.batch is not None:
+            self._loaders = self.batch.loaders
+            self.identity_map = self.batch.identity_map
+
+
+    @property
+    def phase(self) -> str:
+        """The step of the request being run: "arguments", "service:<name>", "handler", "encoding"..."""
+        return self._phase
+
+
+    @phase.setter
+    def phase(self, phase: str) -> None:
+        if self.phase_listener is not None:
+            self.phase_listener(self, phase)
+        self._phase = phase
 
 
     def inject_arg(self, name: str, value: Any) -> None:
         self.arguments[name] = value
 
 
+    def loader(self, table: Table) -> TableLoader:
+        """
+        Get the loader of the table for this request.
+        The `get` awaited in the same tick are batched into a single query.
+        """
+        loader = self._loaders.get(id(table))
+        if loader is None:
+            loader = TableLoader(table)
+            self._loaders[id(table)] = loader
+        return loader
+
+
     def raise_api_error(self,
                         code: str,
                         status_code: int,
@@ -79,20 +130,73 @@ class Context:
         )
 
 
+    def paginate_table(self,
+                       table: Table,
+                       query: dict,
+                       listname: str | None = None,
+                       **kwargs) -> dict[str, Any]:
+        """
+        Paginate the objects of a table that match the query.
+        Only the current page is loaded, the total is counted on the server.
+        """
+        listinfo = self.pagination[listname]
+        start = (listinfo.page - 1) * listinfo.per_page
+
+        items = table.find(query, limit=listinfo.per_page, skip=start, **kwargs)
+        total = table.count(query)
+
+        return self.as_paginable(
+            items,
+            listname=listinfo.name,
+            has_next_page=start + len(items) < total,
+            total=total
+        )
+
+
+    def changes_since(self,
+                      table: Table,
+                      query: dict | None = None,
+                      limit: int = 1000,
+                      param: str = "since") -> dict[str, Any]:
+        """
+        Get the objects of a versioned table upserted and removed since the sync token in the `param` query parameter,
+        with the token to send at the next call. Without token, all the objects are returned.
+        Answer 410 if the token has expired, the client must sync again without token.
+        """
+        try:
+            changes = table.changes_since(self.req.query_params.get(param), query, limit)
+        except ExpiredSyncToken as e:
+            self.raise_api_error("stellapi.sync.expired", 410, str(e))
+        except InvalidSyncToken as e:
+            self.raise_api_error("stellapi.sync.invalid_token", 400, str(e))
+
+        return {
+            "@stellaType": "changes",
+            "upserted": changes.upserted,
+            "removed": changes.removed,
+            "token": changes.token,
+            "more": changes.more,
+        }
+
+
     def as_paginable(self,
                      items: list,
                      listname: str | None = None,
-                     has_next_page: bool = True) -> dict[str, Any]:
+                     has_next_page: bool = True,
+                     total: int | None = None) -> dict[str, Any]:
         listinfo = self.pagination[listname]
 
-        return {
+        paginable = {
             "@stellaType": "paginable",
             "listname": listinfo.name,
             "page": listinfo.page,
             "perPage": listinfo.per_page,
             "nextPage": listinfo.page + 1 if has_next_page else None,
-            "items": items,
         }
+        if total is not None:
+            paginable["total"] = total
+        paginable["items"] = items
+        return paginable
 
 
     def serialize(self, data: Any) -> dict[str, Any]:
@@ -154,11 +258,25 @@ class Route:
     def __init__(self,
                  upper: "StellAppMaster | StellaRouter | None",
                  fn: Callable,
-                 services: list[Service]) -> None:
+                 services: list[Service],
+                 stream: str = "array",
+                 cache: RouteCache | None = None,
+                 admission: AdmissionLimit | None = None,
+                 coalesce: Coalesce | None = None,
+                 ingest: Ingest | None = None) -> None:
         self.upper = upper
         self.fn = fn
         self.services = services
+        self.stream = stream
+        self.cache = cache
+        self.admission = AdmissionController(admission) if admission else None
+        self.coalescer = RequestCoalescer(coalesce) if coalesce else None
+        self.ingest = ingest
         self.faroute: APIRoute | None = None
+        self._arguments: dict[str, Any] | None = None
+        self._services: List[Service] | None = None
+        self._controllers: List[AdmissionController] | None = None
+        self._dependants: dict[tuple[Callable, frozenset[str]], Dependant] = {}
 
 
     @property
@@ -166,7 +284,37 @@ class Route:
         return self.upper.master
 
 
+    def compile(self) -> None:
+        """Resolve the arguments, services, admission controllers and FastAPI dependants of the route once
+        instead of at each request. The services and limits of the routers must not change after."""
+        self._services = self._controllers = None
+        names = {"stella", *self.get_arguments()}
+        self._services = self.get_services()
+        self._controllers = self.get_admission_controllers()
+
+        # the arguments injected by the services are only known at the first request that uses them
+        for service in self._services:
+            if service.before_fn:
+                self.get_dependant(service.before_fn, frozenset(names & set(service.before_fn.__code__.co_varnames)))
+        if self.ingest is not None:
+            names.add("ingestion")
+        self.get_dependant(self.fn, frozenset(names & set(self.fn.__code__.co_varnames)))
+
+
+    def get_dependant(self, func: Callable, names: frozenset[str]) -> Dependant:
+        """Get the FastAPI dependant of the handler or of a service of the route, called with the stelladdon
+        arguments `names`. It is built once for each set of arguments."""
+        key = (func, names)
+        dependant = self._dependants.get(key)
+        if dependant is None:
+            dependant = self._dependants[key] = _build_dependant(func, names, self.faroute.path)
+        return dependant
+
+
     def get_arguments(self) -> dict[str, Any]:
+        if self._arguments is not None:
+            return self._arguments
+
         path_param_names = get_path_param_names(self.faroute.path)
         fnannotations = get_annotations(self.fn)
 
@@ -194,10 +342,14 @@ class Route:
                         pyname=pathparam,
                         key=annot_val.key or pathparam,
                         none_allowed=none_allowed,
-                        only_one=not annot_val.multiple
+                        only_one=not annot_val.multiple,
+                        count=annot_val.count,
+                        exists=annot_val.exists
                     )
             if pathparam not in self.fn.__code__.co_varnames:
                 raise ValueError(f"Path parameter '{pathparam}' is not defined in the function '{self.fn.__name__}'.")
+
+        self._arguments = arguments
         return arguments
 
 
@@ -207,8 +359,22 @@ class Route:
 
         for pyname, arg in self.get_arguments().items():
             if isinstance(arg, DatabaseGetterArg):
-                if arg.only_one:
-                    obj = arg.table.find_one({arg.key: ctx.req.path_params[pyname]})
+                if arg.count:
+                    arguments[pyname] = arg.table.count({arg.key: ctx.req.path_params[pyname]})
+
+                elif arg.exists:
+                    arguments[pyname] = arg.table.exists({arg.key: ctx.req.path_params[pyname]})
+
+                elif arg.only_one:
+                    value = ctx.req.path_params[pyname]
+                    if ctx.identity_map is None:
+                        obj = arg.table.find_one({arg.key: value})
+                    else:
+                        identity = (id(arg.table), arg.key, value)
+                        if identity not in ctx.identity_map:
+                            ctx.identity_map[identity] = arg.table.find_one({arg.key: value})
+                        obj = ctx.identity_map[identity]
+
                     if  obj is None and not arg.none_allowed:
                         ... # TODO: raise error
                         print("ERROR: Object not found in database for", pyname)
@@ -225,10 +391,14 @@ class Route:
         if isinstance(response, APIObject):
             return response.get_api_data("public")
 
+        elif isinstance(response, ColumnResult):
+            return response.to_dict()
+
         elif isinstance(response, (list, tuple, dict)):
             # If the response is a list of APIObjects, encode each one
             return jsonable_encoder(response, custom_encoder={
-                APIObject: self.encode_response
+                APIObject: self.encode_response,
+                **_JSON_ENCODERS,
             })
 
         elif isinstance(response, JSONResponse):
@@ -244,25 +414,111 @@ class Route:
 
 
     def get_services(self) -> List[Service]:
+        if self._services is not None:
+            return self._services
         return self.services + self.upper.get_services()
 
 
+    def get_admission_controllers(self) -> List[AdmissionController]:
+        if self._controllers is not None:
+            return self._controllers
+        controllers = [self.admission] if self.admission else []
+        return controllers + self.upper.get_admission_controllers()
+
+
+    def get_priority(self, req: Request) -> int:
+        priorities = [service.priority_fn(req) for service in self.get_services() if service.priority_fn]
+        return max(priorities, default=0)
+
+
     async def __call__(self, req: Request):
         context = Context(req, self)
-        arguments: dict[str, Any] = {}
-        from inspect import signature
 
+        profiler = self.master.profiler
+        if profiler is not None and profiler.should_profile(context):
+            return await profiler.run(context, self.process)
+
+        allocations = self.master.allocations
+        if allocations is not None and allocations.should_sample(context):
+            return await allocations.run(context, self.process)
+        return await self.process(context)
+
+
+    async def process(self, context: Context):
+        controllers = self.get_admission_controllers()
+        if not controllers:
+            return await self.respond(context)
+
+        priority = self.get_priority(context.req)
+        acquired: List[AdmissionController] = []
+        streaming = False
         try:
-            arguments = self.process_arguments(context)
+            for controller in controllers:
+                await controller.acquire(context, priority)
+                acquired.append(controller)
+
+            response = await self.respond(context)
+            if isinstance(response, StreamingResponse):
+                # the body is produced after the return, the slots are released once it is sent
+                _release_after_stream(response, acquired)
+                streaming = True
+            return response
+        finally:
+            if not streaming:
+                for controller in acquired:
+                    controller.release()
+
+
+    async def respond(self, context: Context):
+        # the services run for every request, the cached and coalesced responses are only shared after them
+        store = self.master.response_cache if self.cache is not None else None
+        started_at = store.begin() if store is not None else None
+        tags: set[tuple[Table, Any]] = set()
+        with recording_reads(tags) if store is not None else nullcontext():
+            try:
+                arguments = await self.prepare(context)
+            except Exception as e:
+                return self.encode(context, await self.handle_error(context, e))
+
+        async def handler(context: Context):
+            if self.coalescer is not None:
+                return await self.coalescer.run(context, lambda context: self.handle(context, arguments))
+            return await self.handle(context, arguments)
+
+        if store is not None:
+            return await store.respond(context, self.cache, handler, started_at, tags)
+        return await handler(context)
+
+
+    async def prepare(self, context: Context) -> dict[str, Any]:
+        """Get the arguments of the handler and run the before functions of the services."""
+        context.phase = "arguments"
+        arguments = self.process_arguments(context)
+
+        for service in self.get_services():
+            if service.before_fn:
+                context.phase = f"service:{service.name}"
+                if context.batch is not None and service.batch_safe:
+                    await context.batch.run_service_once(service, arguments, context)
+                else:
+                    await run_with_context(service.before_fn, arguments, context)
+        return arguments
 
-            for service in self.get_services():
-                if service.before_fn:
-                    service_result = await run_with_context(service.before_fn, arguments, context)
 
+    async def handle(self, context: Context, arguments: dict[str, Any]):
+        try:
+            if self.ingest is not None:
+                context.phase = "ingestion"
+                context.inject_arg("ingestion", await self.ingest.run(context))
+
+            context.phase = "handler"
             response = await run_with_context(self.fn, arguments, context)
+            if response is None and self.ingest is not None:
+                response = context.arguments["ingestion"].as_dict()
 
             for service in self.get_services():
                 if service.after_fn:
+                    context.phase = f"after:{service.name}"
                     afterservice_result = service.after_fn(context, response)
                     if iscoroutinefunction(service.after_fn):
                         afterservice_result = await afterservice_result
@@ -271,20 +527,33 @@ class Route:
                         response = afterservice_result
 
         except Exception as e:
-            errortype = type(e)
+            response = await self.handle_error(context, e)
 
-            best_handler = next((
-                handler for handler in self.master.get_error_handlers()
-                if issubclass(errortype, handler.errortype)), None)
-            
-            if best_handler:
-                response = await best_handler.handler(e, context)
+        return self.encode(context, response)
 
-            else:
-                raise e
 
-        response = self.encode_response(response)
-        return response
+    async def handle_error(self, context: Context, e: Exception) -> Any:
+        """Get the response of the error handler of the app for this error, or raise it again if there is none."""
+        context.error = e
+        errortype = type(e)
+
+        best_handler = next((
+            handler for handler in self.master.get_error_handlers()
+            if issubclass(errortype, handler.errortype)), None)
+
+        if best_handler:
+            context.phase = "errorhandler"
+            return await best_handler.handler(e, context)
+
+        raise e
+
+
+    def encode(self, context: Context, response: Any) -> Any:
+        context.phase = "encoding"
+        if is_streamable(response):
+            return stream_items(response, context, self.stream)
+
+        return self.encode_response(response)
 
 
 
@@ -292,13 +561,15 @@ class StellaRouter:
 
     def __init__(self,
                  router: APIRouter,
-                 services: list[Service] | None = None) -> None:
+                 services: list[Service] | None = None,
+                 admission: AdmissionLimit | None = None) -> None:
         self.routers: list["StellaRouter"] = []
         self.routes: List[Route] = []
         self.farouter = router
         self.upper: StellAppMaster | StellaRouter | None = None
         self.error_handlers: List[ErrorHandler] = []
         self.services = services or []
+        self.admission = AdmissionController(admission) if admission else None
 
 
     @property
@@ -323,9 +594,27 @@ class StellaRouter:
     def route(self,
               method: str,
               path: str,
-              services: list[Service] | None = None) -> Callable:
+              services: list[Service] | None = None,
+              stream: str = "array",
+              cache: RouteCache | None = None,
+              admission: AdmissionLimit | None = None,
+              coalesce: Coalesce | None = None,
+              ingest: Ingest | None = None) -> Callable:
+        """
+        Register a route. If the handler returns a generator or a table cursor,
+        its items are streamed in the `stream` format ("array" or "ndjson").
+        With `cache`, the encoded responses are kept in the app response cache
+        until their TTL expires or a table object they read is written.
+        With `admission`, the concurrent requests of the route are limited and the extra ones queued or rejected.
+        With `coalesce` (idempotent routes only), identical concurrent requests share one response.
+        The arguments and the before functions of the services are still run for every request,
+        a cached or coalesced response is only shared once they passed: a response that depends on
+        the identity of the user must list the identifying headers in the `headers` of these options.
+        With `ingest`, the body is read as NDJSON and its objects inserted in the table while it is received,
+        the handler gets the `ingestion` summary and returns it by default.
+        """
         def decorator(func: Callable) -> Callable:
-            route = Route(self, func, services or [])
+            route = Route(self, func, services or [], stream, cache, admission, coalesce, ingest)
             self.routes.append(route)
             func.__route__ = route
 
@@ -346,19 +635,64 @@ class StellaRouter:
         return self.error_handlers + self.upper.get_error_handlers() if self.upper else []
 
 
+    def get_routes(self) -> List[Route]:
+        """Get the routes of the router and of its included routers."""
+        routes = list(self.routes)
+        for router in self.routers:
+            routes.extend(router.get_routes())
+        return routes
+
+
+    def compile(self) -> None:
+        """Compile all the routes of the router and of its included routers, see `Route.compile()`."""
+        for route in self.get_routes():
+            route.compile()
+
+
+    def get_admission_controllers(self) -> List[AdmissionController]:
+        controllers = [self.admission] if self.admission else []
+        if self.upper:
+            return controllers + self.upper.get_admission_controllers()
+        return controllers
+
+
+    def get_admission_stats(self) -> dict[str, dict[str, int]]:
+        """Get the admission metrics of the routes and routers that have limits, by route."""
+        stats: dict[str, dict[str, int]] = {}
+        if self.admission:
+            stats[self.farouter.prefix or "/"] = self.admission.stats.as_dict()
+
+        for route in self.routes:
+            if route.admission:
+                methods = ",".join(sorted(route.faroute.methods))
+                stats[f"{methods} {route.faroute.path}"] = route.admission.stats.as_dict()
+
+        for router in self.routers:
+            stats.update(router.get_admission_stats())
+        return stats
+
+
 
 class StellAppMaster(StellaRouter):
 
-    def __init__(self, app: FastAPI) -> None:
+    def __init__(self,
+                 app: FastAPI,
+                 response_cache_size: int = 1024,
+                 admission: AdmissionLimit | None = None) -> None:
         self.app = app
         self.error_handlers: List[ErrorHandler] = []
-        super().__init__(self.app.router, services=[])
+        self.response_cache = ResponseStore(response_cache_size)
+        self.profiler: RequestProfiler | None = None
+        self.warmup: Warmup | None = None
+        self.allocations: AllocationProfiler | None = None
+        super().__init__(self.app.router, services=[], admission=admission)
 
         @self.app.exception_handler(StellaAPIError)
         async def stella_error_handler(request: Request, exc: StellaAPIError):
             return JSONResponse(
                 content=exc.data,
                 status_code=exc.status_code,
+                headers=exc.headers,
             )
 
         @self.app.exception_handler(NoWaitResponse)
@@ -375,5 +709,79 @@ class StellAppMaster(StellaRouter):
         return self
 
 
+    def enable_batch(self, path: str = "/batch", max_requests: int = 20) -> BatchDispatcher:
+        """
+        Mount a POST endpoint running several requests of the app in one HTTP request.
+        The body is `{"requests": [{"method", "path", "headers", "body"}, ...]}` and the response
+        `{"responses": [{"status", "body"}, ...]}` in the same order. The sub-requests run concurrently,
+        share the objects read from the tables, and the batch-safe services run once for the batch.
+        """
+        dispatcher = BatchDispatcher(self, max_requests)
+        self.app.add_api_route(path, dispatcher.__call__, methods=["POST"])
+        return dispatcher
+
+
+    def enable_profiling(self,
+                         directory: str,
+                         secret: str | None = None,
+                         rates: dict[str, float] | None = None,
+                         max_files: int = 100,
+                         path: str | None = "/_stella/profile") -> RequestProfiler:
+        """
+        Profile the requests selected by a signed `X-Stella-Profile` header, by `RequestProfiler.arm()`
+        or by the sampling rate of their route path, and write their collapsed stacks in the directory.
+        The admin endpoint at `path` arms a route (`POST ?path=...&count=...`), it requires the `X-Stella-Admin`
+        header to be the secret and is only mounted if a secret is given.
+        """
+        self.profiler = RequestProfiler(directory, secret, rates, max_files)
+        if path is not None and secret is not None:
+            self.app.add_api_route(path, self.profiler.endpoint, methods=["POST"], include_in_schema=False)
+        return self.profiler
+
+
+    def enable_allocation_profiling(self,
+                                    rate: float = 0.01,
+                                    rates: dict[str, float] | None = None,
+                                    frames: int = 1,
+                                    path: str | None = "/_stella/allocations",
+                                    secret: str | None = None) -> AllocationProfiler:
+        """
+        Trace the memory allocations of a sample of the requests (`rate`, or `rates` by route path)
+        and attribute their peak and retained bytes to the route and phase that allocated them.
+        The admin endpoint at `path` lists them with the top allocation sites of each route,
+        it requires the `X-Stella-Admin` header to be the secret and is only mounted if a secret is given.
+        """
+        self.allocations = AllocationProfiler(rate, rates, frames, secret)
+        if path is not None and secret is not None:
+            self.app.add_api_route(path, self.allocations.endpoint, methods=["GET"], include_in_schema=False)
+        return self.allocations
+
+
+    def enable_warmup(self,
+                      clients: list[StellaMongo] | None = None,
+                      tables: list[Table] | None = None,
+                      connections: int = 1,
+                      path: str | None = "/ready") -> Warmup:
+        """
+        Prepare the app when it starts, in each worker process after the fork: compile the routes,
+        create the MongoDB clients and open `connections` connections each, load the in-memory tables
+        and run the steps added with `Warmup.step()`. The tables used by the route arguments are included.
+        The readiness endpoint at `path` answers 200 with the duration of each step once ready, else 503.
+        """
+        warmup = self.warmup = Warmup(self, clients, tables, connections)
+        lifespan = self.app.router.lifespan_context
+
+        @asynccontextmanager
+        async def warmup_lifespan(app: FastAPI):
+            async with lifespan(app) as state:
+                await warmup.run()
+                yield state
+
+        self.app.router.lifespan_context = warmup_lifespan
+        if path is not None:
+            self.app.add_api_route(path, warmup.readiness, methods=["GET"], include_in_schema=False)
+        return warmup
+
+
     def get_error_handlers(self) -> List[ErrorHandler]:
         return self.error_handlers
@@ -12,10 +12,14 @@ class Service:
     def __init__(self,
                  name: str,
                  before: Callable | None = None,
-                 after: Callable | None = None) -> None:
+                 after: Callable | None = None,
+                 priority: Callable | None = None,
+                 batch_safe: bool = False) -> None:
         self.name = name
         self.before_fn = before
         self.after_fn = after
+        self.priority_fn = priority
+        self.batch_safe = batch_safe
 
 
     def before(self, fn: Callable) -> Callable:
@@ -26,3 +30,12 @@ class Service:
     def after(self, fn: Callable) -> Callable:
         self.after_fn = fn
         return fn
+
+
+    def priority(self, fn: Callable) -> Callable:
+        """
+        Register the function giving the admission priority of a request from its `Request`.
+        When a route queue is full, the requests with the highest priority are kept.
+        """
+        self.priority_fn = fn
+        return fn
@@ -0,0 +1,335 @@
+from typing import Any, Callable, Iterable, Type
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from hashlib import blake2b
+from heapq import merge
+from bisect import bisect_right
+import bson
+
+from .typin import TableModelT, ResultModelT
+from .utils import _sort_key
+from .database import StellaMongo, Table
+from .errors import StelladdonError
+from .columns import ColumnResult
+from .tracking import ChangeTracker
+from .coalescing import QueryCoalescer
+from .sharedcache import SharedObjectCache
+from .memory import MemoryStore
+from .changes import VersionStamps, ChangeSet, RETENTION
+
+
+__all__ = [
+    "ShardedTable", "HashSharding", "RangeSharding"
+]
+
+
+
+class HashSharding:
+    """Spread the objects evenly on the shards from a stable hash of their primary key."""
+
+    def shard_of(self, id: Any, shards: int) -> int:
+        digest = blake2b(bson.encode({"id": id}), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % shards
+
+
+
+class RangeSharding:
+    """Put the objects on the shards by ranges of primary keys.
+    With bounds `[b1, b2]`, the ids lower than b1 go on the first shard, the ones lower than b2
+    on the second, and the others on the third."""
+    bounds: list[Any]
+    """The sorted upper bounds (excluded) of the ranges, one less than the number of shards."""
+
+    def __init__(self, bounds: list[Any]) -> None:
+        self.bounds = sorted(bounds)
+
+
+    def shard_of(self, id: Any, shards: int) -> int:
+        return min(bisect_right(self.bounds, id), shards - 1)
+
+
+
+class ShardedTable(Table[TableModelT]):
+    """A table split on several MongoDB clients by its primary key.
+    The operations on one object go to its shard, the queries without the primary key
+    are sent to all the shards concurrently and their results are merged."""
+    shards: list[Table[TableModelT]]
+    """The table of each shard, in the order of the clients."""
+    sharding: HashSharding | RangeSharding
+    """Choose the shard of an object from its primary key."""
+
+    def __init__(self,
+                 model: Type[TableModelT],
+                 collection: str,
+                 database: str,
+                 clients: list[StellaMongo],
+                 primary_key: str = "_id",
+                 sharding: HashSharding | RangeSharding | None = None) -> None:
+        """Create a sharded table stored in the database with this name on each client, one client per shard."""
+        if not clients:
+            raise StelladdonError("A sharded table needs at least one client.")
+        super().__init__(model, collection, clients[0].get_database(database), primary_key)
+        self.sharding = sharding or HashSharding()
+        self.shards = [Table(model, collection, client.get_database(database), primary_key) for client in clients]
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shards),
+                                            thread_name_prefix=f"stelladdon-shards-{collection}")
+
+        for shard in self.shards:
+            shard.write_hooks.append(lambda _, object_id: self._notify_write(object_id))
+
+
+    def __repr__(self) -> str:
+        return f"ShardedTable({self.collection!r} shards={len(self.shards)})"
+
+
+    def shard_of(self, id: Any) -> Table[TableModelT]:
+        """Get the table of the shard that stores the object with this primary key."""
+        return self.shards[self.sharding.shard_of(id, len(self.shards))]
+
+
+    def shards_of(self, query: dict | None) -> list[Table[TableModelT]]:
+        """Get the shards that can have objects matching the query."""
+        value = (query or {}).get(self.primary_key)
+        if value is None:
+            return self.shards
+        if isinstance(value, dict):
+            if set(value) == {"$eq"}:
+                return [self.shard_of(value["$eq"])]
+            if set(value) == {"$in"}:
+                indexes = {self.sharding.shard_of(id, len(self.shards)) for id in value["$in"]}
+                return [self.shards[index] for index in sorted(indexes)]
+            return self.shards
+        return [self.shard_of(value)]
+
+
+    def load_object(self, data: dict) -> TableModelT:
+        return self.shard_of(data.get(self.primary_key)).load_object(data)
+
+
+    def find(self,
+             query: dict,
+             limit: int | None = None,
+             sort: list[tuple[str, int]] | None = None,
+             skip: int = 0,
+             **kwargs) -> list[TableModelT]:
+        """Find objects in the table that match the query.
+        Each shard returns at most `skip + limit` objects, already sorted, that are merged here."""
+        shards = self.shards_of(query)
+        if len(shards) == 1:
+            return shards[0].find(query, limit=limit, sort=sort, skip=skip, **kwargs)
+
+        shard_limit = None if limit is None else skip + limit
+        results = self._scatter(shards, lambda shard: shard.find(query, limit=shard_limit, sort=sort, **kwargs))
+
+        if sort:
+            objects = list(merge(*results, key=_sort_key(sort)))
+        else:
+            objects = [object for result in results for object in result]
+
+        end = None if limit is None else skip + limit
+        return objects[skip:end]
+
+
+    def iter_find(self, query: dict, limit: int | None = None, batch_size: int | None = None, **kwargs):
+        """Find objects in the table that match the query, loading them lazily while iterating.
+        The shards are read one after the other, unordered."""
+        def iterate():
+            remaining = limit
+            for shard in self.shards_of(query):
+                if remaining is not None and remaining <= 0:
+                    return
+                cursor = shard.iter_find(query, limit=remaining, batch_size=batch_size, **kwargs)
+                try:
+                    for object in cursor:
+                        if remaining is not None:
+                            remaining -= 1
+                        yield object
+                finally:
+                    cursor.close()
+        return iterate()
+
+
+    def find_columns(self, query: dict, fields: list[str], limit: int | None = None,
+                     batch_size: int = 10000, **kwargs) -> ColumnResult:
+        result = ColumnResult(fields)
+        for shard_result in self._scatter(self.shards_of(query),
+                                          lambda shard: shard.find_columns(query, fields, limit, batch_size, **kwargs)):
+            for name, column in shard_result.columns.items():
+                result.columns[name].extend(column)
+
+        if limit is not None:
+            return result._select(bytearray(index < limit for index in range(len(result))))
+        return result
+
+
+    def find_one(self, query: dict, **kwargs) -> TableModelT | None:
+        sort = kwargs.get("sort")
+        objects = [object for object in self._scatter(self.shards_of(query),
+                                                      lambda shard: shard.find_one(query, **kwargs))
+                   if object is not None]
+        if not objects:
+            return None
+        return min(objects, key=_sort_key(sort)) if sort else objects[0]
+
+
+    def get(self, id: Any) -> TableModelT | None:
+        return self.shard_of(id).get(id)
+
+
+    def get_many(self, ids: Iterable[Any]) -> list[TableModelT | None]:
+        ids = list(ids)
+        by_shard: dict[int, list[Any]] = {}
+        for id in ids:
+            by_shard.setdefault(self.sharding.shard_of(id, len(self.shards)), []).append(id)
+
+        indexes = list(by_shard)
+        results = self._scatter([self.shards[index] for index in indexes],
+                                lambda shard: shard.get_many(by_shard[self.shards.index(shard)]))
+
+        objects: dict[Any, TableModelT | None] = {}
+        for index, result in zip(indexes, results):
+            objects.update(zip(by_shard[index], result))
+        return [objects[id] for id in ids]
+
+
+    def exists(self, query: dict, **kwargs) -> bool:
+        return any(self._scatter(self.shards_of(query), lambda shard: shard.exists(query, **kwargs)))
+
+
+    def count(self, query: dict | None = None, **kwargs) -> int:
+        return sum(self._scatter(self.shards_of(query), lambda shard: shard.count(query, **kwargs)))
+
+
+    def estimated_count(self, **kwargs) -> int:
+        return sum(self._scatter(self.shards, lambda shard: shard.estimated_count(**kwargs)))
+
+
+    def distinct(self, key: str, query: dict | None = None, **kwargs) -> list[Any]:
+        values: list[Any] = []
+        for result in self._scatter(self.shards_of(query), lambda shard: shard.distinct(key, query, **kwargs)):
+            values.extend(value for value in result if value not in values)
+        return values
+
+
+    def aggregate(self,
+                  pipeline: list[dict],
+                  model: Type[ResultModelT] | None = None,
+                  **kwargs) -> list[ResultModelT] | list[dict]:
+        """Run an aggregation pipeline on each shard and concatenate the results.
+        The grouping stages are applied per shard, so their results must be combined by the caller."""
+        results = self._scatter(self.shards, lambda shard: shard.aggregate(pipeline, model, **kwargs))
+        return [item for result in results for item in result]
+
+
+    def insert(self, object: TableModelT, comment: str | None = None) -> None:
+        self.shard_of(self.get_id_of(object)).insert(object, comment)
+
+
+    def update_many(self, filter: dict, update: dict, comment: str | None = None) -> None:
+        self._scatter(self.shards_of(filter), lambda shard: shard.update_many(filter, update, comment))
+
+
+    def remove_many(self, filter: dict, comment: str | None = None) -> None:
+        self._scatter(self.shards_of(filter), lambda shard: shard.remove_many(filter, comment))
+
+
+    def update(self, object_or_id: TableModelT | Any, update: dict, comment: str | None = None) -> None:
+        object_id = object_or_id if (not isinstance(object_or_id, self.model)) \
+            else self.get_id_of(object_or_id)
+        self.shard_of(object_id).update(object_id, update, comment)
+
+
+    def remove(self, object_or_id: TableModelT | Any, comment: str | None = None) -> None:
+        object_id = object_or_id if (not isinstance(object_or_id, self.model)) \
+            else self.get_id_of(object_or_id)
+        self.shard_of(object_id).remove(object_id, comment)
+
+
+    def push(self, object: TableModelT, comment: str | None = None) -> None:
+        self.shard_of(self.get_id_of(object)).push(object, comment)
+
+
+    def save(self, object: TableModelT, comment: str | None = None) -> None:
+        self.shard_of(self.get_id_of(object)).save(object, comment)
+
+
+    def save_many(self, objects: list[TableModelT], comment: str | None = None) -> None:
+        by_shard: dict[int, list[TableModelT]] = {}
+        for object in objects:
+            index = self.sharding.shard_of(self.get_id_of(object), len(self.shards))
+            by_shard.setdefault(index, []).append(object)
+        self._scatter([self.shards[index] for index in by_shard],
+                      lambda shard: shard.save_many(by_shard[self.shards.index(shard)], comment))
+
+
+    def enable_change_tracking(self, version_field: str | None = None) -> ChangeTracker:
+        for shard in self.shards:
+            shard.enable_change_tracking(version_field)
+        return self.shards[0].tracker
+
+
+    def enable_versioning(self,
+                          field: str = "_seq",
+                          clock: str = "sequence",
+                          retention: float | None = RETENTION,
+                          max_write_time: float = 60.0,
+                          settle_time: float = 1.0) -> VersionStamps:
+        # the sequence numbers and tombstones of each shard would need a sync token per shard
+        raise StelladdonError("The versioning of a sharded table is not supported, "
+                              "enable it on the table of each shard with .shards instead.")
+
+
+    def changes_since(self, token: str | None, query: dict | None = None, limit: int = 1000) -> ChangeSet:
+        raise StelladdonError("The versioning of a sharded table is not supported.")
+
+
+    def enable_write_behind(self, max_size: int = 1000, max_delay: float = 1.0, write_concern: int = 1):
+        for shard in self.shards:
+            shard.enable_write_behind(max_size, max_delay, write_concern)
+        return self.shards[0].write_behind
+
+
+    def disable_write_behind(self) -> None:
+        for shard in self.shards:
+            shard.disable_write_behind()
+
+
+    def flush(self) -> None:
+        for shard in self.shards:
+            shard.flush()
+
+
+    def use_shared_cache(self, cache: SharedObjectCache | None) -> None:
+        for shard in self.shards:
+            shard.use_shared_cache(cache)
+
+
+    def enable_coalescing(self, max_wait: float = 5.0) -> QueryCoalescer:
+        for shard in self.shards:
+            shard.enable_coalescing(max_wait)
+        return self.shards[0].coalescer
+
+
+    def enable_memory(self,
+                      indexes: list[str] | None = None,
+                      refresh_interval: float | None = None,
+                      offline: bool = False) -> list[MemoryStore]:
+        return [shard.enable_memory(indexes, refresh_interval, offline) for shard in self.shards]
+
+
+    def disable_memory(self) -> None:
+        for shard in self.shards:
+            shard.disable_memory()
+
+
+    def _scatter(self, shards: list[Table[TableModelT]], call: Callable[[Table[TableModelT]], Any]) -> list[Any]:
+        if len(shards) == 1:
+            return [call(shards[0])]
+        # each thread records its reads in a copy of the current context
+        futures = [self._executor.submit(copy_context().run, call, shard) for shard in shards]
+        return [future.result() for future in futures]
+
+
+    @property
+    def _collection(self):
+        raise StelladdonError("A sharded table has no single collection, use the table of a shard with .shard_of().")
@@ -0,0 +1,223 @@
+from typing import Any, Callable, TYPE_CHECKING
+from hashlib import blake2b
+from tempfile import gettempdir
+from struct import Struct
+from threading import Lock
+import mmap
+import os
+import re
+import sys
+
+import bson
+
+if sys.platform != "win32":
+    # the shared cache relies on POSIX file locks, the rest of the package doesn't need them
+    import fcntl
+
+from .errors import StelladdonError
+
+if TYPE_CHECKING:
+    from .database import Table
+
+
+__all__ = [
+    "SharedObjectCache"
+]
+
+
+MAGIC = b"STLCACHE"
+HEADER = Struct("<8sIII")
+HEADER_SIZE = 64
+TABLE_GENERATIONS = 256
+GENERATION = Struct("<Q")
+SLOT_HEADER = Struct("<QQQQHI")
+SLOT_HEADER_SIZE = 40
+
+
+
+def _default_path(name: str) -> str:
+    if not re.fullmatch(r"[\w.-]+", name):
+        raise StelladdonError(f"Invalid shared cache name {name!r}, only letters, digits, '_', '.' and '-' are allowed.")
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else gettempdir()
+    return os.path.join(directory, f"stelladdon-{os.getuid()}-{name}.cache")
+
+
+
+class SharedObjectCache:
+    """A cache of table documents shared by all the processes of a host through a memory-mapped file.
+    Every document is stored in the slot of its (database, collection, primary key) hash, with a version stamp.
+    A write through a table in any process bumps the stamp of the slot (or the generation of the whole table)
+    so the other processes see the invalidation on their next read, without any message between them."""
+    path: str
+    """The path of the memory-mapped file, shared by all the processes using the cache."""
+    slots: int
+    """The number of documents the cache can hold."""
+    slot_size: int
+    """The size in bytes of a slot, documents bigger than that are never cached."""
+    hits: int
+    """The number of lookups answered by the cache in this process."""
+    misses: int
+    """The number of lookups that went to the database in this process."""
+
+    def __init__(self,
+                 path: str | None = None,
+                 slots: int = 4096,
+                 slot_size: int = 4096,
+                 name: str | None = None) -> None:
+        """Open the shared cache file, or create it if this process is the first to use it.
+        The file is given by its path, or by a name unique to the app, for a file in /dev/shm (or the temp directory).
+        The processes of unrelated apps must not share a file, their objects would be mixed up.
+        Every process must use the same slots and slot_size for a given file."""
+        if sys.platform == "win32":
+            raise StelladdonError("The shared cache needs POSIX file locks, it is not available on Windows.")
+        if path is None:
+            if name is None:
+                raise StelladdonError("A shared cache needs the name of the app or the path of its file.")
+            path = _default_path(name)
+
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.hits = 0
+        self.misses = 0
+
+        self._slots_offset = HEADER_SIZE + TABLE_GENERATIONS * GENERATION.size
+        size = self._slots_offset + slots * slot_size
+
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, 1, slots, slot_size), 0)
+
+            magic, _, file_slots, file_slot_size = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+            if magic != MAGIC or (file_slots, file_slot_size) != (slots, slot_size):
+                raise StelladdonError((
+                    "The shared cache file {!r} has been created with another layout "
+                    "({} slots of {} bytes, expected {} slots of {} bytes)."
+                ).format(self.path, file_slots, file_slot_size, slots, slot_size))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+
+        self._map = mmap.mmap(self._fd, size)
+        # file locks are held per process, the threads of a process also need to be serialized
+        self._thread_lock = Lock()
+
+
+    def __repr__(self) -> str:
+        return f"SharedObjectCache({self.path!r} slots={self.slots} hits={self.hits} misses={self.misses})"
+
+
+    def fetch(self, table: "Table", id: Any, load: Callable[[], dict | None]) -> dict | None:
+        """Get the document of an object from the cache, or load it with `load` and cache it."""
+        key, hash = self._key_of(table, id)
+        data, token = self._lookup(table, key, hash)
+        if data is not None:
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        data = load()
+        if data is not None:
+            self._store(table, key, hash, data, token)
+        return data
+
+
+    def invalidate(self, table: "Table", id: Any | None) -> None:
+        """Invalidate the cached document of an object in every process, or all the table objects if id is None.
+        Used as a table write hook."""
+        if id is None:
+            offset = self._generation_offset(table)
+            with self._locked(offset, GENERATION.size):
+                generation, = GENERATION.unpack_from(self._map, offset)
+                GENERATION.pack_into(self._map, offset, generation + 1)
+            return
+
+        _, hash = self._key_of(table, id)
+        offset = self._slot_offset(hash)
+        with self._locked(offset, self.slot_size):
+            seq, stamp, _, _, _, _ = SLOT_HEADER.unpack_from(self._map, offset)
+            SLOT_HEADER.pack_into(self._map, offset, seq + 2, stamp + 1, 0, 0, 0, 0)
+
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+
+    def _lookup(self, table: "Table", key: bytes, hash: int) -> tuple[dict | None, tuple[int, int]]:
+        generation, = GENERATION.unpack_from(self._map, self._generation_offset(table))
+        offset = self._slot_offset(hash)
+
+        seq, stamp, slot_hash, slot_generation, key_len, data_len = SLOT_HEADER.unpack_from(self._map, offset)
+        token = (stamp, generation)
+        if seq % 2 or slot_hash != hash or slot_generation != generation or not data_len:
+            return None, token
+
+        start = offset + SLOT_HEADER_SIZE
+        payload = self._map[start:start + key_len + data_len]
+        if SLOT_HEADER.unpack_from(self._map, offset)[0] != seq or payload[:key_len] != key:
+            # the slot has been rewritten while we were reading it
+            return None, token
+
+        return bson.decode(payload[key_len:]), token
+
+
+    def _store(self, table: "Table", key: bytes, hash: int, data: dict, token: tuple[int, int]) -> None:
+        encoded = bson.encode(data)
+        if SLOT_HEADER_SIZE + len(key) + len(encoded) > self.slot_size:
+            return
+
+        generation_offset = self._generation_offset(table)
+        offset = self._slot_offset(hash)
+        with self._locked(offset, self.slot_size):
+            seq, stamp, _, _, _, _ = SLOT_HEADER.unpack_from(self._map, offset)
+            generation, = GENERATION.unpack_from(self._map, generation_offset)
+            if (stamp, generation) != token:
+                # the object has been written since we loaded it, the document may be stale
+                return
+
+            SLOT_HEADER.pack_into(self._map, offset, seq + 1, stamp, 0, 0, 0, 0)
+            start = offset + SLOT_HEADER_SIZE
+            self._map[start:start + len(key) + len(encoded)] = key + encoded
+            SLOT_HEADER.pack_into(self._map, offset, seq + 2, stamp, hash, generation, len(key), len(encoded))
+
+
+    def _key_of(self, table: "Table", id: Any) -> tuple[bytes, int]:
+        key = bson.encode({"k": [table.database.name, table.collection, id]})
+        return key, int.from_bytes(blake2b(key, digest_size=8).digest(), "little")
+
+
+    def _slot_offset(self, hash: int) -> int:
+        return self._slots_offset + (hash % self.slots) * self.slot_size
+
+
+    def _generation_offset(self, table: "Table") -> int:
+        name = f"{table.database.name}.{table.collection}".encode()
+        index = int.from_bytes(blake2b(name, digest_size=4).digest(), "little") % TABLE_GENERATIONS
+        return HEADER_SIZE + index * GENERATION.size
+
+
+    def _locked(self, offset: int, length: int) -> "_RangeLock":
+        return _RangeLock(self._fd, offset, length, self._thread_lock)
+
+
+
+class _RangeLock:
+
+    def __init__(self, fd: int, offset: int, length: int, thread_lock: Lock) -> None:
+        self.fd = fd
+        self.offset = offset
+        self.length = length
+        self.thread_lock = thread_lock
+
+
+    def __enter__(self) -> None:
+        self.thread_lock.acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, self.length, self.offset)
+
+
+    def __exit__(self, *args) -> None:
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, self.length, self.offset)
+        self.thread_lock.release()
@@ -0,0 +1,89 @@
+from typing import Any, AsyncIterator, Iterator, Callable, TYPE_CHECKING
+from json import dumps
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+
+from .utils import _JSON_ENCODERS
+
+if TYPE_CHECKING:
+    from .routing import Context
+
+
+__all__ = [
+    "STREAM_FORMATS", "is_streamable", "stream_items"
+]
+
+
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "array": "application/json",
+}
+
+
+
+def is_streamable(response: Any) -> bool:
+    """Check if a handler response is a generator or a cursor that should be streamed."""
+    return isinstance(response, (Iterator, AsyncIterator))
+
+
+async def _aiter_items(source: Iterator | AsyncIterator) -> AsyncIterator[Any]:
+    try:
+        if isinstance(source, AsyncIterator):
+            async for item in source:
+                yield item
+        else:
+            # sync iterators (and cursors) may block on the database, keep them out of the event loop
+            async for item in iterate_in_threadpool(source):
+                yield item
+    finally:
+        if hasattr(source, "aclose"):
+            await source.aclose()
+        elif hasattr(source, "close"):
+            source.close()
+
+
+async def _encode_items(source: Iterator | AsyncIterator,
+                        encode: Callable[[Any], Any],
+                        format: str) -> AsyncIterator[bytes]:
+    # StreamingResponse stops the iteration itself when the client disconnects
+    if format == "array":
+        yield b"["
+
+    count = 0
+    items = _aiter_items(source)
+    try:
+        async for item in items:
+            data = dumps(jsonable_encoder(encode(item), custom_encoder=_JSON_ENCODERS), separators=(",", ":"))
+
+            if format == "ndjson":
+                yield (data + "\n").encode()
+            else:
+                yield (data if count == 0 else "," + data).encode()
+            count += 1
+    finally:
+        await items.aclose()
+
+    if format == "array":
+        yield b"]"
+
+
+def stream_items(source: Iterator | AsyncIterator,
+                 ctx: "Context",
+                 format: str = "array") -> StreamingResponse:
+    """
+    Stream the items of a generator or a cursor as they are produced, as NDJSON or as a JSON array.
+    Each item is encoded with the route serialization method. The client can ask for NDJSON
+    with the `Accept: application/x-ndjson` header.
+    """
+    if "application/x-ndjson" in ctx.req.headers.get("accept", ""):
+        format = "ndjson"
+
+    if format not in STREAM_FORMATS:
+        raise ValueError(f"Unknown stream format {format!r}, expected one of {list(STREAM_FORMATS)}.")
+
+    return StreamingResponse(
+        _encode_items(source, ctx.route.encode_response, format),
+        media_type=STREAM_FORMATS[format],
+    )
@@ -0,0 +1,81 @@
+from typing import Any
+from weakref import finalize
+
+from pydantic import BaseModel
+
+
+__all__ = [
+    "ChangeTracker"
+]
+
+
+
+def _diff(old: dict, new: dict, prefix: str, set_: dict[str, Any], unset: dict[str, Any]) -> None:
+    for key, value in new.items():
+        path = prefix + key
+        if key not in old:
+            set_[path] = value
+            continue
+
+        old_value = old[key]
+        if old_value == value:
+            continue
+
+        if isinstance(old_value, dict) and isinstance(value, dict) and all(
+                isinstance(k, str) and "." not in k and not k.startswith("$") for k in value):
+            _diff(old_value, value, path + ".", set_, unset)
+        else:
+            # lists and scalars are replaced as a whole
+            set_[path] = value
+
+    for key in old:
+        if key not in new:
+            unset[prefix + key] = ""
+
+
+
+class ChangeTracker:
+    """Remember the state of the objects loaded from a table, to build the minimal update of their changes.
+    The assignments, as well as the mutations of the nested models, dicts and lists, are detected."""
+    version_field: str | None
+    """The field incremented at each save and checked to detect concurrent modifications, if any."""
+
+    def __init__(self, version_field: str | None = None) -> None:
+        self.version_field = version_field
+        self._snapshots: dict[int, dict[str, Any]] = {}
+
+
+    def track(self, object: BaseModel) -> None:
+        """Remember the current state of an object."""
+        key = id(object)
+        if key not in self._snapshots:
+            finalize(object, self._snapshots.pop, key, None)
+        self._snapshots[key] = object.model_dump()
+
+
+    def is_tracked(self, object: BaseModel) -> bool:
+        return id(object) in self._snapshots
+
+
+    def snapshot_of(self, object: BaseModel) -> dict[str, Any] | None:
+        return self._snapshots.get(id(object))
+
+
+    def changes_of(self, object: BaseModel) -> dict[str, dict[str, Any]]:
+        """Build the `$set`/`$unset` update of the changes of an object since it has been tracked.
+        An untracked object is entirely set."""
+        current = object.model_dump()
+        snapshot = self._snapshots.get(id(object))
+        if snapshot is None:
+            return {"$set": current}
+
+        set_: dict[str, Any] = {}
+        unset: dict[str, Any] = {}
+        _diff(snapshot, current, "", set_, unset)
+
+        update: dict[str, dict[str, Any]] = {}
+        if set_:
+            update["$set"] = set_
+        if unset:
+            update["$unset"] = unset
+        return update
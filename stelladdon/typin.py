@@ -7,6 +7,7 @@ if TYPE_CHECKING:
 __all__ = [
     "ControllerModelT", "ControllerT", "DepP",
     "ServiceT", "ServiceResultT", "TableModelT",
+    "ResultModelT",
 ]
 
 
@@ -14,3 +15,4 @@ DepP = ParamSpec("DepP")
 ServiceT = TypeVar("ServiceT", bound=Callable)
 ServiceResultT = TypeVar("ServiceResultT", bound=Any)
 TableModelT = TypeVar("TableModelT", bound="BaseModel")
+ResultModelT = TypeVar("ResultModelT", bound="BaseModel")
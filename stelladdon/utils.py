@@ -1,8 +1,44 @@
-from typing import Any, Optional
-from rich.console import Console
+from typing import Any, Callable, Optional
+from functools import cmp_to_key
+
+from bson import ObjectId
+
+
+_JSON_ENCODERS: dict[type, Callable[[Any], Any]] = {
+    ObjectId: str,
+}
 
 
 def _pretty(obj: Any) -> str:
+    # rich is only needed for the error messages, don't slow down the import of the package
+    from rich.console import Console
+
     console = Console(record=True)
     console.print(obj)
     return console.export_text(styles=True).strip()
+
+
+def _get_field(object: Any, path: str) -> Any:
+    for key in path.split("."):
+        if object is None:
+            return None
+        object = object.get(key) if isinstance(object, dict) else getattr(object, key, None)
+    return object
+
+
+def _sort_key(sort: list[tuple[str, int]]) -> Callable:
+    def compare(a: Any, b: Any) -> int:
+        for field, direction in sort:
+            x, y = _get_field(a, field), _get_field(b, field)
+            if x == y:
+                continue
+            # like MongoDB, the missing values come first in ascending order
+            if x is None:
+                result = -1
+            elif y is None:
+                result = 1
+            else:
+                result = -1 if x < y else 1
+            return result if direction >= 0 else -result
+        return 0
+    return cmp_to_key(compare)
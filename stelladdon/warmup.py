@@ -0,0 +1,153 @@
+from typing import Any, Awaitable, Callable, TYPE_CHECKING
+from inspect import isawaitable
+from time import perf_counter
+from asyncio import gather
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from .core import DatabaseGetterArg
+from .database import StellaMongo, Table
+
+if TYPE_CHECKING:
+    from .routing import StellAppMaster
+
+
+__all__ = [
+    "Warmup", "StartupReport"
+]
+
+
+
+class StartupReport:
+    """The readiness of the app and the duration of each step of its startup."""
+    ready: bool
+    """If all the steps succeeded."""
+    timings: dict[str, float]
+    """The duration of each step in seconds, and the total."""
+    errors: dict[str, str]
+    """The error of each failed step."""
+
+    def __init__(self) -> None:
+        self.ready = False
+        self.timings: dict[str, float] = {}
+        self.errors: dict[str, str] = {}
+
+
+    def __repr__(self) -> str:
+        timings = " ".join(f"{name}={duration * 1000:.1f}ms" for name, duration in self.timings.items())
+        return f"StartupReport(ready={self.ready} {timings})"
+
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "timings": {name: round(duration * 1000, 3) for name, duration in self.timings.items()},
+            "errors": self.errors,
+        }
+
+
+
+class Warmup:
+    """Prepare the app when it starts, in each worker process: compile the routes, create the MongoDB clients
+    and open their connections, load the in-memory tables and run the custom steps.
+    Should not be used directly, use `StellAppMaster.enable_warmup()`."""
+    clients: list[StellaMongo]
+    """The clients to connect, in addition to the ones of the tables."""
+    tables: list[Table]
+    """The tables to warm up, in addition to the ones used by the route arguments."""
+    connections: int
+    """The number of connections opened by each client."""
+    report: StartupReport
+    """The report of the last startup."""
+
+    def __init__(self,
+                 master: "StellAppMaster",
+                 clients: list[StellaMongo] | None = None,
+                 tables: list[Table] | None = None,
+                 connections: int = 1) -> None:
+        self.master = master
+        self.clients = clients or []
+        self.tables = tables or []
+        self.connections = connections
+        self.report = StartupReport()
+        self._steps: list[Callable[[], Any]] = []
+        self._running = False
+
+
+    def step(self, fn: Callable[[], Any]) -> Callable[[], Any]:
+        """Decorator adding a step to the warmup, such as filling a cache. The step is timed under its function name."""
+        self._steps.append(fn)
+        return fn
+
+
+    async def run(self) -> StartupReport:
+        """Run all the steps, even if one fails, and build the startup report."""
+        self._running = True
+        report = StartupReport()
+        start = perf_counter()
+        try:
+            tables: list[Table] = []
+
+            def compile_routes() -> None:
+                self.master.compile()
+                tables.extend(self.get_tables())
+
+            await self._run_step(report, "routes", compile_routes)
+
+            tables = tables or list(self.tables)
+            clients = list(self.clients)
+            for table in tables:
+                for shard in getattr(table, "shards", [table]):
+                    if shard.database.client not in clients:
+                        clients.append(shard.database.client)
+
+            await self._run_step(report, "clients", lambda: gather(*(
+                run_in_threadpool(client.connect, self.connections)
+                for client in clients if client.host is not None)))
+
+            await self._run_step(report, "tables", lambda: gather(*(
+                run_in_threadpool(shard.memory.refresh)
+                for table in tables for shard in getattr(table, "shards", [table])
+                if shard.memory is not None)))
+
+            for fn in self._steps:
+                await self._run_step(report, fn.__name__, fn)
+        finally:
+            report.timings["total"] = perf_counter() - start
+            report.ready = not report.errors
+            self.report = report
+            self._running = False
+        return report
+
+
+    def get_tables(self) -> list[Table]:
+        """Get the tables to warm up: the given ones and the ones used by the route arguments."""
+        tables = list(self.tables)
+        for route in self.master.get_routes():
+            for argument in route.get_arguments().values():
+                if isinstance(argument, DatabaseGetterArg) and argument.table not in tables:
+                    tables.append(argument.table)
+        return tables
+
+
+    async def readiness(self, req: Request) -> JSONResponse:
+        """The readiness endpoint: 200 with the startup report once ready, else 503.
+        A failed startup is retried by the next readiness check."""
+        if not self.report.ready and not self._running and self.report.timings:
+            await self.run()
+        return JSONResponse(self.report.as_dict(), status_code=200 if self.report.ready else 503)
+
+
+    @staticmethod
+    async def _run_step(report: StartupReport, name: str, fn: Callable[[], Awaitable[Any] | Any]) -> None:
+        start = perf_counter()
+        try:
+            result = fn()
+            if isawaitable(result):
+                await result
+        except Exception as e:
+            report.errors[name] = f"{type(e).__name__}: {e}"
+        finally:
+            report.timings[name] = perf_counter() - start
@@ -0,0 +1,213 @@
+from typing import Any, TYPE_CHECKING
+from threading import Lock, Event, Thread
+from time import perf_counter
+import atexit
+import logging
+
+from pymongo import UpdateOne
+from pymongo.write_concern import WriteConcern
+
+if TYPE_CHECKING:
+    from .database import Table
+
+
+__all__ = [
+    "WriteBehindBuffer", "WriteBehindStats"
+]
+
+
+MERGEABLE_OPERATORS = ("$inc", "$set", "$max")
+
+logger = logging.getLogger(__name__)
+
+
+
+class WriteBehindStats:
+    """The metrics of a write-behind buffer."""
+    flushes: int
+    """The number of bulk writes sent."""
+    flushed_writes: int
+    """The number of updates that have been sent, after merging."""
+    merged_writes: int
+    """The number of updates that have been merged into a pending one."""
+    dropped_writes: int
+    """The number of updates lost because their bulk write failed."""
+    last_flush_latency: float
+    """The duration of the last flush, in seconds."""
+    total_flush_latency: float
+    """The total duration of all the flushes, in seconds."""
+
+    def __init__(self) -> None:
+        self.flushes = 0
+        self.flushed_writes = 0
+        self.merged_writes = 0
+        self.dropped_writes = 0
+        self.last_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+
+    def __repr__(self) -> str:
+        return (f"WriteBehindStats(flushes={self.flushes}, flushed={self.flushed_writes}, "
+                f"merged={self.merged_writes}, dropped={self.dropped_writes}, "
+                f"last_latency={self.last_flush_latency:.4f}s)")
+
+
+
+class WriteBehindBuffer:
+    """Accumulate the `$inc`, `$set` and `$max` updates of a table in memory and send them as bulk writes.
+    Updates on the same primary key are merged, so a counter incremented a thousand times is written once.
+    The buffered updates are not visible to the reads until they are flushed."""
+    table: "Table"
+    """The table whose updates are buffered."""
+    max_size: int
+    """The number of pending objects that triggers a flush."""
+    max_delay: float
+    """The maximum time in seconds an update can stay in the buffer."""
+    write_concern: int
+    """The write concern of the bulk writes, 0 to not wait for the acknowledgement."""
+    stats: WriteBehindStats
+    """The flush metrics of the buffer."""
+
+    def __init__(self,
+                 table: "Table",
+                 max_size: int = 1000,
+                 max_delay: float = 1.0,
+                 write_concern: int = 1) -> None:
+        """Create a write-behind buffer. Should not be used directly, use `Table.enable_write_behind()`."""
+        self.table = table
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.write_concern = write_concern
+        self.stats = WriteBehindStats()
+
+        self._pending: dict[Any, dict[str, dict[str, Any]]] = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._closed = Event()
+        self._thread = Thread(target=self._run, name=f"stelladdon-writebehind-{table.collection}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+    @staticmethod
+    def can_buffer(update: dict) -> bool:
+        """Check if an update only uses operators that can be merged."""
+        return bool(update) and all(op in MERGEABLE_OPERATORS for op in update)
+
+
+    def add(self, object_id: Any, update: dict) -> None:
+        """Add an update to the buffer, merging it with the pending update of the same object."""
+        if self._closed.is_set():
+            self.table._write_collection(self.write_concern).update_one({self.table.primary_key: object_id}, update)
+            self.table._notify_write(object_id)
+            return
+
+        with self._lock:
+            pending = self._pending.get(object_id)
+            if pending is not None and self._conflicts(pending, update):
+                conflicting = True
+            else:
+                conflicting = False
+                if pending is None:
+                    pending = self._pending[object_id] = {}
+                else:
+                    self.stats.merged_writes += 1
+                self._merge(pending, update)
+            full = len(self._pending) >= self.max_size
+
+        if conflicting:
+            self.flush()
+            self.add(object_id, update)
+        elif full:
+            self.flush()
+
+
+    def discard(self, object_id: Any) -> None:
+        """Forget the pending update of an object."""
+        with self._lock:
+            self._pending.pop(object_id, None)
+
+
+    def flush(self) -> None:
+        """Send all the pending updates as one unordered bulk write."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            if not pending:
+                return
+
+            start = perf_counter()
+            try:
+                # the updates are stamped now, so the sync tokens don't pass them while they wait in the buffer
+                with self.table._stamping() as seq:
+                    requests = [
+                        UpdateOne({self.table.primary_key: object_id}, self.table._stamp(update, seq))
+                        for object_id, update in pending.items()
+                    ]
+                    self.table._write_collection(self.write_concern).bulk_write(requests, ordered=False)
+            except Exception as e:
+                # with ordered=False the successful writes of a failed bulk are still applied
+                write_errors = getattr(e, "details", None) or {}
+                dropped = len(write_errors.get("writeErrors", pending))
+                self.stats.dropped_writes += dropped
+                logger.exception("The write-behind flush of %s dropped %d of its %d updates.",
+                                 self.table.collection, dropped, len(pending))
+            finally:
+                latency = perf_counter() - start
+                self.stats.flushes += 1
+                self.stats.flushed_writes += len(pending)
+                self.stats.last_flush_latency = latency
+                self.stats.total_flush_latency += latency
+
+            # only now the reads see the updates, the caches loaded before must be invalidated
+            for object_id in pending:
+                self.table._notify_write(object_id)
+
+
+    def close(self) -> None:
+        """Flush the pending updates and stop the background flushing. Called at interpreter exit."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self.flush()
+        atexit.unregister(self.close)
+
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.max_delay):
+            self.flush()
+
+
+    @staticmethod
+    def _conflicts(pending: dict[str, dict[str, Any]], update: dict) -> bool:
+        # MongoDB rejects an update modifying a field and one of its parents or children
+        for op, fields in update.items():
+            for other_op, other_fields in pending.items():
+                for field in fields:
+                    for other in other_fields:
+                        if field == other:
+                            if op != other_op:
+                                return True
+                        elif other.startswith(field + ".") or field.startswith(other + "."):
+                            return True
+        return False
+
+
+    @staticmethod
+    def _merge(pending: dict[str, dict[str, Any]], update: dict) -> None:
+        for op, fields in update.items():
+            merged = pending.setdefault(op, {})
+            for field, value in fields.items():
+                if field not in merged:
+                    merged[field] = value
+                elif op == "$inc":
+                    merged[field] += value
+                elif op == "$max":
+                    merged[field] = max(merged[field], value)
+                else:
+                    merged[field] = value
@@ -0,0 +1,61 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from stelladdon import StellAppMaster, Service, AdmissionLimit
+
+
+
+def build(limit: AdmissionLimit) -> tuple[FastAPI, StellAppMaster]:
+    app = FastAPI()
+    master = StellAppMaster(app)
+
+    priorities = Service("Priorities")
+
+    @priorities.priority
+    def priority(req):
+        return int(req.headers.get("x-priority", "0"))
+
+    @master.route("GET", "/slow", [priorities], admission=limit)
+    async def slow():
+        await asyncio.sleep(0.1)
+        return {"ok": 1}
+
+    return app, master
+
+
+async def send(app: FastAPI, *priorities: int) -> list[httpx.Response]:
+    transport = httpx.ASGITransport(app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        async def get(delay: float, priority: int) -> httpx.Response:
+            await asyncio.sleep(delay)
+            return await client.get("/slow", headers={"x-priority": str(priority)})
+
+        return await asyncio.gather(*(get(index * 0.01, priority) for index, priority in enumerate(priorities)))
+
+
+
+def test_requests_are_queued_then_shed():
+    app, master = build(AdmissionLimit(1, max_queue=1, queue_timeout=2.0, retry_after=3))
+    responses = asyncio.run(send(app, 0, 0, 0))
+    assert [response.status_code for response in responses] == [200, 200, 503]
+    assert responses[2].headers["retry-after"] == "3"
+    assert responses[2].json()["error"] == "stellapi.overloaded"
+
+    stats = master.get_admission_stats()["GET /slow"]
+    assert (stats["admitted"], stats["shed"], stats["maxQueued"], stats["active"], stats["queued"]) == (2, 1, 1, 0, 0)
+
+
+def test_queued_requests_time_out():
+    app, master = build(AdmissionLimit(1, max_queue=1, queue_timeout=0.02))
+    responses = asyncio.run(send(app, 0, 0))
+    assert [response.status_code for response in responses] == [200, 503]
+    assert master.get_admission_stats()["GET /slow"]["timedOut"] == 1
+
+
+def test_higher_priority_takes_the_queue_place():
+    app, master = build(AdmissionLimit(1, max_queue=1, queue_timeout=2.0))
+    responses = asyncio.run(send(app, 0, 0, 5, 0))
+    assert [response.status_code for response in responses] == [200, 503, 200, 503]
+    assert master.get_admission_stats()["GET /slow"]["shed"] == 2
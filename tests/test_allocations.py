@@ -0,0 +1,41 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from stelladdon import StellAppMaster
+
+
+
+def build(secret: str | None) -> tuple[TestClient, StellAppMaster]:
+    app = FastAPI()
+    master = StellAppMaster(app)
+    master.enable_allocation_profiling(rate=0.0, secret=secret)
+
+    @master.route("GET", "/build")
+    def build_list():
+        data = [str(i) * 10 for i in range(5000)]
+        return {"size": len(data)}
+
+    return TestClient(app), master
+
+
+
+def test_sampled_requests_are_attributed_to_their_phases():
+    client, master = build("secret")
+    master.allocations.arm("/build", 2)
+    for _ in range(3):
+        assert client.get("/build").json() == {"size": 5000}
+
+    assert client.get("/_stella/allocations").status_code == 403
+    assert client.get("/_stella/allocations", headers={"X-Stella-Admin": "wrong"}).status_code == 403
+    stats = client.get("/_stella/allocations?top=3", headers={"X-Stella-Admin": "secret"}).json()["/build"]
+    assert stats["samples"] == 2
+    assert stats["phases"]["handler"]["peak_bytes"] > 5000 * 10
+    assert 0 < len(stats["top"]) <= 3
+
+
+def test_endpoint_is_not_mounted_without_secret():
+    client, master = build(None)
+    master.allocations.arm("/build")
+    client.get("/build")
+    assert client.get("/_stella/allocations").status_code == 404
+    assert master.allocations.as_dict()["/build"]["samples"] == 1
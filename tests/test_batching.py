@@ -0,0 +1,112 @@
+import pytest
+from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, StellAppMaster, Table, Service, Context
+
+
+
+class Item(BaseModel):
+    id: int
+    name: str
+
+
+
+@pytest.fixture
+def app() -> tuple[TestClient, list]:
+    table = Table(Item, "items", StellaMongo(None).get_database("shop"), "id")
+    table.enable_memory(offline=True)
+    for id in range(300):
+        table.insert(Item(id=id, name=f"i{id}"))
+
+    app = FastAPI()
+    master = StellAppMaster(app)
+    master.enable_batch(max_requests=5)
+    calls = []
+
+    auth = Service("Auth", batch_safe=True)
+
+    @auth.before
+    async def authenticate(stella: Context, token: str):
+        calls.append(token)
+        stella.states["user"] = token
+
+    @master.route("GET", "/items/{id}", [auth])
+    def get_item(stella: Context, id: int):
+        return {"item": table.get(id).model_dump(), "user": stella.states["user"]}
+
+    @master.route("GET", "/items")
+    def list_items():
+        return table.iter_find({})
+
+    @master.route("POST", "/echo")
+    def echo(body: dict):
+        return body
+
+    @master.route("GET", "/forbidden")
+    def forbidden(stella: Context):
+        stella.raise_api_error("shop.forbidden", 403, "No.")
+
+    @master.route("GET", "/teapot")
+    def teapot():
+        raise HTTPException(418, "I'm a teapot.")
+
+    @master.route("GET", "/broken")
+    def broken():
+        return Response(b"{not json", media_type="application/json")
+
+    @master.route("GET", "/background")
+    def background():
+        tasks = BackgroundTasks()
+        tasks.add_task(calls.append, "background")
+        return Response(b'{"ok":1}', media_type="application/json", background=tasks)
+
+    return TestClient(app), calls
+
+
+
+def batch(client: TestClient, *requests: dict, token: str = "abc") -> list[dict]:
+    response = client.post(f"/batch?token={token}", json={"requests": list(requests)})
+    assert response.status_code == 200
+    return response.json()["responses"]
+
+
+
+def test_sub_requests_share_the_batch_safe_services(app):
+    client, calls = app
+    responses = batch(client, {"path": "/items/1?token=abc"}, {"path": "/items/2?token=abc"},
+                      {"method": "POST", "path": "/echo", "body": {"a": 1}})
+    assert [response["status"] for response in responses] == [200, 200, 200]
+    assert responses[1]["body"] == {"item": {"id": 2, "name": "i2"}, "user": "abc"}
+    assert responses[2]["body"] == {"a": 1}
+    assert calls == ["abc"]
+
+
+def test_errors_are_returned_per_sub_request(app):
+    client, _ = app
+    responses = batch(client, {"path": "/forbidden"}, {"path": "/teapot"}, {"path": "/nope"},
+                      {"path": "/broken"}, {"path": "/items/1?token=abc"})
+    assert [response["status"] for response in responses] == [403, 418, 404, 500, 200]
+    assert responses[0]["body"]["error"] == "shop.forbidden"
+    assert responses[1]["body"] == {"detail": "I'm a teapot."}
+    assert responses[3]["body"]["message"] == "An internal error occurred."
+
+
+def test_streamed_sub_responses_are_complete(app):
+    client, _ = app
+    responses = batch(client, {"path": "/items"})
+    assert [item["id"] for item in responses[0]["body"]] == list(range(300))
+
+
+def test_background_tasks_run(app):
+    client, calls = app
+    assert batch(client, {"path": "/background"})[0]["body"] == {"ok": 1}
+    assert calls == ["background"]
+
+
+def test_invalid_batches(app):
+    client, _ = app
+    assert client.post("/batch", json={"requests": {}}).status_code == 400
+    assert client.post("/batch", json={"requests": [{"path": "/echo"}] * 6}).status_code == 413
@@ -0,0 +1,65 @@
+from typing import Annotated
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from stelladdon import StellaMongo, StellAppMaster, Table, Service, Context, APIObject, FromDB, RouteCache
+
+
+
+class User(APIObject):
+    id: str
+    name: str
+
+    def get_api_data(self, mode: str) -> dict:
+        return {"id": self.id, "name": self.name}
+
+
+
+@pytest.fixture
+def app() -> tuple[TestClient, Table, list]:
+    table = Table(User, "users", StellaMongo(None).get_database("accounts"), "id")
+    table.enable_memory(offline=True)
+    for id in range(3):
+        table.insert(User(id=str(id), name="x"))
+
+    app = FastAPI()
+    master = StellAppMaster(app)
+    calls = []
+
+    auth = Service("Auth")
+
+    @auth.before
+    async def authenticate(stella: Context, token: str):
+        calls.append(token)
+        if token != "good":
+            stella.raise_api_error("accounts.unauthorized", 401)
+
+    @master.route("GET", "/users/{id}", [auth], cache=RouteCache(ttl=60))
+    def get_user(id: Annotated[User, FromDB(table)]):
+        calls.append("handler")
+        return id
+
+    return TestClient(app), table, calls
+
+
+
+def test_services_run_on_cache_hits(app):
+    client, _, calls = app
+    assert client.get("/users/1?token=good").json() == {"id": "1", "name": "x"}
+    assert client.get("/users/1?token=good").status_code == 200
+    assert client.get("/users/1?token=bad").status_code == 401
+    assert calls == ["good", "handler", "good", "bad"]
+
+
+def test_arguments_read_from_the_tables_invalidate(app):
+    client, table, calls = app
+    etag = client.get("/users/1?token=good").headers["etag"]
+    assert client.get("/users/1?token=good", headers={"If-None-Match": etag}).status_code == 304
+
+    table.update("1", {"$set": {"name": "z"}})
+    response = client.get("/users/1?token=good", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json() == {"id": "1", "name": "z"}
+    assert calls.count("handler") == 2
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, Table, ShardedTable, StelladdonError, InvalidSyncToken, ExpiredSyncToken
+
+
+
+class Note(BaseModel):
+    id: int
+    owner: str
+    text: str = ""
+
+
+
+@pytest.fixture
+def table() -> Table[Note]:
+    table = Table(Note, "notes", StellaMongo(None).get_database("app"), "id")
+    table.enable_memory(offline=True)
+    table.enable_versioning()
+    for id in range(4):
+        table.insert(Note(id=id, owner="a" if id % 2 else "b"))
+    return table
+
+
+
+def test_changes_since(table):
+    changes = table.changes_since(None)
+    assert [note.id for note in changes.upserted] == [0, 1, 2, 3]
+
+    table.update(1, {"$set": {"text": "x"}})
+    table.remove(2)
+    changes = table.changes_since(changes.token)
+    assert [note.text for note in changes.upserted] == ["x"]
+    assert changes.removed == [2]
+
+    with pytest.raises(InvalidSyncToken):
+        table.changes_since("abc")
+
+
+def test_tokens_stay_below_writes_in_flight(table):
+    token = table.changes_since(None).token
+
+    # a write that started first but is committed after a later one must not be skipped
+    with table.versions.write() as seq:
+        table.update(0, {"$set": {"text": "later"}})
+        changes = table.changes_since(token)
+        assert changes.upserted == []
+        assert int(changes.token) < seq
+        table._collection.update_one({"id": 1}, table.versions.stamp({"$set": {"text": "first"}}, seq))
+
+    changes = table.changes_since(changes.token)
+    assert sorted(note.text for note in changes.upserted) == ["first", "later"]
+
+
+def test_filtered_changes_remove_the_objects_not_matching(table):
+    token = table.changes_since(None, {"owner": "a"}).token
+
+    table.update(1, {"$set": {"owner": "b"}})
+    table.update(3, {"$set": {"text": "y"}})
+    changes = table.changes_since(token, {"owner": "a"})
+    assert [note.id for note in changes.upserted] == [3]
+    assert changes.removed == [1]
+
+
+def test_expired_tokens(table):
+    token = table.changes_since(None).token
+    table.remove(0)
+    table.remove(1)
+    recent = table.changes_since(None).token
+
+    table.versions.tombstones._collection.update_one(
+        {"id": 0}, {"$set": {"at": datetime.now(timezone.utc) - timedelta(days=31)}})
+    table.versions.prune()
+
+    assert table.versions.tombstones.count() == 1
+    with pytest.raises(ExpiredSyncToken):
+        table.changes_since(token)
+    assert table.changes_since(recent).removed == []
+    assert [note.id for note in table.changes_since(None).upserted] == [2, 3]
+
+
+def test_sharded_table_versioning_is_rejected():
+    table = ShardedTable(Note, "notes", "app", [StellaMongo(None) for _ in range(2)], "id")
+    with pytest.raises(StelladdonError):
+        table.enable_versioning()
+
+
+def test_objects_written_before_the_versioning_are_synced():
+    table = Table(Note, "notes", StellaMongo(None).get_database("app"), "id")
+    table.enable_memory(offline=True)
+    for id in range(5):
+        table.insert(Note(id=id, owner="a"))
+    table.enable_versioning()
+    table.update(4, {"$set": {"text": "x"}})
+
+    changes = table.changes_since(None, limit=2)
+    ids = [note.id for note in changes.upserted]
+    while changes.more:
+        changes = table.changes_since(changes.token, limit=2)
+        ids += [note.id for note in changes.upserted]
+    assert sorted(ids) == [0, 1, 2, 3, 4]
+    assert table.changes_since(changes.token).upserted == []
+
+
+def test_pipeline_updates_are_rejected(table):
+    with pytest.raises(StelladdonError):
+        table.versions.stamp([{"$set": {"text": "x"}}], 1)
@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from stelladdon import StellAppMaster, Service, Context, Coalesce
+
+
+
+@pytest.fixture
+def app() -> tuple[FastAPI, list]:
+    app = FastAPI()
+    master = StellAppMaster(app)
+    calls = []
+
+    auth = Service("Auth")
+
+    @auth.before
+    async def authenticate(stella: Context, token: str):
+        calls.append(token)
+        if token != "good":
+            stella.raise_api_error("shop.unauthorized", 401)
+
+    @master.route("GET", "/report", [auth], coalesce=Coalesce(query_params=[]))
+    async def report():
+        calls.append("handler")
+        await asyncio.sleep(0.05)
+        return {"total": 42}
+
+    @master.route("GET", "/failing", coalesce=Coalesce())
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ValueError("failed")
+
+    return app, calls
+
+
+
+async def get_all(app: FastAPI, *urls: str) -> list:
+    transport = httpx.ASGITransport(app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.gather(*(client.get(url) for url in urls), return_exceptions=True)
+
+
+
+def test_followers_run_the_services(app):
+    app, calls = app
+    responses = asyncio.run(get_all(app, "/report?token=good", "/report?token=good", "/report?token=bad"))
+    assert [response.status_code for response in responses] == [200, 200, 401]
+    assert responses[1].json() == {"total": 42}
+    assert calls.count("handler") == 1
+    assert sorted(call for call in calls if call != "handler") == ["bad", "good", "good"]
+
+
+def test_followers_raise_their_own_error(app):
+    app, _ = app
+    errors = asyncio.run(get_all(app, "/failing", "/failing", "/failing"))
+    assert all(isinstance(error, ValueError) and error.args == ("failed",) for error in errors)
+    assert len({id(error) for error in errors}) == 3
+    leaders = [error for error in errors if error.__cause__ is None]
+    assert len(leaders) == 1
+    assert all(error.__cause__ is leaders[0] for error in errors if error is not leaders[0])
@@ -0,0 +1,30 @@
+import pytest
+
+from stelladdon import ColumnResult
+
+
+
+@pytest.fixture
+def result() -> ColumnResult:
+    result = ColumnResult(["count", "price", "name", "extra"])
+    result.add_documents([
+        {"count": 1, "price": 1.5, "name": "a", "extra": [1]},
+        {"count": 2, "name": "b", "extra": "x"},
+        {"count": 3, "price": 4.5, "name": "a"},
+    ])
+    return result
+
+
+
+def test_numeric_aggregates(result):
+    assert result.sum("count") == 6
+    assert result.mean("price") == 3.0
+    assert result.min("name") == "a" and result.max("count") == 3
+
+
+def test_sum_of_non_numeric_columns(result):
+    for field in ("name", "extra"):
+        with pytest.raises(TypeError):
+            result.sum(field)
+        with pytest.raises(TypeError):
+            result.mean(field)
@@ -0,0 +1,113 @@
+from json import dumps
+from time import sleep
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, StellAppMaster, Table, ShardedTable, Ingest
+
+
+
+class Event(BaseModel):
+    id: int
+    kind: str
+
+
+
+class RecordingIngest(Ingest):
+    """Record how far the body has been read at each bulk write."""
+
+    def __init__(self, table: Table, **kwargs) -> None:
+        super().__init__(table, **kwargs)
+        self.writes: list[tuple[int, int]] = []
+
+
+    def _write(self, batch, summary) -> None:
+        sleep(0.005)
+        self.writes.append((summary.lines, len(batch)))
+        super()._write(batch, summary)
+
+
+
+def build(table: Table, **kwargs) -> tuple[TestClient, RecordingIngest]:
+    app = FastAPI()
+    master = StellAppMaster(app)
+    ingest = RecordingIngest(table, **kwargs)
+
+    @master.route("POST", "/events", ingest=ingest)
+    def events():
+        pass
+
+    return TestClient(app), ingest
+
+
+def offline_table() -> Table[Event]:
+    table = Table(Event, "events", StellaMongo(None).get_database("log"), "id")
+    table.enable_memory(offline=True)
+    return table
+
+
+def ndjson(*lines: str) -> bytes:
+    return "\n".join(lines).encode()
+
+
+
+def test_lines_split_across_chunks():
+    table = offline_table()
+    client, _ = build(table)
+    body = ndjson(*(dumps({"id": id, "kind": "click"}) for id in range(50)))
+    chunks = [body[start:start + 7] for start in range(0, len(body), 7)]
+
+    summary = client.post("/events", content=iter(chunks)).json()
+    assert summary["lines"] == 50 and summary["inserted"] == 50
+    assert sorted(event.id for event in table.find({})) == list(range(50))
+
+
+def test_oversize_and_invalid_lines():
+    table = offline_table()
+    client, _ = build(table, max_line_size=40)
+    body = ndjson(dumps({"id": 1, "kind": "a"}), dumps({"id": 2, "kind": "x" * 100}), "{not json",
+                  "", dumps({"id": 3, "kind": "b"}))
+    chunks = [body[start:start + 16] for start in range(0, len(body), 16)]
+
+    summary = client.post("/events", content=iter(chunks)).json()
+    assert (summary["lines"], summary["inserted"], summary["invalid"]) == (4, 2, 2)
+    assert [error["line"] for error in summary["errors"]] == [2, 3]
+
+
+def test_duplicates_are_counted():
+    table = offline_table()
+    table.insert(Event(id=1, kind="old"))
+    client, _ = build(table, batch_size=2)
+    body = ndjson(*(dumps({"id": id, "kind": "new"}) for id in [0, 1, 2, 2, 3]))
+
+    summary = client.post("/events", content=body).json()
+    assert (summary["inserted"], summary["duplicates"]) == (3, 2)
+    assert table.get(1).kind == "old"
+
+
+def test_reading_waits_for_the_writes():
+    table = offline_table()
+    client, ingest = build(table, batch_size=10, max_pending=1)
+    lines = [dumps({"id": id, "kind": "click"}) for id in range(500)]
+    chunks = [(line + "\n").encode() for line in lines]
+
+    assert client.post("/events", content=iter(chunks)).json()["inserted"] == 500
+    written = 0
+    for read, size in ingest.writes:
+        # the batch being written, the one queued and the one being filled
+        assert read - written <= 3 * 10 + 1
+        written += size
+
+
+def test_sharded_table():
+    table = ShardedTable(Event, "events", "log", [StellaMongo(None) for _ in range(3)], "id")
+    table.enable_memory(offline=True)
+    client, _ = build(table, batch_size=7)
+    body = ndjson(*(dumps({"id": id, "kind": "click"}) for id in range(30)))
+
+    assert client.post("/events", content=body).json()["inserted"] == 30
+    assert all(table.shard_of(event.id).get(event.id) is not None for event in table.find({}))
+    assert table.count() == 30
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, Table, TableLoader
+
+
+
+class Author(BaseModel):
+    id: int
+    name: str
+
+
+
+@pytest.fixture
+def table() -> Table[Author]:
+    table = Table(Author, "authors", StellaMongo(None).get_database("blog"), "id")
+    table.enable_memory(offline=True)
+    for id in range(5):
+        table.insert(Author(id=id, name=f"a{id}"))
+    return table
+
+
+def counting(table: Table, monkeypatch) -> list[list]:
+    queries = []
+    get_many = table.get_many
+
+    def recording_get_many(ids):
+        queries.append(list(ids))
+        return get_many(ids)
+
+    monkeypatch.setattr(table, "get_many", recording_get_many)
+    return queries
+
+
+
+def test_loads_of_the_same_tick_are_batched(table, monkeypatch):
+    queries = counting(table, monkeypatch)
+
+    async def run():
+        loader = TableLoader(table)
+        first = await asyncio.gather(loader.load(1), loader.load(3), loader.load(1), loader.load(9))
+        second = await loader.load_many([3, 4])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert [author and author.id for author in first] == [1, 3, 1, None]
+    assert [author.id for author in second] == [3, 4]
+    assert queries == [[1, 3, 9], [4]]
+
+
+def test_primed_objects_are_not_queried(table, monkeypatch):
+    queries = counting(table, monkeypatch)
+
+    async def run():
+        loader = TableLoader(table)
+        loader.prime(Author(id=2, name="primed"))
+        return await loader.load_many([2, 0])
+
+    assert [author.name for author in asyncio.run(run())] == ["primed", "a0"]
+    assert queries == [[0]]
+
+
+def test_errors_are_given_to_every_waiting_load(table, monkeypatch):
+    def failing_get_many(ids):
+        raise RuntimeError("unreachable")
+
+    monkeypatch.setattr(table, "get_many", failing_get_many)
+
+    async def run():
+        loader = TableLoader(table)
+        return await asyncio.gather(loader.load(1), loader.load(2), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
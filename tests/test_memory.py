@@ -0,0 +1,204 @@
+from threading import Thread
+
+import pytest
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, Table, StelladdonError, ObjectAlreadyExists, ConcurrentModification
+
+
+
+class Plan(BaseModel):
+    id: int
+    name: str
+    tier: str
+    price: float
+    tags: list[str] = []
+
+
+
+@pytest.fixture
+def table() -> Table[Plan]:
+    table = Table(Plan, "plans", StellaMongo(None).get_database("shop"), "id")
+    table.enable_memory(["tier", "tags"], offline=True)
+    for id in range(10):
+        table.insert(Plan(id=id, name=f"p{id}", tier=["free", "pro", "ent"][id % 3], price=id * 1.5,
+                          tags=["a"] if id % 2 else ["b", "c"]))
+    return table
+
+
+
+def test_get(table):
+    assert table.get(3).name == "p3"
+    assert table.get(99) is None
+    assert [plan and plan.id for plan in table.get_many([1, 99, 2])] == [1, None, 2]
+
+
+def test_find_with_operators(table):
+    assert [plan.id for plan in table.find({"tier": "pro"})] == [1, 4, 7]
+    assert [plan.id for plan in table.find({"tags": "c"})] == [0, 2, 4, 6, 8]
+    assert [plan.id for plan in table.find({"tier": {"$in": ["pro", "ent"]}, "price": {"$gte": 6}},
+                                           sort=[("price", -1)], limit=2)] == [8, 7]
+    assert [plan.id for plan in table.find({"tier": {"$nin": ["free", "pro"]}, "id": {"$lt": 6}})] == [2, 5]
+    assert [plan.id for plan in table.find({}, sort=[("id", -1)], skip=2, limit=3)] == [7, 6, 5]
+    assert table.find_one({"tier": "ent"}, sort=[("price", -1)]).id == 8
+    assert table.find({"missing": {"$exists": True}}) == []
+
+
+def test_counts_and_distinct(table):
+    assert table.count() == 10
+    assert table.count({"tags": "a"}) == 5
+    assert table.estimated_count() == 10
+    assert table.exists({"tier": "free"})
+    assert not table.exists({"tier": "unknown"})
+    assert sorted(table.distinct("tier")) == ["ent", "free", "pro"]
+    assert table.find_columns({"tier": "pro"}, ["id", "price"]).to_dict() == {"id": [1, 4, 7], "price": [1.5, 6.0, 10.5]}
+
+
+def test_updates_keep_the_indexes_up_to_date(table):
+    table.update(3, {"$set": {"tier": "free"}, "$push": {"tags": "q"}, "$inc": {"price": 1}})
+    assert table.get(3).tier == "free"
+    assert table.get(3).tags == ["a", "q"]
+    assert table.get(3).price == 5.5
+    assert 3 in [plan.id for plan in table.find({"tier": "free"})]
+    assert 3 not in [plan.id for plan in table.find({"tier": "ent"})]
+    assert [plan.id for plan in table.find({"tags": "q"})] == [3]
+
+    table.update_many({"tier": "pro"}, {"$max": {"price": 100}})
+    assert [plan.price for plan in table.find({"tier": "pro"})] == [100, 100, 100]
+
+
+def test_insert_push_and_remove(table):
+    with pytest.raises(ObjectAlreadyExists):
+        table.insert(Plan(id=1, name="duplicate", tier="free", price=0))
+
+    table.push(Plan(id=1, name="replaced", tier="ent", price=9))
+    assert table.get(1).name == "replaced"
+    assert table.count({"tier": "ent"}) == 4
+
+    table.remove(4)
+    assert table.get(4) is None
+    table.remove_many({"tier": "free"})
+    assert table.count() == 5
+    assert table.find({"tier": "free"}) == []
+
+
+def test_change_tracking(table):
+    table.enable_change_tracking("price")
+    first, second = table.get(3), table.get(3)
+    assert first is not second
+
+    first.name = "first"
+    table.save(first)
+    assert table.get(3).name == "first"
+
+    second.name = "second"
+    with pytest.raises(ConcurrentModification):
+        table.save(second)
+
+
+def test_write_behind(table):
+    table.enable_write_behind(max_delay=60)
+    try:
+        table.update(1, {"$inc": {"price": 1}})
+        table.update(1, {"$inc": {"price": 1}})
+        table.flush()
+        assert table.get(1).price == 3.5
+    finally:
+        table.disable_write_behind()
+
+
+def test_unsupported_operations(table):
+    with pytest.raises(StelladdonError):
+        table.find({"name": {"$regex": "^p1"}})
+    with pytest.raises(StelladdonError):
+        table.aggregate([{"$match": {}}])
+
+
+def test_results_are_copies(table):
+    plan = table.get(1)
+    plan.name = "modified"
+    plan.tags.append("modified")
+    table.find({"tier": "pro"})[0].tags.clear()
+
+    assert table.get(1).name == "p1"
+    assert table.get(1).tags == ["a"]
+    assert table.get(1) is not table.get(1)
+
+
+def test_booleans_are_not_numbers():
+    class Flag(BaseModel):
+        id: int
+        value: bool | int | float
+
+    table = Table(Flag, "flags", StellaMongo(None).get_database("shop"), "id")
+    table.enable_memory(["value"], offline=True)
+    for id, value in enumerate([True, 1, 1.0, False, 0]):
+        table.insert(Flag(id=id, value=value))
+
+    assert [flag.id for flag in table.find({"value": True})] == [0]
+    assert [flag.id for flag in table.find({"value": 1})] == [1, 2]
+    assert [flag.id for flag in table.find({"value": {"$in": [0]}})] == [4]
+    assert [flag.id for flag in table.find({"value": {"$gte": 1}})] == [1, 2]
+    assert table.count({"id": {"$in": [True]}}) == 0
+
+
+def test_reads_during_a_reload(table):
+    documents = [table.memory.document_of(id) for id in range(10)]
+    documents += [{"id": id, "name": f"p{id}", "tier": "free", "price": 0.0, "tags": []} for id in range(10, 5000)]
+    table.memory.load(documents)
+    errors = []
+
+    def reload() -> None:
+        try:
+            for _ in range(10):
+                table.memory.load(documents)
+        except Exception as e:
+            errors.append(e)
+
+    thread = Thread(target=reload)
+    thread.start()
+    while thread.is_alive():
+        assert table.get(4999) is not None
+        assert len(table.find({"tier": "pro"})) == 3
+        assert table.find_one({"tier": "ent"}, sort=[("price", -1)]).id == 8
+    thread.join()
+    assert errors == []
+    assert table.count() == 5000
+
+
+def test_writes_during_a_reload_are_kept(table):
+    documents = list(table.memory.collection.find({}))
+    contents = table.memory._contents
+
+    # a reload reading the documents before a write must not bring the old version back
+    def load_then_write():
+        yield from documents[:5]
+        table.update(7, {"$set": {"name": "written"}})
+        table.remove(8)
+        yield from documents[5:]
+
+    table.memory.load(load_then_write())
+    assert table.memory._contents is not contents
+    assert table.get(7).name == "written"
+    assert table.get(8) is None
+    assert table.count() == 9
+
+
+def test_loaded_at_first_read(table):
+    loads = []
+
+    class Mirror(Table):
+        # reads the offline table as its database
+        @property
+        def _collection(self):
+            loads.append(1)
+            return table.memory.collection
+
+    mirror = Mirror(Plan, "plans", table.database, "id")
+    memory = mirror.enable_memory(["tier"], refresh_interval=60)
+    assert loads == [] and memory._thread is None
+
+    assert mirror.get(4).name == "p4"
+    assert len(mirror.find({"tier": "pro"})) == 3
+    assert loads == [1] and memory._thread is not None
+    mirror.disable_memory()
@@ -0,0 +1,77 @@
+from typing import Annotated
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, StellAppMaster, Table, Context, FromDB
+
+
+
+class Comment(BaseModel):
+    id: int
+    post: str
+    text: str
+
+
+
+@pytest.fixture
+def app() -> tuple[TestClient, Table]:
+    table = Table(Comment, "comments", StellaMongo(None).get_database("blog"), "id")
+    table.enable_memory(offline=True)
+    for id in range(12):
+        table.insert(Comment(id=id, post=str(id % 2), text=f"c{id}"))
+
+    app = FastAPI()
+    master = StellAppMaster(app)
+
+    @master.route("GET", "/posts/{post}/comments")
+    def comments(stella: Context, post: str):
+        return stella.paginate_table(table, {"post": post}, sort=[("id", 1)])
+
+    @master.route("GET", "/texts")
+    def texts(stella: Context):
+        return stella.paginate([f"t{i}" for i in range(7)])
+
+    @master.route("GET", "/posts/{post}/count")
+    def count(post: Annotated[int, FromDB(table, key="post", count=True)]):
+        return {"count": post}
+
+    @master.route("GET", "/posts/{post}/exists")
+    def exists(post: Annotated[bool, FromDB(table, key="post", exists=True)]):
+        return {"exists": post}
+
+    return TestClient(app), table
+
+
+
+def test_paginate_table_counts_the_total(app):
+    client, _ = app
+    page = client.get("/posts/1/comments?page@=2&perPage@=4").json()
+    assert [comment["id"] for comment in page["items"]] == [9, 11]
+    assert (page["total"], page["nextPage"]) == (6, None)
+
+    page = client.get("/posts/0/comments?perPage@=4").json()
+    assert (page["total"], page["nextPage"]) == (6, 2)
+
+
+def test_paginate_has_no_total(app):
+    client, _ = app
+    page = client.get("/texts?page@=2").json()
+    assert page["items"] == ["t5", "t6"]
+    assert "total" not in page and page["nextPage"] is None
+
+
+def test_count_and_exists_arguments(app):
+    client, _ = app
+    assert client.get("/posts/0/count").json() == {"count": 6}
+    assert client.get("/posts/3/exists").json() == {"exists": False}
+    assert client.get("/posts/1/exists").json() == {"exists": True}
+
+
+def test_server_side_queries(app):
+    _, table = app
+    assert table.count({"post": "1"}) == 6
+    assert table.exists({"text": "c3"}) and not table.exists({"text": "x"})
+    assert sorted(table.distinct("post")) == ["0", "1"]
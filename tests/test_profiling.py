@@ -0,0 +1,36 @@
+import os
+from time import perf_counter
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from stelladdon import StellAppMaster
+
+
+
+def busy_work() -> None:
+    start = perf_counter()
+    while perf_counter() - start < 0.1:
+        pass
+
+
+
+def test_armed_sync_route_is_sampled_in_its_worker_thread(tmp_path):
+    app = FastAPI()
+    master = StellAppMaster(app)
+    master.enable_profiling(str(tmp_path), secret="secret")
+
+    @master.route("GET", "/work")
+    def work():
+        busy_work()
+        return {"ok": 1}
+
+    client = TestClient(app)
+    assert client.post("/_stella/profile?path=/work").status_code == 403
+    assert client.post("/_stella/profile?path=/work", headers={"X-Stella-Admin": "secret"}).json() == {"armed": {"/work": 1}}
+
+    assert client.get("/work").json() == {"ok": 1}
+    assert client.get("/work").json() == {"ok": 1}
+    files = os.listdir(tmp_path)
+    assert len(files) == 1
+    assert "handler;work (test_profiling.py" in (tmp_path / files[0]).read_text()
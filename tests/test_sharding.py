@@ -0,0 +1,117 @@
+import pytest
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, ShardedTable, HashSharding, RangeSharding, StelladdonError
+
+
+
+class Player(BaseModel):
+    id: int
+    name: str
+    score: int | None = None
+
+
+
+def score_of(id: int) -> int | None:
+    return (id * 7) % 11 if id % 5 else None
+
+
+@pytest.fixture
+def table() -> ShardedTable[Player]:
+    table = ShardedTable(Player, "players", "game", [StellaMongo(None) for _ in range(3)], "id")
+    # every shard is stored in memory, no database server is needed
+    table.enable_memory(offline=True)
+    for id in range(30):
+        table.insert(Player(id=id, name=f"p{id}", score=score_of(id)))
+    return table
+
+
+
+def test_hash_sharding_is_stable_and_spread():
+    sharding = HashSharding()
+    assert [sharding.shard_of(id, 3) for id in range(100)] == [sharding.shard_of(id, 3) for id in range(100)]
+    assert {sharding.shard_of(id, 3) for id in range(100)} == {0, 1, 2}
+
+
+def test_range_sharding():
+    sharding = RangeSharding([20, 10])
+    assert [sharding.shard_of(id, 3) for id in (0, 9, 10, 19, 20, 100)] == [0, 0, 1, 1, 2, 2]
+
+
+def test_objects_are_stored_on_their_shard(table):
+    assert sum(shard.count() for shard in table.shards) == 30
+    for id in range(30):
+        shard = table.shard_of(id)
+        assert shard.get(id) is not None
+        assert all(other.get(id) is None for other in table.shards if other is not shard)
+
+
+def test_single_object_operations(table):
+    assert table.get(4).name == "p4"
+    assert table.get(99) is None
+    assert [player and player.id for player in table.get_many([3, 99, 1, 3])] == [3, None, 1, 3]
+
+    table.update(3, {"$set": {"name": "renamed"}})
+    assert table.shard_of(3).get(3).name == "renamed"
+
+    table.remove(3)
+    assert table.get(3) is None
+    assert table.count() == 29
+
+
+def test_primary_key_queries_target_their_shards(table):
+    assert table.shards_of({"id": 4}) == [table.shard_of(4)]
+    assert table.shards_of({"id": {"$eq": 4}}) == [table.shard_of(4)]
+    assert set(map(id, table.shards_of({"id": {"$in": [1, 2]}}))) == {id(table.shard_of(1)), id(table.shard_of(2))}
+    assert table.shards_of({"id": {"$gt": 4}}) == table.shards
+    assert table.shards_of({"name": "p4"}) == table.shards
+
+
+def test_find_merges_sorted_shards(table):
+    sort = [("score", 1), ("id", -1)]
+    expected = sorted(range(30), key=lambda id: (score_of(id) is not None, score_of(id) or 0, -id))
+
+    assert [player.id for player in table.find({}, sort=sort)] == expected
+    assert [player.id for player in table.find({}, sort=sort, skip=2, limit=6)] == expected[2:8]
+    assert table.find_one({"score": {"$ne": None}}, sort=[("score", -1), ("id", 1)]).id == expected[-1]
+
+
+def test_combined_queries(table):
+    assert table.count() == 30
+    assert table.count({"score": None}) == 6
+    assert table.exists({"name": "p7"})
+    assert not table.exists({"name": "unknown"})
+    assert sorted(table.distinct("score"), key=str) == sorted({score_of(id) for id in range(30)}, key=str)
+
+    table.update_many({"score": None}, {"$set": {"score": 0}})
+    assert table.count({"score": 0}) == 6 + sum(1 for id in range(30) if score_of(id) == 0)
+
+    table.remove_many({"id": {"$lt": 10}})
+    assert table.count() == 20
+
+
+def test_find_columns_concatenates_the_shards(table):
+    result = table.find_columns({}, ["id", "name", "score"])
+    rows = sorted(zip(result["id"].to_list(), result["name"].to_list(), result["score"].to_list()))
+    assert rows == [(id, f"p{id}", score_of(id)) for id in range(30)]
+    assert result["name"].kind == "str" and len(set(result["name"].strings)) == 30
+
+    assert len(table.find_columns({"id": {"$gte": 10}}, ["id"], limit=5)) == 5
+
+
+def test_save_many_and_write_hooks(table):
+    written = []
+    table.write_hooks.append(lambda _, id: written.append(id))
+
+    players = table.find({"id": {"$in": [1, 2, 3, 4]}})
+    for player in players:
+        player.name = "saved"
+    table.save_many(players)
+
+    assert table.count({"name": "saved"}) == 4
+    assert sorted(written) == [1, 2, 3, 4]
+
+
+def test_sharded_table_has_no_single_collection(table):
+    with pytest.raises(StelladdonError):
+        table._collection
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import sys
+
+import pytest
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, Table, SharedObjectCache, StelladdonError
+
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="the shared cache needs POSIX file locks")
+
+
+
+class Player(BaseModel):
+    id: int
+    level: int
+
+
+
+def make_table(path: str) -> Table[Player]:
+    table = Table(Player, "players", StellaMongo(None).get_database("game"), "id")
+    table.use_shared_cache(SharedObjectCache(path, slots=64, slot_size=512))
+    return table
+
+
+def fail() -> dict:
+    raise AssertionError("the document should have been read from the shared cache")
+
+
+def read_then_write(path: str, id: int, results) -> None:
+    table = make_table(path)
+    results.put(table.shared_cache.fetch(table, id, fail))
+    table._notify_write(id)
+
+
+def write_many(path: str) -> None:
+    table = make_table(path)
+    table._notify_write(None)
+
+
+def run(target, *args) -> None:
+    process = multiprocessing.get_context("spawn").Process(target=target, args=args)
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+
+
+
+def test_write_in_other_process_invalidates(tmp_path):
+    path = str(tmp_path / "cache")
+    table = make_table(path)
+    cache = table.shared_cache
+
+    assert cache.fetch(table, 1, lambda: {"id": 1, "level": 1}) == {"id": 1, "level": 1}
+    assert cache.fetch(table, 1, fail) == {"id": 1, "level": 1}
+
+    results = multiprocessing.get_context("spawn").Queue()
+    run(read_then_write, path, 1, results)
+    assert results.get(timeout=5) == {"id": 1, "level": 1}
+
+    assert cache.fetch(table, 1, lambda: {"id": 1, "level": 2}) == {"id": 1, "level": 2}
+    assert cache.fetch(table, 1, fail) == {"id": 1, "level": 2}
+
+
+def test_bulk_write_in_other_process_invalidates_table(tmp_path):
+    path = str(tmp_path / "cache")
+    table = make_table(path)
+    cache = table.shared_cache
+    for id in range(3):
+        cache.fetch(table, id, lambda: {"id": id, "level": 1})
+
+    run(write_many, path)
+
+    for id in range(3):
+        assert cache.fetch(table, id, lambda: {"id": id, "level": 2}) == {"id": id, "level": 2}
+
+
+def test_document_loaded_before_a_write_is_not_stored(tmp_path):
+    path = str(tmp_path / "cache")
+    table = make_table(path)
+    cache = table.shared_cache
+
+    def load_while_written() -> dict:
+        run(write_many, path)
+        return {"id": 1, "level": 1}
+
+    assert cache.fetch(table, 1, load_while_written) == {"id": 1, "level": 1}
+    assert cache.fetch(table, 1, lambda: {"id": 1, "level": 2}) == {"id": 1, "level": 2}
+
+
+def test_default_file_is_named_per_app(tmp_path):
+    with pytest.raises(StelladdonError):
+        SharedObjectCache()
+    with pytest.raises(StelladdonError):
+        SharedObjectCache(name="../app")
+
+    first = SharedObjectCache(name=f"test-{tmp_path.name}-a", slots=8, slot_size=256)
+    second = SharedObjectCache(name=f"test-{tmp_path.name}-b", slots=8, slot_size=256)
+    try:
+        assert first.path != second.path
+    finally:
+        for cache in (first, second):
+            cache.close()
+            os.remove(cache.path)
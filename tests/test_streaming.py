@@ -0,0 +1,71 @@
+import asyncio
+from json import loads
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, StellAppMaster, Table
+
+
+
+class Item(BaseModel):
+    id: int
+    name: str
+
+
+
+@pytest.fixture
+def client() -> TestClient:
+    table = Table(Item, "items", StellaMongo(None).get_database("shop"), "id")
+    table.enable_memory(offline=True)
+    for id in range(300):
+        table.insert(Item(id=id, name=f"i{id}"))
+
+    app = FastAPI()
+    master = StellAppMaster(app)
+
+    @master.route("GET", "/items")
+    def items():
+        return table.iter_find({}, batch_size=50)
+
+    @master.route("GET", "/documents", stream="ndjson")
+    def documents():
+        # a raw cursor yields the documents with their ObjectId
+        return table._collection.find({}, limit=3)
+
+    @master.route("GET", "/generated")
+    async def generated():
+        async def generate():
+            for id in range(3):
+                await asyncio.sleep(0)
+                yield {"id": id, "ref": ObjectId("65f000000000000000000000")}
+        return generate()
+
+    return TestClient(app)
+
+
+
+def test_array_stream_is_complete(client):
+    response = client.get("/items")
+    assert response.headers["content-type"] == "application/json"
+    assert [item["id"] for item in response.json()] == list(range(300))
+
+
+def test_ndjson_stream_encodes_object_ids(client):
+    response = client.get("/documents")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [line for line in response.text.splitlines() if line]
+    assert len(lines) == 3
+    assert all(len(loads(line)["_id"]) == 24 for line in lines)
+
+
+def test_async_generator_stream(client):
+    assert client.get("/generated").json() == [{"id": id, "ref": "65f000000000000000000000"} for id in range(3)]
+
+
+def test_ndjson_on_request(client):
+    response = client.get("/items", headers={"Accept": "application/x-ndjson"})
+    assert len(response.text.splitlines()) == 300
@@ -0,0 +1,68 @@
+import pytest
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, Table, ConcurrentModification
+
+
+
+class Task(BaseModel):
+    id: int
+    title: str
+    done: bool = False
+    version: int = 0
+
+
+
+@pytest.fixture
+def table() -> Table[Task]:
+    table = Table(Task, "tasks", StellaMongo(None).get_database("todo"), "id")
+    table.enable_memory(offline=True)
+    for id in range(4):
+        table.insert(Task(id=id, title=f"t{id}"))
+    table.enable_change_tracking("version")
+    return table
+
+
+
+def test_save_many_sends_the_changes(table):
+    tasks = table.find({})
+    tasks[0].done = True
+    tasks[2].title = "renamed"
+    table.save_many(tasks)
+
+    assert [(task.title, task.done, task.version) for task in table.find({})] == [
+        ("t0", True, 1), ("t1", False, 0), ("renamed", False, 1), ("t3", False, 0)]
+    # the saved objects are tracked again from their new state
+    tasks[0].title = "again"
+    table.save_many(tasks)
+    assert table.get(0).version == 2
+
+
+def test_save_many_reports_only_the_conflicts(table):
+    first, second = table.get(1), table.get(2)
+    concurrent = table.get(2)
+    concurrent.title = "concurrent"
+    table.save(concurrent)
+
+    first.done = True
+    second.done = True
+    with pytest.raises(ConcurrentModification) as error:
+        table.save_many([first, second])
+    assert "[2]" in str(error.value)
+    assert table.get(1).done and table.get(1).version == 1
+    assert table.get(2).title == "concurrent" and not table.get(2).done
+
+
+def test_save_many_with_untracked_objects(table):
+    # the version is only stored in the database, the objects built by the caller don't have it
+    table.enable_change_tracking("revision")
+    stale = table.get(3)
+    table.update(3, {"$set": {"title": "changed"}, "$inc": {"revision": 1}})
+    stale.done = True
+
+    rebuilt = Task(id=0, title="rebuilt")
+    with pytest.raises(ConcurrentModification) as error:
+        table.save_many([rebuilt, stale])
+    assert "[3]" in str(error.value)
+    assert table.get(0).title == "rebuilt"
+    assert table.get(3).title == "changed" and not table.get(3).done
@@ -0,0 +1,62 @@
+import pytest
+from pydantic import BaseModel
+
+from stelladdon import StellaMongo, Table
+
+
+
+class Counter(BaseModel):
+    id: int
+    hits: int = 0
+    best: int = 0
+    meta: dict = {}
+
+
+
+@pytest.fixture
+def table() -> Table[Counter]:
+    table = Table(Counter, "counters", StellaMongo(None).get_database("stats"), "id")
+    table.enable_memory(offline=True)
+    for id in range(3):
+        table.insert(Counter(id=id))
+    table.enable_write_behind(max_size=2, max_delay=60)
+    yield table
+    table.disable_write_behind()
+
+
+
+def test_updates_are_merged(table):
+    buffer = table.write_behind
+    for _ in range(10):
+        table.update(0, {"$inc": {"hits": 1}, "$max": {"best": 4}})
+    table.update(0, {"$max": {"best": 2}, "$set": {"meta.source": "a"}})
+    assert len(buffer) == 1 and table.get(0).hits == 0
+
+    table.flush()
+    counter = table.get(0)
+    assert (counter.hits, counter.best, counter.meta) == (10, 4, {"source": "a"})
+    assert (buffer.stats.flushes, buffer.stats.flushed_writes, buffer.stats.merged_writes) == (1, 1, 10)
+
+
+def test_conflicting_updates_flush_first(table):
+    buffer = table.write_behind
+    table.update(1, {"$set": {"meta.source": "a"}})
+    table.update(1, {"$set": {"meta": {"kind": "b"}}})
+    table.update(1, {"$inc": {"hits": 1}})
+    table.update(1, {"$set": {"hits": 5}})
+    assert buffer.stats.flushes == 2
+
+    table.flush()
+    counter = table.get(1)
+    assert (counter.hits, counter.meta) == (5, {"kind": "b"})
+
+
+def test_full_buffer_and_unbuffered_updates_flush(table):
+    buffer = table.write_behind
+    table.update(0, {"$inc": {"hits": 1}})
+    table.update(1, {"$inc": {"hits": 1}})
+    assert len(buffer) == 0 and table.get(1).hits == 1
+
+    table.update(2, {"$inc": {"hits": 1}})
+    table.update(2, {"$unset": {"meta": ""}})
+    assert len(buffer) == 0 and table.get(2).hits == 1